@@ -37,11 +37,14 @@
 from common import *
 
 from tracks.api import *
+from tracks.core import dump_track, Track, MultiTracksReader
 
-import unittest, numpy
+from molmod.unit_cells import UnitCell
 
+import unittest, numpy, os
 
-__all__ = ["ACTestCase", "PCATestCase"]
+
+__all__ = ["ACTestCase", "PCATestCase", "DatabaseTestCase", "RDFTestCase"]
 
 
 class ACTestCase(BaseTestCase):
@@ -57,6 +60,60 @@ class ACTestCase(BaseTestCase):
         self.assert_(abs(mean - 0.3) < 0.1)
         self.assert_(error < 0.15)
 
+    def test_ac_window_fft(self):
+        signals = numpy.random.normal(0, 1, (1000, 3)).cumsum(axis=0)
+        for max_delta_steps in 0, 1, 300, 999:
+            ac = compute_ac_window_fft(signals, max_delta_steps)
+            self.assertEqual(ac.shape, (max_delta_steps+1, 3))
+            for i in xrange(3):
+                f = signals[:,i]
+                expected = numpy.correlate(f, f[:1000-max_delta_steps], 'valid')/(1000-max_delta_steps)
+                self.assertArraysAlmostEqual(ac[:,i], expected, 1e-8)
+        self.assertRaises(ValueError, compute_ac_window_fft, signals, 1000)
+
+    def test_multiple_tau(self):
+        signals = numpy.random.normal(0, 1, (3000, 3)).cumsum(axis=0) + 3
+        correlator = MultipleTauCorrelator(3, 8, 2, 6)
+        first = 0
+        for size in 1, 5, 100, 1000, 1894:
+            correlator.add_data(signals[first:first+size])
+            first += size
+        lags = correlator.get_lags()
+        self.assertArraysEqual(lags[:12], numpy.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14]))
+        self.assertEqual(lags[-1], 7*2**5)
+        ac = correlator.get_ac()
+        msd = correlator.get_msd()
+        mean = signals.mean(axis=0)
+        for i, lag in enumerate(lags):
+            # the lags 4*2**level, ..., 7*2**level are computed with averages
+            # of blocks of 2**level time steps
+            if lag < 8:
+                size = 1
+            else:
+                size = 2**int(numpy.log2(lag/4.0))
+            averaged = signals[:len(signals)/size*size].reshape(-1, size, 3).mean(axis=1)
+            early = averaged[:len(averaged)-lag/size]
+            late = averaged[lag/size:]
+            self.assertArraysAlmostEqual(ac[i], ((early - mean)*(late - mean)).mean(axis=0), 1e-8, do_abs=True)
+            self.assertArraysAlmostEqual(msd[i], ((late - early)**2).mean(axis=0), 1e-8, do_abs=True)
+
+    def test_multiple_tau_empty(self):
+        for filename in "a", "b":
+            dump_track(filename, numpy.zeros(0, float))
+        mtr = MultiTracksReader(["a", "b"], numpy.dtype([("data", float, 2)]))
+        correlator = multiple_tau(mtr)
+        self.assertEqual(correlator.num_columns, 2)
+        self.assertEqual(len(correlator.get_lags()), 0)
+        self.assertEqual(correlator.get_ac().shape, (0, 2))
+        self.assertEqual(correlator.get_msd().shape, (0, 2))
+
+    def test_num_levels(self):
+        self.assertEqual(get_num_levels(0, 8, 2), 1)
+        self.assertEqual(get_num_levels(7*2**5, 8, 2), 6)
+        self.assertEqual(get_num_levels(7*2**5 + 1, 8, 2), 7)
+        self.assertEqual(get_num_levels(100), 4)
+        self.assertEqual(get_num_levels(100, 12, 3), 4)
+
 
 class PCATestCase(BaseTestCase):
     def check_sanity(self, overlap_fn, num):
@@ -92,3 +149,73 @@ class PCATestCase(BaseTestCase):
         self.check_sanity(cov_overlap_multi, 3)
 
 
+class DatabaseTestCase(BaseTestCase):
+    def test_atoms(self):
+        pos = numpy.random.normal(0, 1, (100, 5, 3))
+        os.mkdir("tracks")
+        for i in xrange(5):
+            for j, c in enumerate("xyz"):
+                dump_track("tracks/atom.pos.%07i.%s" % (i, c), pos[:,i,j])
+        dump_track("tracks/time", numpy.arange(100)*0.5)
+
+        db = TrackDatabase("tracks", block_size=16)
+        self.assertEqual(db.pos.shape, (100, 5, 3))
+        self.assertArraysEqual(db.pos[:], pos)
+        self.assertArraysEqual(db.pos[10:87:3, [0,3], :], pos[10:87:3, [0,3], :])
+        self.assertArraysEqual(db.pos[20:30, 4], pos[20:30, 4])
+        self.assertArraysEqual(db.pos[-1], pos[-1])
+        self.assertArraysEqual(db.pos[[5,50,7], 1:3, 2], pos[[5,50,7], 1:3, 2])
+        self.assertArraysEqual(db.pos[::-1, 2], pos[::-1, 2])
+        self.assertArraysEqual(db.time[3:9], numpy.arange(3,9)*0.5)
+        # a single track is returned as a view on the file
+        view = db.pos[5:60, 2, 1]
+        self.assert_(isinstance(view, numpy.memmap))
+        self.assertArraysEqual(view, pos[5:60, 2, 1])
+        # a sparse selection of frames only reads the blocks it needs
+        db.cache.clear()
+        self.assertArraysEqual(db.pos[[95, 3, 2, 95], 0], pos[[95, 3, 2, 95], 0])
+        filename = db.get_filename("atom.pos.0000000.x")
+        self.assert_((filename, 0, 100) in db.cache)
+        self.assert_((filename, 3, 100) not in db.cache)
+        self.assert_((filename, 5, 100) in db.cache)
+        # the cached blocks at the end are not reused when the tracks grow
+        extra = numpy.random.normal(0, 1, (10, 5, 3))
+        for i in xrange(5):
+            for j, c in enumerate("xyz"):
+                Track("tracks/atom.pos.%07i.%s" % (i, c)).append(extra[:,i,j])
+        self.assertArraysEqual(db.pos[90:110, 0], numpy.concatenate([pos, extra])[90:110, 0])
+
+    def test_cache(self):
+        cache = BlockCache(1000)
+        cache["a"] = numpy.zeros(50)
+        cache["b"] = numpy.zeros(50)
+        cache["a"]
+        cache["c"] = numpy.zeros(50)
+        self.assert_("a" in cache)
+        self.assert_("b" not in cache)
+        self.assert_("c" in cache)
+        self.assert_(cache.size <= 1000)
+
+
+class RDFTestCase(BaseTestCase):
+    def test_pair_histograms(self):
+        coordinates = numpy.random.uniform(-10, 10, (5, 8, 3))
+        first, second = numpy.tril_indices(8, -1)
+        unit_cells = [
+            UnitCell(numpy.array([[7, 0, 0], [1, 8, 0], [-1, 2, 6]], float)*numpy.random.uniform(0.9, 1.1))
+            for i in xrange(5)
+        ]
+        rmax = 9.0
+        # a buffer_size that only fits a few pairs at a time
+        histograms = compute_pair_histograms(coordinates, first, second, unit_cells, rmax, 20, 10000)
+        self.assertEqual(histograms.shape, (5, 20))
+        for frame in xrange(5):
+            uc = unit_cells[frame]
+            distances = []
+            for i, j in zip(first, second):
+                delta = uc.shortest_vector(coordinates[frame, i] - coordinates[frame, j])
+                for n in uc.get_radius_indexes(rmax):
+                    distances.append(numpy.linalg.norm(delta + numpy.dot(uc.matrix, n)))
+            distances = numpy.array(distances)
+            expected = numpy.histogram(distances[distances < rmax], 20, (0, rmax))[0]
+            self.assertArraysEqual(histograms[frame], expected)
@@ -37,23 +37,32 @@ from common import *
 
 from tracks.core import load_track, dump_track
 from tracks.parse import parse_slice
+from tracks.convert import get_frame_offsets, dlpoly_history_to_tracks, npy_to_tracks
+from tracks.core import Error
+from tracks import context
 import tracks.api.vector as vector
 import tracks.api.cell as cell
+from tracks.api import compute_msd_fft
 
 from molmod.io.psf import PSFFile
 from molmod.io.xyz import XYZReader, XYZFile
+from molmod.io.gromacs import GroReader
+from molmod.io.dlpoly import DLPolyHistoryReader
 from molmod.units import angstrom, nanometer, femtosecond, picosecond, kcalmol, \
-    bar
+    bar, deg, kjmol
 from molmod.constants import lightspeed, boltzmann
 from molmod.periodic import periodic
 
-import numpy, os, glob, shutil
+import numpy, os, glob, shutil, gzip, bz2, struct
 
 
 __all__ = ["CommandsTestCase"]
 
 
 class CommandsTestCase(BaseTestCase):
+    # the commands do not write frame offsets next to the files in test/input
+    cache_offsets = False
+
     def from_xyz(self, case, middle_word, extra_args=[]):
         self.execute("tr-from-xyz", [
             os.path.join(input_dir, case, "md-%s-1.xyz" % middle_word),
@@ -76,6 +85,7 @@ class CommandsTestCase(BaseTestCase):
         if lib_dir is not None:
             env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
         env['DISPLAY'] = os.getenv('DISPLAY')
+        env['TRACKS_CACHE_OFFSETS'] = str(int(self.cache_offsets))
         p = Popen(
             ["/usr/bin/env", "python", os.path.join(scripts_dir, command)] + args,
             stdin=PIPE, stdout=PIPE, stderr=PIPE, env=env,
@@ -154,6 +164,153 @@ class CommandsTestCase(BaseTestCase):
         self.assertAlmostEqual(tmp[1]/angstrom, 0.4181952123, 5)
         self.assertAlmostEqual(tmp[-1]/angstrom, -1.7859607480, 5)
 
+    def test_from_xyz_index(self):
+        self.cache_offsets = True
+        shutil.copy(os.path.join(input_dir, "thf01/md-pos-1.xyz"), "test.xyz")
+        ref = numpy.array([coordinates for title, coordinates in XYZReader("test.xyz")])
+        self.execute("tr-from-xyz", ["-s20:601:5", "-a1,3,5", "test.xyz", "pos"])
+        self.assert_(os.path.isfile("test.xyz.offsets"))
+        cached = load_track("test.xyz.offsets")
+        lines_per_frame = ref.shape[1] + 2
+        self.assertEqual(cached[0], lines_per_frame)
+        self.assertEqual(cached[1], os.path.getsize("test.xyz"))
+        offsets = cached[3:]
+        self.assertEqual(len(offsets), len(ref)+1)
+        self.assertEqual(offsets[-1], os.path.getsize("test.xyz"))
+        # the cache is not reused for another number of lines per frame
+        self.assertEqual(len(get_frame_offsets("test.xyz", 2*lines_per_frame)), len(ref)/2+1)
+        self.assertEqual(load_track("test.xyz.offsets")[0], 2*lines_per_frame)
+        self.assertArraysEqual(get_frame_offsets("test.xyz", lines_per_frame), offsets)
+        # a file that is modified without changing its size is scanned again
+        f = file("test.xyz", "r+")
+        f.seek(offsets[1] + 10)
+        f.write("\n")
+        f.close()
+        os.utime("test.xyz", (0, 0))
+        modified = get_frame_offsets("test.xyz", lines_per_frame)
+        self.assert_(modified[2] < offsets[2])
+        context.cache_frame_offsets = False
+        try:
+            self.assertArraysEqual(get_frame_offsets("test.xyz", lines_per_frame), modified)
+        finally:
+            context.cache_frame_offsets = True
+        shutil.copy(os.path.join(input_dir, "thf01/md-pos-1.xyz"), "test.xyz")
+        self.assertArraysEqual(get_frame_offsets("test.xyz", lines_per_frame), offsets)
+        self.assertArraysEqual(load_track("tracks/atom.pos.0000003.y"), ref[20:601:5,3,1])
+        # append the first two frames, plus an incomplete third frame
+        f = file("test.xyz")
+        data = f.read()
+        f.close()
+        f = file("test.xyz", "a")
+        f.write(data[:offsets[2]+100])
+        f.close()
+        self.execute("tr-from-xyz", ["-s1000:", "test.xyz", "pos"])
+        self.assertEqual(len(load_track("test.xyz.offsets")), 3+len(ref)+3)
+        self.assertArraysEqual(load_track("tracks/atom.pos.0000012.z"), ref[[1000,0,1],12,2])
+
+    def test_from_xyz_jobs(self):
+        # the parallel conversion must give exactly the same tracks
+        xyz_filename = os.path.join(input_dir, "thf01/md-pos-1.xyz")
+        self.execute("tr-from-xyz", ["-s3::2", xyz_filename, "pos", "serial"])
+        self.execute("tr-from-xyz", ["-s3::2", "-j3", xyz_filename, "pos", "parallel"])
+        for name in "atom.pos.0000000.x", "atom.pos.0000007.y", "atom.pos.0000012.z":
+            self.assertEqual(file("serial/%s" % name).read(), file("parallel/%s" % name).read())
+        # append to existing tracks with a pyramid
+        self.execute("tr-pyramid", ["--min-size=10", "parallel/atom.pos.0000007.y"])
+        self.execute("tr-from-xyz", ["-s:50", "-j2", "--append", xyz_filename, "pos", "parallel"])
+        self.execute("tr-from-xyz", ["-s:50", xyz_filename, "pos", "first"])
+        pos = load_track("parallel/atom.pos.0000007.y")
+        self.assertArraysEqual(pos, numpy.concatenate([load_track("serial/atom.pos.0000007.y"), load_track("first/atom.pos.0000007.y")]))
+        self.assertEqual(len(load_track("parallel/atom.pos.0000007.y.pyramid.01.mean")), len(pos)/2)
+
+    def test_from_compressed(self):
+        # compressed files must give exactly the same tracks
+        xyz_filename = os.path.join(input_dir, "thf01/md-pos-1.xyz")
+        data = file(xyz_filename).read()
+        half = len(data)/2
+        file("pos.xyz.bz2", "w").write(bz2.compress(data[:half]) + bz2.compress(data[half:]))
+        gz = gzip.GzipFile("pos.xyz.gz", "w")
+        gz.write(data)
+        gz.close()
+        self.execute("tr-from-xyz", ["-s3::2", xyz_filename, "pos", "plain"])
+        for suffix in "bz2", "gz":
+            self.execute("tr-from-xyz", ["-s3::2", "-j2", "pos.xyz.%s" % suffix, "pos", suffix])
+            for name in "atom.pos.0000000.x", "atom.pos.0000012.z":
+                self.assertEqual(file("plain/%s" % name).read(), file("%s/%s" % (suffix, name)).read())
+        gz = gzip.GzipFile("md-1.ener.gz", "w")
+        gz.write(file(os.path.join(input_dir, "thf01/md-1.ener")).read())
+        gz.close()
+        self.from_cp2k_ener("thf01", ["-s10:500:3"])
+        self.execute("tr-from-cp2k-ener", ["-s10:500:3", "md-1.ener.gz", "compressed"])
+        self.assertArraysEqual(load_track("tracks/temperature"), load_track("compressed/temperature"))
+
+    def test_from_xyz_follow(self):
+        # convert a growing file in three steps, cut in the middle of a frame
+        xyz_filename = os.path.join(input_dir, "thf01/md-pos-1.xyz")
+        data = file(xyz_filename).read()
+        self.execute("tr-from-xyz", ["-s3::2", xyz_filename, "pos", "plain"])
+        for end in len(data)/3, len(data)/3 + 10, 2*len(data)/3, len(data):
+            file("pos.xyz", "w").write(data[:end])
+            self.execute("tr-from-xyz", ["-s3::2", "--follow", "pos.xyz", "pos", "follow"])
+        for name in "atom.pos.0000000.x", "atom.pos.0000012.z":
+            self.assertEqual(file("plain/%s" % name).read(), file("follow/%s" % name).read())
+        # the same for a table, cut in the middle of a line
+        ener_filename = os.path.join(input_dir, "thf01/md-1.ener")
+        data = file(ener_filename).read()
+        self.from_cp2k_ener("thf01", ["-s1::3"])
+        for end in 1000, 1001, 5000, len(data):
+            file("md-1.ener", "w").write(data[:end])
+            self.execute("tr-from-cp2k-ener", ["-s1::3", "--follow", "md-1.ener", "follow"])
+        self.assertArraysEqual(load_track("tracks/temperature"), load_track("follow/temperature"))
+        # after a modification of the tracks, the conversion starts again
+        self.execute("tr-from-cp2k-ener", ["-s:3", "--append", "md-1.ener", "follow"])
+        self.execute("tr-from-cp2k-ener", ["-s1::3", "--follow", "md-1.ener", "follow"])
+        self.assertArraysEqual(load_track("tracks/step"), load_track("follow/step"))
+
+    def test_from_xyz_segments(self):
+        # three restart segments that repeat some of the frames
+        lines = file(os.path.join(input_dir, "thf01/md-pos-1.xyz")).readlines()
+        for name, first, last in ("run-1.xyz", 0, 601), ("run-2.xyz", 500, 800), ("run-3.xyz", 790, 1001):
+            file(name, "w").writelines(lines[first*15:last*15])
+        segments = ["run-1.xyz", "--segment", "run-2.xyz", "--segment", "run-3.xyz"]
+        self.execute("tr-from-xyz", segments + ["pos", "segments"])
+        self.execute("tr-from-xyz", ["-j2", "-s3::4"] + segments + ["pos", "segments_jobs"])
+        self.from_xyz("thf01", "pos")
+        for name in "atom.pos.0000000.x", "atom.pos.0000012.z":
+            self.assertEqual(file("tracks/%s" % name).read(), file("segments/%s" % name).read())
+            self.assertArraysEqual(load_track("tracks/%s" % name)[3::4], load_track("segments_jobs/%s" % name))
+        # a comma in a filename does not split it into segments
+        shutil.copy("run-1.xyz", "run,1.xyz")
+        self.execute("tr-from-xyz", ["run,1.xyz", "pos", "comma"])
+        self.assertArraysEqual(load_track("comma/atom.pos.0000012.z"), load_track("tracks/atom.pos.0000012.z")[:601])
+
+    def test_from_xyz_filter_atoms(self):
+        # only the lines of the selected atoms are read, also when the titles
+        # have a different length, and a frame with another layout is parsed
+        lines = file(os.path.join(input_dir, "thf01/md-pos-1.xyz")).readlines()
+        for i in xrange(0, len(lines), 15):
+            lines[i+1] = "frame %i\n" % (i/15)
+        lines[20*15+6] = lines[20*15+6][:-1] + "  \n"
+        file("test.xyz", "w").writelines(lines)
+        self.execute("tr-from-xyz", ["test.xyz", "pos"])
+        self.execute("tr-from-xyz", ["-a", "12,4,5", "-s2::3", "test.xyz", "pos", "filtered"])
+        self.execute("tr-from-xyz", ["-a", "12,5", "test.xyz", "pos", "after"])
+        for index in 4, 5, 12:
+            for c in "xyz":
+                name = "atom.pos.%07i.%s" % (index, c)
+                self.assertArraysEqual(load_track("tracks/%s" % name)[2::3], load_track("filtered/%s" % name))
+                if index != 4:
+                    self.assertArraysEqual(load_track("tracks/%s" % name), load_track("after/%s" % name))
+        self.assertEqual(len(glob.glob("filtered/*")), 9)
+        self.assertEqual(len(glob.glob("after/*")), 6)
+
+    def test_from_xyz_quantized(self):
+        self.from_xyz("thf01", "pos")
+        x1 = load_track("tracks/atom.pos.0000005.y")
+        self.from_xyz("thf01", "pos", ["--max-error=1e-4*angstrom", "-a5"])
+        x2 = load_track("tracks/atom.pos.0000005.y")
+        self.assertArrayAlmostZero(x1 - x2, 1e-4*angstrom)
+
     def test_from_cp2k_ener(self):
         # Load the energy file
         self.from_cp2k_ener("thf01")
@@ -237,6 +394,31 @@ class CommandsTestCase(BaseTestCase):
         self.assertAlmostEqual(tmp[118], 0.045686571, 5)
         self.assertAlmostEqual(tmp[-1], 0.045663267, 5)
 
+    def test_from_cp2k_ener_stages(self):
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        lines = file(os.path.join(input_dir, "thf01/md-1.ener")).readlines()
+        file("md-1.ener", "w").writelines(lines)
+        # the time spent in the stages of the conversion is printed
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-from-cp2k-ener"), "md-1.ener"],
+            stdout=PIPE, stderr=PIPE, env=env,
+        )
+        error = p.communicate()[1]
+        self.assertEqual(p.returncode, 0)
+        self.assert_("Time spent in the stages of the conversion: reading" in error)
+        self.assertEqual(len(load_track("tracks/step")), len(lines) - 1)
+        # an error in the parser thread stops the conversion
+        lines[-10] = "corrupt\n"
+        file("md-1.ener", "w").writelines(lines)
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-from-cp2k-ener"), "md-1.ener"],
+            stdout=PIPE, stderr=PIPE, env=env,
+        )
+        error = p.communicate()[1]
+        self.assertNotEqual(p.returncode, 0)
+        self.assert_("Could not read 6 numbers from each line." in error)
+
     def test_from_cp2k_cell(self):
         # Load the energy file
         self.execute("tr-from-cp2k-cell", [os.path.join(input_dir, "thf64/md-1.cell")])
@@ -257,6 +439,21 @@ class CommandsTestCase(BaseTestCase):
         self.assertAlmostEqual(tmp[1]/angstrom**3, 8612.3101980259)
         self.assertAlmostEqual(tmp[-1]/angstrom**3, 8530.7692124516)
 
+    def test_from_cp2k_cell_blocks(self):
+        # comments and empty lines do not count for the slice
+        self.execute("tr-from-cp2k-cell", [os.path.join(input_dir, "thf64/md-1.cell")])
+        f = file(os.path.join(input_dir, "thf64/md-1.cell"))
+        lines = f.readlines()
+        f.close()
+        lines.insert(7, "# restart\n")
+        lines.insert(12, "\n")
+        f = file("test.cell", "w")
+        f.writelines(lines)
+        f.close()
+        self.execute("tr-from-cp2k-cell", ["-s2::3", "test.cell", "sliced"])
+        for name in "step", "cell.b.z", "volume", "cell.c", "cell.gamma":
+            self.assertArraysEqual(load_track("sliced/%s" % name), load_track("tracks/%s" % name)[2::3])
+
     def test_from_cp2k_stress(self):
         # Load the energy file
         self.execute("tr-from-cp2k-stress", [os.path.join(input_dir, "thf64/md-1.stress")])
@@ -356,6 +553,11 @@ class CommandsTestCase(BaseTestCase):
         self.assertArraysAlmostEqual(cor, numpy.array([8.354914, 9.159180])*angstrom, 1e-5)
         cor = load_track("tracks/atom.pos.0001292.z")
         self.assertArraysAlmostEqual(cor, numpy.array([0.622863, -0.250132])*angstrom, 1e-5)
+        # only the lines of the selected atoms are read
+        self.execute("tr-from-atrj", [os.path.join(input_dir, "bartek.atrj"), "--slice=::2", "-a", "27,0", "filtered"])
+        for name in "time", "step", "total_energy", "atom.pos.0000000.x", "atom.pos.0000027.y":
+            self.assertArraysEqual(load_track("tracks/%s" % name), load_track("filtered/%s" % name))
+        self.assertEqual(len(glob.glob("filtered/atom.*")), 6)
 
     def test_from_dlpoly_hist(self):
         self.execute("tr-from-dlpoly-hist", [os.path.join(input_dir, "dlpoly_uo", "HISTORY")])
@@ -365,6 +567,60 @@ class CommandsTestCase(BaseTestCase):
         # test will be extended once we know for sure that our assumptions for
         # the units in the dl_poly file are correct.
 
+    def test_from_dlpoly_hist_blocks(self):
+        # a small history file with forces in exponential notation
+        numpy.random.seed(3)
+        f = file("HISTORY", "w")
+        print >> f, "test history file"
+        print >> f, "%10i%10i%10i" % (2, 3, 5)
+        for step in xrange(100, 220, 10):
+            print >> f, "timestep%10i%10i%10i%10i%12.6f" % (step, 5, 2, 3, 0.001)
+            for i in xrange(3):
+                print >> f, "%12.4f%12.4f%12.4f" % tuple(numpy.random.normal(0, 1, 3) + 10*(numpy.arange(3) == i))
+            for i in xrange(5):
+                print >> f, "%-8s%10i%12.6f%12.6f" % ("O", i+1, 15.9994, -0.8)
+                for j in xrange(3):
+                    print >> f, "%12.4e%12.4e%12.4e" % tuple(numpy.random.normal(0, 10, 3))
+        f.close()
+        # the frames are counted from one, as in the molmod reader
+        frames = list(DLPolyHistoryReader("HISTORY", slice(1, None, 4)))
+        self.assertEqual(frames[0]["step"], 100)
+        self.execute("tr-from-dlpoly-hist", ["-s1::4", "HISTORY"])
+        self.assertArraysEqual(load_track("tracks/step"), numpy.array([frame["step"] for frame in frames]))
+        self.assertArraysEqual(load_track("tracks/time"), numpy.array([frame["time"] for frame in frames]))
+        for s in slice(0, None, 3), slice(2, 9, 2), slice(5, 6):
+            self.execute("tr-from-dlpoly-hist", ["-s%s:%s:%s" % (s.start or "", s.stop or "", s.step or ""), "HISTORY", "sliced"])
+            steps = [frame["step"] for frame in DLPolyHistoryReader("HISTORY", s)]
+            self.assertArraysEqual(load_track("sliced/step"), numpy.array(steps, int))
+        self.assertArraysEqual(load_track("tracks/cell.b.z"), numpy.array([frame["cell"][1,2] for frame in frames]))
+        for name in "pos", "vel", "frc":
+            self.assertArraysEqual(load_track("tracks/atom.%s.0000003.y" % name), numpy.array([frame[name][3,1] for frame in frames]))
+        a = numpy.array([frame["cell"][:,0] for frame in frames])
+        b = numpy.array([frame["cell"][:,1] for frame in frames])
+        gamma = numpy.arccos((a*b).sum(axis=1)/numpy.sqrt((a*a).sum(axis=1)*(b*b).sum(axis=1)))
+        self.assertArraysAlmostEqual(load_track("tracks/cell.gamma"), gamma, 1e-10)
+        # the header is also read from a compressed file
+        file("HISTORY.bz2", "w").write(bz2.compress(file("HISTORY").read()))
+        self.execute("tr-from-dlpoly-hist", ["-s1::4", "HISTORY.bz2", "compressed"])
+        for name in "step", "cell.b.z", "atom.frc.0000003.y":
+            self.assertArraysEqual(load_track("tracks/%s" % name), load_track("compressed/%s" % name))
+        # a restart segment without header that repeats the steps 160 and 170
+        lines = file("HISTORY").readlines()
+        file("HISTORY.1", "w").writelines(lines[:2+8*24])
+        file("HISTORY.2", "w").writelines(lines[2+6*24:])
+        self.execute("tr-from-dlpoly-hist", ["-s1::4", "HISTORY.1", "--segment", "HISTORY.2", "segments"])
+        for name in "step", "cell.b.z", "atom.frc.0000003.y":
+            self.assertArraysEqual(load_track("tracks/%s" % name), load_track("segments/%s" % name))
+        # only the lines of the selected atoms are read
+        self.execute("tr-from-dlpoly-hist", ["-s1::4", "-a", "3,1", "HISTORY", "filtered"])
+        for name in "step", "cell.b.z", "atom.pos.0000001.x", "atom.vel.0000003.y", "atom.frc.0000003.z":
+            self.assertArraysEqual(load_track("tracks/%s" % name), load_track("filtered/%s" % name))
+        self.assertEqual(len(glob.glob("filtered/atom.*")), 18)
+        # imcon must be the same in all frames
+        lines[2+5*24] = lines[2+5*24].replace("%10i%10i%12.6f" % (2, 3, 0.001), "%10i%10i%12.6f" % (2, 2, 0.001))
+        file("HISTORY", "w").writelines(lines)
+        self.assertRaises(Error, dlpoly_history_to_tracks, "HISTORY", "imcon")
+
     def test_from_dlpoly_output(self):
         self.execute("tr-from-dlpoly-output", [os.path.join(input_dir, "dlpoly_uo", "OUTPUT")])
         step = load_track("tracks/step")
@@ -389,6 +645,78 @@ class CommandsTestCase(BaseTestCase):
         self.assertAlmostEqual(vel5y[5]/(angstrom/femtosecond), 0.00913911)
         self.assertAlmostEqual(vel5y[-1]/(angstrom/femtosecond), 0.00252762)
 
+    def test_from_lammps_dump_sorted(self):
+        # shuffle the atoms in each frame and label the columns
+        f = file(os.path.join(input_dir, "lammps2", "dump.txt"))
+        lines = f.readlines()
+        f.close()
+        num_atoms = int(lines[3])
+        f = file("dump.txt", "w")
+        for begin in xrange(0, len(lines), num_atoms+9):
+            lines[begin+8] = "ITEM: ATOMS id x y z vx vy vz\n"
+            atom_lines = lines[begin+9:begin+9+num_atoms]
+            numpy.random.shuffle(atom_lines)
+            f.writelines(lines[begin:begin+9] + atom_lines)
+        f.close()
+        self.execute("tr-from-lammps-dump", ["-s1::3", "dump.txt", "A", "pos3", "A/fs", "vel3", "sorted"])
+        self.execute("tr-from-lammps-dump", ["-s1::3", os.path.join(input_dir, "lammps2", "dump.txt"), "A", "pos3", "A/fs", "vel3"])
+        for name in "step", "atom.pos.0000003.z", "atom.vel.0000025.x":
+            self.assertArraysEqual(load_track("sorted/%s" % name), load_track("tracks/%s" % name))
+
+    def test_from_lammps_dump_segments(self):
+        # two restart segments that both contain the steps 20 to 29
+        f = file(os.path.join(input_dir, "lammps2", "dump.txt"))
+        lines = f.readlines()
+        f.close()
+        lines_per_frame = int(lines[3]) + 9
+        for name, first, last in ("run-1.dump", 0, 30), ("run-2.dump", 20, 46):
+            f = file(name, "w")
+            f.writelines(lines[first*lines_per_frame:last*lines_per_frame])
+            f.close()
+        self.execute("tr-from-lammps-dump", ["run-1.dump", "--segment", "run-2.dump", "A", "pos3", "segments"])
+        self.execute("tr-from-lammps-dump", [os.path.join(input_dir, "lammps2", "dump.txt"), "A", "pos3"])
+        self.assertArraysEqual(load_track("segments/step"), numpy.arange(46))
+        self.assertArraysEqual(load_track("segments/atom.pos.0000003.z"), load_track("tracks/atom.pos.0000003.z"))
+
+    def write_dcd(self, filename, pos, cells=None, order="<"):
+        # write a small DCD file in the CHARMM format
+        def record(data):
+            marker = struct.pack(order + "i", len(data))
+            return marker + data + marker
+        icntrl = [len(pos), 100, 10, 10*len(pos)] + [0]*16
+        icntrl[10] = cells is not None
+        icntrl[19] = 24
+        f = file(filename, "wb")
+        f.write(record("CORD" + struct.pack(order + "9if10i", *(icntrl[:9] + [0.04] + icntrl[10:]))))
+        f.write(record(struct.pack(order + "i", 1) + "test".ljust(80)))
+        f.write(record(struct.pack(order + "i", pos.shape[1])))
+        for i in xrange(len(pos)):
+            if cells is not None:
+                f.write(record(numpy.array(cells[i], order + "f8").tostring()))
+            for j in xrange(3):
+                f.write(record(numpy.array(pos[i,:,j], order + "f4").tostring()))
+        f.close()
+
+    def test_from_dcd(self):
+        numpy.random.seed(1)
+        pos = numpy.random.normal(0, 10, (12, 5, 3)).astype(numpy.float32)
+        cells = numpy.array([[10.0, 90.0, 11.0, 80.0, 70.0, 12.0]]*12)
+        # recent CHARMM versions write the cosines of the angles
+        cells[5,[1,3,4]] = numpy.cos(cells[5,[1,3,4]]*numpy.pi/180)
+        for order in "<", ">":
+            self.write_dcd("test.dcd", pos, cells, order)
+            # an incomplete frame at the end is ignored
+            file("test.dcd", "a").write("\0"*50)
+            self.execute("tr-from-dcd", ["-s1::2", "-a1,3", "test.dcd", order])
+            self.assertArraysEqual(load_track("%s/step" % order), 100 + 10*numpy.arange(1, 12, 2))
+            self.assertArraysAlmostEqual(load_track("%s/time" % order)/femtosecond, numpy.arange(110, 220, 20)*0.04*48.88821, 1e-6)
+            self.assertArraysEqual(load_track("%s/atom.pos.0000003.y" % order), pos[1::2,3,1].astype(float)*angstrom)
+            self.assert_(not os.path.exists("%s/atom.pos.0000002.y" % order))
+            self.assertArraysAlmostEqual(load_track("%s/cell.b" % order), numpy.ones(6)*11*angstrom, 1e-10)
+            self.assertArraysAlmostEqual(load_track("%s/cell.beta" % order), numpy.ones(6)*80*deg, 1e-10)
+            self.assertArraysAlmostEqual(load_track("%s/cell.c.y" % order), numpy.ones(6)*12*numpy.cos(70*deg)*angstrom, 1e-10)
+            self.assertArraysEqual(load_track("%s/cell.b.z" % order), numpy.zeros(6))
+
     def test_from_gro(self):
         self.execute("tr-from-gro", [os.path.join(input_dir, "gromacs", "water2.gro")])
         time = load_track("tracks/time")
@@ -403,6 +731,25 @@ class CommandsTestCase(BaseTestCase):
         cellbz = load_track("tracks/cell.b.z")
         self.assertAlmostEqual(cellbz[1]/nanometer, 0.0)
 
+    def test_from_gro_sub(self):
+        # a gro file with more frames and a triclinic cell
+        f = file(os.path.join(input_dir, "gromacs", "water2.gro"))
+        lines = f.readlines()
+        f.close()
+        f = file("test.gro", "w")
+        for i in xrange(20):
+            lines[0] = "MD of 2 waters, t= %.1f\n" % i
+            lines[3] = "    1WATER  HW2    2   0.190 %7.3f   1.747  0.8085  0.3191 %7.4f\n" % (0.1*i, -0.01*i)
+            lines[8] = "   1.82060   1.82060   1.82060   0.00000   0.00000   0.10000   0.00000   0.20000   0.30000\n"
+            f.writelines(lines[:9])
+        f.close()
+        frames = list(GroReader("test.gro"))[3:15:2]
+        self.execute("tr-from-gro", ["-s3:15:2", "test.gro"])
+        self.assertArraysEqual(load_track("tracks/time"), numpy.array([frame[0] for frame in frames], numpy.float32))
+        self.assertArraysAlmostEqual(load_track("tracks/atom.pos.0000001.y"), numpy.array([frame[1][1,1] for frame in frames]), 1e-6)
+        self.assertArraysAlmostEqual(load_track("tracks/atom.vel.0000001.z"), numpy.array([frame[2][1,2] for frame in frames]), 1e-6)
+        self.assertArraysAlmostEqual(load_track("tracks/cell.c.y"), numpy.array([frame[3][1,2] for frame in frames]), 1e-6)
+
 
     def test_to_xyz(self):
         self.from_xyz("thf01", "pos")
@@ -432,8 +779,51 @@ class CommandsTestCase(BaseTestCase):
             os.path.join(input_dir, "water32/init.psf"),
             "9.865*A,", "tracks/atom.pos", os.path.join(output_dir, "water32.ref.pos.xyz"),
         ])
+        # the molecule centers must be inside the box
+        groups = PSFFile(os.path.join(input_dir, "water32/init.psf")).get_groups()
+        xyz_reader = XYZReader(os.path.join(output_dir, "water32.ref.pos.xyz"))
+        for title, coordinates in xyz_reader:
+            for group in groups:
+                center = coordinates[group].mean(axis=0)/(9.865*angstrom)
+                self.assert_((center >= -1e-8).all() and (center < 1+1e-8).all())
         self.from_xyz("ar108", "pos")
 
+    def test_to_dcd(self):
+        # convert back and forth with a subset of the frames and atoms
+        self.from_xyz("thf01", "pos")
+        self.execute("tr-to-dcd", ["-s5::3", "-a2,5", "tracks/atom.pos", "test.dcd"])
+        self.execute("tr-from-dcd", ["test.dcd", "copy"])
+        # without a time step, the time is not stored
+        self.assertArraysEqual(load_track("copy/step"), numpy.arange(len(range(5, 1001, 3))))
+        self.assertArrayConstant(load_track("copy/time"), 0.0)
+        # the time step is taken from a time track
+        time = numpy.arange(1001)*0.5*femtosecond
+        dump_track("tracks/time", time)
+        self.execute("tr-to-dcd", ["-s5::3", "-a2,5", "-ttracks/time", "tracks/atom.pos", "test.dcd"])
+        self.execute("tr-from-dcd", ["test.dcd", "copy"])
+        self.assertArraysEqual(load_track("copy/step"), numpy.arange(5, 1001, 3))
+        self.assertArraysAlmostEqual(load_track("copy/time"), time[5::3], 1e-6)
+        for index, copy_index in (2, 0), (5, 1):
+            orig = load_track("tracks/atom.pos.%07i.z" % index)[5::3]
+            copy = load_track("copy/atom.pos.%07i.z" % copy_index)
+            self.assertArraysAlmostEqual(orig, copy, 1e-6)
+        # wrapped molecules must be identical to the output of tr-to-xyz
+        self.from_xyz("water32", "pos")
+        self.execute("tr-to-xyz", [
+            os.path.join(input_dir, "water32/init.xyz"),
+            os.path.join(input_dir, "water32/init.psf"),
+            "9.865*A,", "tracks/atom.pos", "water.xyz",
+        ])
+        self.execute("tr-to-dcd", [
+            os.path.join(input_dir, "water32/init.psf"),
+            "9.865*A,", "tracks/atom.pos", "water.dcd",
+        ])
+        self.execute("tr-from-dcd", ["water.dcd", "water"])
+        self.assertArraysAlmostEqual(load_track("water/cell.c"), load_track("water/step")*0 + 9.865*angstrom, 1e-6)
+        for i, (title, coordinates) in enumerate(XYZReader("water.xyz")):
+            if i % 10 == 0:
+                self.assertAlmostEqual(coordinates[7,1], load_track("water/atom.pos.0000007.y")[i], 5)
+
     def test_txt_slice_length(self):
         self.from_cp2k_ener("water32")
         # tr-to-txt
@@ -492,6 +882,159 @@ class CommandsTestCase(BaseTestCase):
         check("::")
         check("20:601:5")
 
+    def test_stream(self):
+        self.from_cp2k_ener("thf01")
+        t1 = load_track("tracks/time")
+        k1 = load_track("tracks/kinetic_energy")
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        p1 = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-to-txt"),
+             "--stream", "tracks/time", "tracks/kinetic_energy"],
+            stdout=PIPE, env=env,
+        )
+        p2 = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-from-txt"),
+             "--stream", "-", "tracks/test"],
+            stdin=p1.stdout, env=env,
+        )
+        p1.stdout.close()
+        self.assertEqual(p2.wait(), 0)
+        self.assertEqual(p1.wait(), 0)
+        self.assertArraysEqual(k1, load_track("tracks/test"))
+        # an analysis command that reads the stream
+        p1 = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-to-txt"),
+             "--stream", "tracks/time", "tracks/kinetic_energy"],
+            stdout=PIPE, env=env,
+        )
+        p2 = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-msd"),
+             "--multiple-tau", "-", "tracks/msd_stream"],
+            stdin=p1.stdout, stdout=PIPE, stderr=PIPE, env=env,
+        )
+        p1.stdout.close()
+        p2.communicate()
+        self.assertEqual(p2.wait(), 0)
+        self.assertEqual(p1.wait(), 0)
+        self.execute("tr-msd", ["--multiple-tau", "tracks/time", "tracks/kinetic_energy", "tracks/msd_files"])
+        self.assertArraysEqual(load_track("tracks/msd_stream"), load_track("tracks/msd_files"))
+        self.assertArraysEqual(load_track("tracks/msd_stream.lags"), load_track("tracks/msd_files.lags"))
+
+    def test_txt_format_binary(self):
+        self.from_cp2k_ener("thf01")
+        t1 = load_track("tracks/time")
+        k1 = load_track("tracks/kinetic_energy")
+        # the default format is read back exactly
+        lines = self.execute("tr-to-txt", ["fs", "tracks/time", "au", "tracks/kinetic_energy"])
+        self.execute("tr-from-txt", ["fs", "-", "au", "tracks/test"], stdin=lines)
+        self.assertArraysEqual(k1, load_track("tracks/test"))
+        # and it is identical to str() of the values, as in earlier versions
+        self.assertEqual(lines, ["%s\t%s" % (str(t/femtosecond), str(k)) for t, k in zip(t1, k1)])
+        lines = self.execute("tr-to-txt", ["--format=%.2f", "fs", "tracks/time", "au", "tracks/kinetic_energy"])
+        self.assertEqual(lines[1], "%.2f\t%.2f" % (t1[1]/femtosecond, k1[1]))
+        # raw binary data in the given units
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-to-txt"),
+             "--binary", "fs", "tracks/time", "kjmol", "tracks/kinetic_energy"],
+            stdout=PIPE, env=env,
+        )
+        data = p.communicate()[0]
+        self.assertEqual(p.returncode, 0)
+        values = numpy.frombuffer(data, float).reshape((-1, 2))
+        self.assertArraysAlmostEqual(values[:,0], t1/femtosecond, 1e-10)
+        self.assertArraysAlmostEqual(values[:,1], k1/kjmol, 1e-10)
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-from-txt"),
+             "--binary", "-s10::3", "-", "kjmol", "tracks/test"],
+            stdin=PIPE, env=env,
+        )
+        p.communicate(data)
+        self.assertEqual(p.returncode, 0)
+        self.assertArraysAlmostEqual(load_track("tracks/test"), k1[10::3], 1e-10)
+
+    def test_transpose(self):
+        self.from_xyz("thf01", "pos")
+        paths_in = ["tracks/atom.pos.%07i.%s" % (i, c) for i in xrange(13) for c in "xyz"]
+        self.execute("tr-transpose", ["-j2"] + paths_in + ["tracks/frames"])
+        data = load_track("tracks/frames").reshape((-1, len(paths_in)))
+        for i, path_in in enumerate(paths_in):
+            self.assertArraysEqual(data[:,i], load_track(path_in))
+        paths_out = ["tracks/out.%07i" % i for i in xrange(len(paths_in))]
+        self.execute("tr-transpose", ["--to-columns", "-s::2", "tracks/frames"] + paths_out)
+        for path_in, path_out in zip(paths_in, paths_out):
+            self.assertArraysEqual(load_track(path_out), load_track(path_in)[::2])
+
+    def test_npy(self):
+        self.from_xyz("thf01", "pos")
+        self.execute("tr-to-npy", ["-u", "A", "tracks/atom.pos", "pos.npy"])
+        pos = numpy.load("pos.npy")
+        self.assertEqual(pos.shape, (1001, 13, 3))
+        self.assertArraysAlmostEqual(pos[:,5,1]*angstrom, load_track("tracks/atom.pos.0000005.y"), 1e-10)
+        # back into separate tracks, with a selection of frames and atoms
+        self.execute("tr-from-npy", ["-u", "A", "-s10::7", "-a2,5", "pos.npy", "copy/atom.pos"])
+        self.assertEqual(len(glob.glob("copy/atom.pos.*")), 6)
+        self.assertArraysAlmostEqual(load_track("copy/atom.pos.0000005.z"), pos[10::7,5,2]*angstrom, 1e-10)
+        # into a bundle and back into a .npz file
+        self.execute("tr-from-npy", ["--bundle", "copy/bundle", "pos.npy", "tracks/atom.pos"])
+        self.execute("tr-to-npy", ["--bundle", "copy/bundle", "-s::2", "-a3,7", "-k", "pos", "tracks/atom.pos", "pos.npz"])
+        self.assertArraysEqual(numpy.load("pos.npz")["pos"], pos[::2][:,[3,7]])
+        # a bundle can not be quantized
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-from-npy"),
+             "--bundle", "copy/bundle2", "--max-error", "1e-4", "pos.npy", "tracks/atom.pos"],
+            stdout=PIPE, stderr=PIPE, env=env,
+        )
+        error = p.communicate()[1]
+        self.assertNotEqual(p.returncode, 0)
+        self.assert_("The option --bundle can not be combined with --max-error." in error)
+        self.assertRaises(Error, npy_to_tracks, "pos.npy", "tracks/atom.pos", max_error=1e-4, bundle_filename="copy/bundle2")
+        # a single track keeps its data type
+        numpy.save("step.npy", numpy.arange(0, 50, 5))
+        self.execute("tr-from-npy", ["step.npy", "copy/step"])
+        self.execute("tr-to-npy", ["copy/step", "step2.npy"])
+        self.assertArraysEqual(numpy.load("step2.npy"), numpy.arange(0, 50, 5))
+        self.assertEqual(numpy.load("step2.npy").dtype, numpy.dtype(int))
+
+    def test_from_xyz_stripe(self):
+        self.from_xyz("thf01", "pos", ["--stripe=stripe0,stripe1,stripe2"])
+        self.assert_(os.path.islink("tracks/atom.pos.0000000.x"))
+        self.assert_(os.path.isfile("tracks/.stripes"))
+        # 13 atoms with three coordinates are distributed over three stripes
+        self.assertEqual(sum(len(names) for root, dirs, names in os.walk("stripe1")), 13)
+        self.execute("tr-to-txt", ["tracks/atom.pos.0000000.x", "tracks/atom.pos.0000000.y"])
+
+    def test_pyramid(self):
+        self.from_cp2k_ener("thf01")
+        self.execute("tr-pyramid", ["--min-size=10", "tracks/temperature", "tracks/time"])
+        temperature = load_track("tracks/temperature")
+        mean = load_track("tracks/temperature.pyramid.02.mean")
+        self.assertEqual(len(mean), len(temperature)/4)
+        self.assertAlmostEqual(mean[0], temperature[:4].mean(), 5)
+        self.execute("tr-plot", [
+            "--xunit=fs", "--yunit=K", ":line", "tracks/time", "tracks/temperature",
+            os.path.join(output_dir, "pyramid_temperature.png"),
+        ])
+        self.execute("tr-plot", [
+            "--xlim=100*fs,500*fs", ":line", "-s::2", "tracks/temperature",
+            os.path.join(output_dir, "pyramid_temperature_xlim.png"),
+        ])
+        # an x-axis without a pyramid, averaged over the same bins as y
+        self.execute("tr-plot", [
+            "--xunit=fs", "--yunit=K", ":line", "tracks/kinetic_energy", "tracks/temperature",
+            os.path.join(output_dir, "pyramid_temperature_energy.png"),
+        ])
+        # an outdated pyramid is not used
+        dump_track("tracks/temperature", temperature[:100])
+        self.execute("tr-plot", [
+            "--xunit=fs", "--yunit=K", ":line", "tracks/time", "tracks/temperature",
+            os.path.join(output_dir, "pyramid_temperature_outdated.png"),
+        ])
+
     def test_ac(self):
         self.from_xyz("thf01", "vel", ["-u1"])
         self.from_cp2k_ener("thf01")
@@ -562,6 +1105,43 @@ class CommandsTestCase(BaseTestCase):
         self.assertArraysEqual(tmp1, tmp2)
         self.assertArrayConstant(tmp1, tmp1[0])
 
+    def test_ac_multiple_tau(self):
+        self.from_xyz("thf01", "vel", ["-u1"])
+        paths = sorted(glob.glob("tracks/atom.vel.*"))
+        self.execute("tr-ac", ["--multiple-tau", "-m500*fs"] + paths + ["5.0*fs", "tracks/vac"])
+        # the lags are trimmed to the maximum time difference of 100 steps
+        lags = load_track("tracks/vac.lags")
+        self.assertEqual(lags[-1], 96)
+        vac = load_track("tracks/vac")
+        self.assertEqual(len(vac), len(lags))
+        # the first level contains the exact autocorrelation function
+        data = numpy.array([load_track(path) for path in paths]).transpose()
+        data -= data.mean(axis=0)
+        for lag, value in zip(lags[:16], vac[:16]):
+            self.assertAlmostEqual(value, (data[:len(data)-lag]*data[lag:]).mean(), 10)
+        # without a maximum, the levels are capped by the track size
+        self.execute("tr-ac", ["--multiple-tau"] + paths + ["5.0*fs", "tracks/vac_all"])
+        lags = load_track("tracks/vac_all.lags")
+        self.assert_(lags[-1] <= len(data) - 1)
+        self.assert_(lags[-1] > (len(data) - 1)/2)
+        # all inputs must have the same length and they may not be empty
+        dump_track("tracks/short", data[:10,0])
+        dump_track("tracks/empty", data[:0,0])
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        for inputs, message in [
+            ([paths[0], "tracks/short"], "All input tracks must have the same length."),
+            (["tracks/empty"], "The input tracks are empty."),
+        ]:
+            p = Popen(
+                ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-ac"), "--multiple-tau"] +
+                inputs + ["5.0*fs", "tracks/vac_bad"],
+                stdout=PIPE, stderr=PIPE, env=env,
+            )
+            error = p.communicate()[1]
+            self.assertNotEqual(p.returncode, 0)
+            self.assert_(message in error)
+
     def test_ac_fft(self):
         self.from_xyz("thf01", "vel", ["-u1"])
         self.from_cp2k_ener("thf01")
@@ -1438,6 +2018,34 @@ class CommandsTestCase(BaseTestCase):
         lines = self.execute("tr-msd-fit", ["tracks/atom.pos.msd", "tracks/time", "--slice=10:100:", "--unit=cm**2/s"])
         self.assertAlmostEqual(float(lines[0].split()[-1]), 2.2861e-05)
 
+    def test_msd_fft(self):
+        self.from_xyz("thf01", "pos")
+        paths_in = glob.glob("tracks/atom.pos.*")
+        self.execute("tr-msd", paths_in + ["-s::3", "tracks/msd"])
+        self.execute("tr-msd", paths_in + ["-s::3", "--delta-origin=1", "tracks/msd_loop"])
+        msd = load_track("tracks/msd")
+        self.assertEqual(len(msd), 333)
+        self.assertArraysAlmostEqual(msd, load_track("tracks/msd_loop"), 1e-8)
+        x = load_track(paths_in[0], parse_slice("::3"))
+        self.assertArraysAlmostEqual(compute_msd_fft(x.reshape(-1, 1))[:,0], numpy.array([
+            ((x[delta:] - x[:-delta])**2).mean() for delta in xrange(1, len(x))
+        ]), 1e-8)
+        # the progress is silenced with -q
+        self.assertEqual(self.execute("tr-msd", ["-q"] + paths_in + ["tracks/msd_quiet"]), [])
+        # inputs of different lengths are only accepted with --delta-origin
+        dump_track("tracks/short", x[:100])
+        self.execute("tr-msd", [paths_in[0], "tracks/short", "--delta-origin=1", "tracks/msd_short"])
+        from subprocess import Popen, PIPE
+        env = {"PYTHONPATH": "%s:%s" % (lib_dir, os.getenv("PYTHONPATH"))}
+        p = Popen(
+            ["/usr/bin/env", "python", os.path.join(scripts_dir, "tr-msd"),
+             paths_in[0], "tracks/short", "tracks/msd_short"],
+            stdout=PIPE, stderr=PIPE, env=env,
+        )
+        error = p.communicate()[1]
+        self.assertNotEqual(p.returncode, 0)
+        self.assert_("The input tracks/short has 100 instead of 1001 time steps." in error)
+
     def test_qh_entropy(self):
         self.from_xyz("ar108", "pos")
         self.execute("tr-qh-entropy", [os.path.join(input_dir, "thf01", "init.xyz"), "300*K", "--unit=J/K/mol"])
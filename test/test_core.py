@@ -36,15 +36,22 @@
 from common import *
 
 from tracks.core import *
+from tracks.bundle import *
+from tracks.pyramid import *
+from tracks.compressed import *
 from tracks.log import log
 
-import unittest, numpy
+from StringIO import StringIO
+import unittest, numpy, os, zlib, bz2, struct, subprocess
 
 
 log.verbose = False
 
 
-__all__ = ["TrackTestCase", "MultiTrackTestCase"]
+__all__ = [
+    "TrackTestCase", "MultiTrackTestCase", "BundleTestCase", "PyramidTestCase",
+    "CompressedTestCase",
+]
 
 
 class TrackTestCase(BaseTestCase):
@@ -116,6 +123,51 @@ class TrackTestCase(BaseTestCase):
             self.assertEqual(len(rnd2), 0)
             self.assertEqual(rnd1.dtype, rnd2.dtype)
 
+    def test_quantized(self):
+        for dtype in numpy.float32, numpy.float64:
+            rnd1 = numpy.random.normal(0, 0.01, 10000).cumsum().astype(dtype)
+            max_error = 1e-3
+            track = Track("test", clear=True, max_error=max_error)
+            track.append(rnd1[:7000])
+            track.append(rnd1[7000:])
+            self.assert_(track.is_quantized())
+            self.assertEqual(track.size(), len(rnd1))
+            rnd2 = track.read()
+            self.assertEqual(rnd2.dtype, rnd1.dtype)
+            round_off = abs(rnd1).max()*numpy.finfo(dtype).eps
+            self.assertArrayAlmostZero(rnd2 - rnd1, max_error + round_off)
+            sub = slice(3000, 9500, 7)
+            self.assertArraysEqual(track.read(sub), rnd2[sub])
+            destination = numpy.zeros(2000, dtype)
+            self.assertEqual(track.read_into(destination, sub), len(rnd2[sub]))
+            self.assertArraysEqual(destination[:len(rnd2[sub])], rnd2[sub])
+            self.assertEqual(len(track.read(slice(20000, 30000))), 0)
+            # the quantized file is much smaller than the raw data
+            self.assert_(os.path.getsize("test") < rnd1.nbytes/2)
+        self.assertRaises(Error, dump_track, "test", numpy.arange(10), 0.1)
+
+    def test_quantized_reader(self):
+        # a track with several chunks, read in small buffers
+        rnd1 = numpy.random.normal(0, 0.01, 3*Track.chunk_size + 123).cumsum()
+        dump_track("test1", rnd1, 1e-3)
+        dump_track("test2", rnd1*2, 1e-3)
+        rnd2 = load_track("test1")
+        self.assertArrayAlmostZero(rnd2 - rnd1, 1e-3*(1 + 1e-6))
+        dtype = numpy.dtype([("a", float, 2)])
+        for sub in slice(None), slice(1000, 11000, 3), slice(4095, 4097):
+            mtr = MultiTracksReader(["test1", "test2"], dtype, buffer_size=16*333, sub=sub)
+            data = numpy.concatenate([buffer["a"].copy() for buffer in mtr.iter_buffers()])
+            self.assertArraysEqual(data[:,0], rnd2[sub])
+            self.assertArrayAlmostZero(data[:,1] - 2*rnd1[sub], 2e-3*(1 + 1e-6))
+        # the index of a Track object follows the appended chunks
+        track = Track("test1")
+        self.assertEqual(track.size(), len(rnd1))
+        Track("test1").append(rnd1[:5000])
+        self.assertEqual(track.size(), len(rnd1) + 5000)
+        self.assertArraysEqual(track.read(slice(len(rnd1), None)), load_track("test1")[len(rnd1):])
+        dump_track("test1", rnd1[:10], 1e-3)
+        self.assertEqual(track.size(), 10)
+
     def test_read_into(self):
         sub = slice(10,30,2)
         for rnd1 in self.get_arrays():
@@ -126,6 +178,20 @@ class TrackTestCase(BaseTestCase):
             self.assertArrayConstant(destination[10:],0)
             self.assertArraysEqual(destination[:10], rnd1[sub])
 
+    def test_grow_write(self):
+        for rnd1 in self.get_arrays():
+            track = Track("test", clear=True)
+            self.assertEqual(track.grow(rnd1.dtype, 20), 0)
+            track.append(rnd1[20:30])
+            self.assertEqual(track.grow(rnd1.dtype, 20), 30)
+            # fill the gaps in a different order
+            track.write(rnd1[30:], 30)
+            track.write(rnd1[:20], 0)
+            self.assertArraysEqual(track.read(), rnd1)
+            self.assertRaises(Error, track.write, rnd1[:10], 45)
+        track = Track("test", clear=True, max_error=0.1)
+        self.assertRaises(Error, track.grow, numpy.float64, 10)
+
 
 class MultiTrackTestCase(BaseTestCase):
     def get_data(self):
@@ -238,4 +304,206 @@ class MultiTrackTestCase(BaseTestCase):
         # compare the original data with the data read from disk
         self.compare_data(data[sub], data_check)
 
+    def test_stream(self):
+        data, filenames = self.get_data()
+
+        # write the data to a binary stream
+        f = StringIO()
+        mtw = MultiTracksWriter("-", data.dtype, buffer_size=5*1024, stream=f)
+        for row in data[:100]:
+            mtw.dump_row(row)
+        mtw.dump_buffer(data[100:])
+        mtw.finish()
+
+        # read it back with the dtype from the stream header
+        f.seek(0)
+        mtr = MultiTracksReader("-", None, buffer_size=1024, stream=f)
+        self.assertRaises(Error, getattr, mtr, "shortest")
+        data_check = numpy.concatenate(list(mtr.iter_buffers()))
+        self.compare_data(data, data_check)
+
+        # read it back sliced, with a compatible dtype
+        f.seek(0)
+        sub = slice(10,920,13)
+        dtype = numpy.dtype([("c", float, (1,2)),("d", int)])
+        mtr = MultiTracksReader("-", dtype, buffer_size=1024, sub=sub, stream=f)
+        data_check = numpy.concatenate(list(mtr.iter_buffers()))
+        self.assertArraysEqual(data["a"][sub], data_check["c"][:,0])
+        self.assertArraysEqual(data["b"][sub], data_check["d"])
+
+        # an incompatible dtype must be refused
+        f.seek(0)
+        dtype = numpy.dtype([("c", int, 3)])
+        self.assertRaises(Error, MultiTracksReader, "-", dtype, stream=f)
+
 
+    def test_stripes(self):
+        data, filenames = self.get_data()
+        filenames = [os.path.join("tracks", filename) for filename in filenames]
+        mtw = MultiTracksWriter(filenames, data.dtype, buffer_size=1600, roots=["root0", "root1"])
+        mtw.dump_buffer(data[:500])
+        for row in data[500:]:
+            mtw.dump_row(row)
+        mtw.finish()
+        manifest = read_stripe_manifest("tracks")
+        for counter, filename in enumerate(filenames):
+            self.assert_(os.path.islink(filename))
+            physical = os.path.join(os.path.abspath("root%i" % (counter % 2)), os.path.abspath(filename)[1:])
+            self.assertEqual(manifest[os.path.basename(filename)], physical)
+            self.assert_(os.path.isfile(physical))
+        mtr = MultiTracksReader(filenames, data.dtype, buffer_size=1600)
+        self.compare_data(numpy.concatenate([buffer.copy() for buffer in mtr.iter_buffers()]), data)
+        # pretend that each track is on a different device to test the threads
+        mtr = MultiTracksReader(filenames, data.dtype, buffer_size=1600)
+        mtr.devices = dict((filename, i) for i, filename in enumerate(filenames))
+        buffers = []
+        pools = set()
+        for buffer in mtr.iter_buffers():
+            buffers.append(buffer.copy())
+            pools.add(mtr._pool)
+        self.compare_data(numpy.concatenate(buffers), data)
+        # one pool is used for all buffers and it is closed at the end
+        self.assertEqual(len(pools), 1)
+        self.assert_(mtr._pool is None)
+        mtw = MultiTracksWriter(filenames, data.dtype, buffer_size=1600)
+        mtw.devices = mtr.devices
+        pools = set()
+        for row in data:
+            mtw.dump_row(row)
+            pools.add(mtw._pool)
+        mtw.finish()
+        self.assertEqual(len(pools - set([None])), 1)
+        self.assert_(mtw._pool is None)
+        # clearing a striped track also removes the file on the stripe
+        Track(filenames[0], clear=True)
+        self.assert_(not os.path.lexists(filenames[0]))
+        self.assert_(not os.path.exists(manifest[os.path.basename(filenames[0])]))
+
+
+class BundleTestCase(BaseTestCase):
+    def test_transpose(self):
+        data = numpy.random.normal(0, 1, (1000, 7))
+        filenames = ["test%i" % i for i in xrange(7)]
+        for i, filename in enumerate(filenames):
+            dump_track(filename, data[:,i])
+        for num_jobs in 1, 3:
+            # small buffers to test the blocking
+            columns_to_bundle(filenames, "bundle", num_jobs=num_jobs, buffer_size=1024)
+            bundle = Bundle("bundle")
+            self.assertEqual(bundle.columns, filenames)
+            self.assertArraysEqual(bundle.memmap(), data)
+            self.assertArraysEqual(bundle.read(slice(5,50,3), [1,4]), data[5:50:3,[1,4]])
+            outputs = ["out%i" % i for i in xrange(7)]
+            bundle_to_columns("bundle", outputs, num_jobs=num_jobs, buffer_size=1024)
+            for i, output in enumerate(outputs):
+                self.assertArraysEqual(load_track(output), data[:,i])
+
+    def test_transpose_sliced(self):
+        data = numpy.random.normal(0, 1, (1000, 3))
+        filenames = ["test%i" % i for i in xrange(3)]
+        for i, filename in enumerate(filenames):
+            dump_track(filename, data[:,i])
+        sub = slice(10, 900, 7)
+        columns_to_bundle(filenames, "bundle", sub, buffer_size=256)
+        self.assertArraysEqual(Bundle("bundle").memmap(), data[sub])
+        bundle_to_columns("bundle", sub=slice(None, None, 2))
+        for i, filename in enumerate(filenames):
+            self.assertArraysEqual(load_track(filename), data[sub][::2,i])
+
+    def test_transpose_empty(self):
+        filenames = ["a", "b"]
+        for filename in filenames:
+            dump_track(filename, numpy.arange(5, dtype=float))
+        # the slice is beyond the end of the tracks
+        columns_to_bundle(filenames, "bundle", slice(10, 20))
+        bundle = Bundle("bundle")
+        self.assertEqual(bundle.columns, filenames)
+        self.assertEqual(bundle.memmap().shape, (0, 2))
+        bundle_to_columns("bundle", ["out_a", "out_b"])
+        self.assertEqual(len(load_track("out_a")), 0)
+
+
+class PyramidTestCase(BaseTestCase):
+    def test_update(self):
+        data = numpy.random.normal(0, 1, 5000)
+        dump_track("test", data[:3001])
+        update_pyramid("test", min_size=100, buffer_size=800)
+        self.assert_(has_pyramid("test"))
+        self.assert_(has_current_pyramid("test"))
+        # appending data with a MultiTracksWriter updates the existing pyramid
+        # incrementally
+        mtw = MultiTracksWriter(["test"], numpy.dtype([("a", float)]), clear=False)
+        for value in data[3001:]:
+            mtw.dump_row((value,))
+        mtw.finish()
+        self.assert_(has_current_pyramid("test"))
+        self.assertEqual(get_pyramid_levels("test"), 5)
+        for level in xrange(1, 5):
+            size = len(data) >> level
+            binned = data[:size << level].reshape((size, 1 << level))
+            low, high, mean = load_pyramid_level("test", level, 0, len(data))
+            self.assertArraysEqual(low, binned.min(axis=1))
+            self.assertArraysEqual(high, binned.max(axis=1))
+            self.assertArraysAlmostEqual(mean, binned.mean(axis=1), 1e-10)
+        low, high, mean = load_pyramid_level("test", 2, 10, 20)
+        self.assertArraysEqual(low, data[8:20].reshape((3, 4)).min(axis=1))
+        self.assertEqual(choose_pyramid_level("test", 0, 5000, 1000), 2)
+        self.assertEqual(choose_pyramid_level("test", 0, 5000, 10), 4)
+        self.assertEqual(choose_pyramid_level("test", 1000, 1500, 1000), 0)
+        # a track that is overwritten without a MultiTracksWriter has an
+        # outdated pyramid
+        dump_track("test", data[:4000])
+        self.assert_(not has_current_pyramid("test"))
+        # clearing the track with a MultiTracksWriter resets the pyramid
+        mtw = MultiTracksWriter(["test"], numpy.dtype([("a", float)]))
+        for value in data[:64]:
+            mtw.dump_row((value,))
+        mtw.finish()
+        self.assertEqual(get_pyramid_levels("test"), 2)
+        self.assertArraysEqual(load_pyramid_level("test", 1, 0, 64)[2], 0.5*(data[:64:2] + data[1:64:2]))
+
+
+class CompressedTestCase(BaseTestCase):
+    def check_file(self, filename, data, num_threads):
+        f = DecompressedFile(filename, num_threads, chunk_size=10000)
+        self.assertEqual(f.readline(), data[:data.find("\n")+1])
+        position = f.tell()
+        self.assertEqual(f.read(1000), data[position:position+1000])
+        self.assertEqual("".join(f), data[position+1000:])
+        self.assertEqual(f.read(), "")
+        f.close()
+
+    def test_decompress(self):
+        data = "".join("%i %s\n" % (i, "x"*(i%50)) for i in xrange(20000))
+        file("test", "w").write(data)
+        # members of BGZF files and streams of multi-stream bzip2 files are
+        # decompressed in parallel
+        members = []
+        for i in xrange(0, len(data), 30000):
+            piece = data[i:i+30000]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            raw = compressor.compress(piece) + compressor.flush()
+            members.append(
+                "\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0" +
+                struct.pack("<H", len(raw) + 25) + raw +
+                struct.pack("<Ii", zlib.crc32(piece) & 0xffffffff, len(piece))
+            )
+        file("test.gz", "w").write("".join(members))
+        file("test.bz2", "w").write("".join(bz2.compress(data[i:i+30000]) for i in xrange(0, len(data), 30000)))
+        for num_threads in 1, 3:
+            self.check_file("test.gz", data, num_threads)
+            self.check_file("test.bz2", data, num_threads)
+        # plain gzip and bzip2 files, and xz files
+        subprocess.call(["gzip", "-f", "test"])
+        self.check_file("test.gz", data, 2)
+        file("test.bz2", "w").write(bz2.compress(data))
+        self.check_file("test.bz2", data, 2)
+        if subprocess.call("xz --version > /dev/null 2>&1", shell=True) == 0:
+            file("test", "w").write(data)
+            subprocess.call(["xz", "-f", "test"])
+            self.check_file("test.xz", data, 2)
+        # reading only the beginning of a file
+        f = open_input("test.bz2")
+        self.assertEqual(f.read(5), data[:5])
+        f.close()
+        self.assertEqual(get_compression("test.txt"), None)
@@ -34,6 +34,8 @@
 
 
 from tracks.core import *
+from tracks.bundle import *
+from tracks.pyramid import *
 from tracks.parse import *
 from tracks.util import *
 from tracks.convert import *
@@ -37,6 +37,7 @@ from common import *
 
 from tracks.core import dump_track
 from tracks.parse import *
+from tracks.convert import _parse_fixed_floats
 from tracks.log import log
 
 import unittest, numpy
@@ -61,4 +62,25 @@ class ParseTestCase(BaseTestCase):
         dump_track("test", numpy.arange(50))
         self.assertEqual(parse_x_length("test"), 50)
 
+    def test_fixed_floats(self):
+        def parse(lines):
+            chars = numpy.frombuffer("".join(lines), numpy.uint8)
+            return _parse_fixed_floats(chars.reshape((len(lines), -1)))
+        # the results are identical to float()
+        for lines in [
+            ["  1.25", " -3.50", "+12.00", "  -.50"],
+            ["   -12", "   345", "    +7", "     0"],
+            [" 1.5E+02", "-2.5E-03", " 7.0E+00"],
+        ]:
+            self.assertEqual(parse(lines).tolist(), [float(line) for line in lines])
+        # a sign that is not directly before the number, a missing digit or
+        # two signs are rejected, like float() does
+        for line in "  12-3", " 1-2.5", "  1.5-", "  -+12", "    -.", " 1.5+ ":
+            self.assertRaises(ValueError, float, line)
+            self.assertEqual(parse([line, "  1.00"]), None)
+
+    def test_segments(self):
+        self.assertEqual(parse_segments("run,1.xyz", None), "run,1.xyz")
+        self.assertEqual(parse_segments("run-1.xyz", ["run-2.xyz", "run-3.xyz"]), ["run-1.xyz", "run-2.xyz", "run-3.xyz"])
+
 
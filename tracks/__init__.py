@@ -33,10 +33,19 @@
 #--
 
 
+import os
+
+
 class Context(object):
     def __init__(self):
         self.default_buffer_size = 100*1024*1024
         self.default_dot_interval = 50
+        # root directories over which new tracks are striped, see
+        # MultiTracksWriter
+        self.stripe_roots = None
+        # store the frame offsets of text trajectories next to the files, see
+        # get_frame_offsets; TRACKS_CACHE_OFFSETS=0 turns the cache off
+        self.cache_frame_offsets = os.getenv("TRACKS_CACHE_OFFSETS", "1") != "0"
 
 context = Context()
 
@@ -35,8 +35,12 @@
 
 from tracks.api.ac import *
 from tracks.api.cell import *
+from tracks.api.correlator import *
+from tracks.api.database import *
 from tracks.api.geom import *
+from tracks.api.msd import *
 from tracks.api.pca import *
+from tracks.api.rdf import *
 from tracks.api.spectrum import *
 from tracks.api.vector import *
 
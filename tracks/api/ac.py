@@ -39,12 +39,12 @@ import numpy
 
 
 __all__ = [
-    "fit_cor_time", "compute_ac_fft", "cor_time", "mean_error_ac",
-    "compute_blav", "mean_error_blav"
+    "fit_cor_time", "compute_ac_fft", "compute_ac_window_fft", "cor_time",
+    "mean_error_ac", "compute_blav", "mean_error_blav"
 ]
 
 
-def fit_cor_time(time_step, ac):
+def fit_cor_time(time_step, ac, time=None):
     """Fit the correlation time from a normalized autocorrelation function.
 
        The fit is performed based on a simple single exponential decay model.
@@ -55,6 +55,10 @@ def fit_cor_time(time_step, ac):
        Arguments:
          time_step  --  The time step in atomic units.
          ac  --  An array with the normalized autocorrelation function.
+
+       Optional argument:
+         time  --  The time differences of the ac, when they are not
+                   equidistant, e.g. from a MultipleTauCorrelator.
     """
     tmp = (ac<0.3678794).nonzero()[0]
     if len(tmp) == 0:
@@ -62,7 +66,10 @@ def fit_cor_time(time_step, ac):
     end = tmp[0]
     if end <= 1:
         return time_step
-    time = numpy.arange(end)*time_step
+    if time is None:
+        time = numpy.arange(end)*time_step
+    else:
+        time = time[:end]
     ac_log = numpy.log(ac[:end])
     correlation_time = -1.0/(numpy.dot(ac_log[:end], time[:end])/numpy.dot(time[:end], time[:end]))
     return correlation_time
@@ -108,6 +115,34 @@ def compute_ac_fft(inputs, num_blocks=10, zero_mean=False):
     return numpy.fft.irfft(amp)
 
 
+def compute_ac_window_fft(signals, max_delta_steps):
+    """Compute the autocorrelation of signals over a window of time origins.
+
+       Arguments:
+         signals  --  A two-dimensional array with one signal in each column,
+                      i.e. with shape (time steps, signals).
+         max_delta_steps  --  The largest time difference in time steps.
+
+       Returns an array with shape (max_delta_steps + 1, signals) with the
+       average of x(t)*x(t+d) over the first (time steps - max_delta_steps)
+       time origins t, for d = 0, 1, ..., max_delta_steps. This is the same
+       estimator as numpy.correlate(x, x[:time steps - max_delta_steps],
+       'valid'), but it is computed with zero-padded fast Fourier transforms
+       of all columns at once. The cost is O(N log N) instead of O(N*M).
+    """
+    size = len(signals)
+    average_steps = size - max_delta_steps
+    if average_steps <= 0:
+        raise ValueError("The maximum time difference must be smaller than the number of time steps.")
+    # the sum over the window does not wrap around for a transform size of
+    # at least the number of time steps
+    fft_size = 2**int(numpy.ceil(numpy.log2(size)))
+    transformed = numpy.fft.rfft(signals, fft_size, axis=0)
+    transformed_window = numpy.fft.rfft(signals[:average_steps], fft_size, axis=0)
+    result = numpy.fft.irfft(transformed_window.conjugate()*transformed, fft_size, axis=0)
+    return result[:max_delta_steps+1]/average_steps
+
+
 def cor_time(time_step, inputs, num_blocks=10, zero_mean=False):
     """Determine the correlation time for a list of inputs.
 
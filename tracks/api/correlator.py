@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+
+import numpy
+
+
+__all__ = ["MultipleTauCorrelator", "get_num_levels", "multiple_tau"]
+
+
+def get_num_levels(max_lag, block_length=16, averaging=2):
+    """Return the number of levels of a MultipleTauCorrelator for a given lag.
+
+       Arguments:
+         max_lag  --  The largest lag (in time steps) that must be covered.
+
+       Optional arguments: see MultipleTauCorrelator.
+
+       The result is the smallest number of levels for which the largest lag,
+       (block_length-1)*averaging**(num_levels-1), is at least max_lag.
+    """
+    num_levels = 1
+    while (block_length-1)*averaging**(num_levels-1) < max_lag:
+        num_levels += 1
+    return num_levels
+
+
+def multiple_tau(mtr, block_length=16, averaging=2, num_levels=20, max_lag=None):
+    """Feed all data from a MultiTracksReader to a MultipleTauCorrelator.
+
+       Arguments:
+         mtr  --  A MultiTracksReader, e.g. with a field 'data' with one column
+                  for each input track. All elements of all fields in the
+                  buffers are treated as columns.
+
+       Optional arguments: see MultipleTauCorrelator. When max_lag is given,
+       num_levels is derived from it with get_num_levels.
+
+       Returns the MultipleTauCorrelator. Without data, its results are empty.
+    """
+    if max_lag is not None:
+        num_levels = get_num_levels(max_lag, block_length, averaging)
+    dtype = mtr.buffer.dtype
+    sizes = [numpy.product(dtype.fields[name][0].shape, dtype=int) for name in dtype.names]
+    correlator = MultipleTauCorrelator(sum(sizes), block_length, averaging, num_levels)
+    for buffer in mtr.iter_buffers():
+        data = numpy.concatenate([
+            buffer[name].reshape((len(buffer), size)) for name, size in zip(dtype.names, sizes)
+        ], axis=1)
+        correlator.add_data(data)
+    return correlator
+
+
+class MultipleTauCorrelator(object):
+    """Computes correlation functions at logarithmically spaced time lags.
+
+       The data are processed in blocks of time steps, without keeping more
+       than block_length time steps per level in memory, such that the memory
+       usage does not depend on the length of the trajectory. The first level
+       contains the original time steps and covers the lags 0, 1, ...,
+       block_length-1. Each following level contains averages of averaging
+       consecutive time steps of the previous level, and covers the lags that
+       are averaging times longer. (This is the multiple-tau or logarithmic
+       block correlator.) All columns, e.g. different tracks, are processed at
+       once.
+
+       For each lag, the sum of the products x(t)*x(t+lag), the sum of the
+       squared differences (x(t+lag)-x(t))**2, and the sums of both members of
+       the pairs are accumulated. The autocorrelation functions and the mean
+       square displacements are derived from these sums.
+    """
+
+    def __init__(self, num_columns, block_length=16, averaging=2, num_levels=20):
+        """Initialize a MultipleTauCorrelator.
+
+           Arguments:
+             num_columns  --  The number of columns in the data.
+
+           Optional arguments:
+             block_length  --  The number of lags in each level. It must be a
+                               multiple of averaging. [default=16]
+             averaging  --  The number of time steps of a level that are
+                            averaged in one time step of the next level.
+                            [default=2]
+             num_levels  --  The number of levels. The largest lag is
+                             (block_length-1)*averaging**(num_levels-1).
+                             [default=20]
+        """
+        if block_length % averaging != 0 or averaging < 2:
+            raise ValueError("The block_length must be a multiple of averaging, which must be at least two.")
+        self.num_columns = num_columns
+        self.block_length = block_length
+        self.averaging = averaging
+        self.num_levels = num_levels
+
+        shape = (num_levels, block_length, num_columns)
+        self._prod = numpy.zeros(shape, float)
+        self._sqdiff = numpy.zeros(shape, float)
+        self._early = numpy.zeros(shape, float)
+        self._late = numpy.zeros(shape, float)
+        self._counts = numpy.zeros((num_levels, block_length), int)
+        # the last time steps of each level, for the pairs with the next data
+        self._history = [numpy.zeros((0, num_columns), float) for level in xrange(num_levels)]
+        # the time steps of each level that are not yet averaged
+        self._pending = [numpy.zeros((0, num_columns), float) for level in xrange(num_levels)]
+        self._sum = numpy.zeros(num_columns, float)
+        self._size = 0
+
+    def add_data(self, data):
+        """Process the next time steps.
+
+           Arguments:
+             data  --  An array with shape (time steps, num_columns).
+        """
+        data = numpy.asarray(data, float)
+        if data.ndim != 2 or data.shape[1] != self.num_columns:
+            raise ValueError("The data must be an array with %i columns." % self.num_columns)
+        self._sum += data.sum(axis=0)
+        self._size += len(data)
+        for level in xrange(self.num_levels):
+            if len(data) == 0:
+                break
+            self._add_level(level, data)
+            # average consecutive time steps for the next level
+            data = numpy.concatenate([self._pending[level], data])
+            size = (len(data)/self.averaging)*self.averaging
+            self._pending[level] = data[size:]
+            data = data[:size].reshape((-1, self.averaging, self.num_columns)).mean(axis=1)
+
+    def _add_level(self, level, data):
+        history = self._history[level]
+        both = numpy.concatenate([history, data])
+        if level == 0:
+            first_lag = 0
+        else:
+            # the smaller lags are covered by the previous level
+            first_lag = self.block_length/self.averaging
+        for lag in xrange(first_lag, self.block_length):
+            # the pairs with a second member in the new data
+            begin = max(len(history), lag)
+            if begin >= len(both):
+                continue
+            early = both[begin-lag:len(both)-lag]
+            late = both[begin:]
+            self._prod[level, lag] += (early*late).sum(axis=0)
+            self._sqdiff[level, lag] += ((late - early)**2).sum(axis=0)
+            self._early[level, lag] += early.sum(axis=0)
+            self._late[level, lag] += late.sum(axis=0)
+            self._counts[level, lag] += len(late)
+        self._history[level] = both[max(0, len(both)-self.block_length+1):]
+
+    def _select(self, values):
+        # the values of the lags with pairs, in the order of the lags
+        mask = self._counts > 0
+        return values[mask]
+
+    def get_lags(self):
+        """Return the lags (in time steps) with at least one pair."""
+        levels, lags = numpy.indices((self.num_levels, self.block_length))
+        return self._select(lags*self.averaging**levels)
+
+    def get_ac(self, zero_mean=False):
+        """Return the autocorrelation functions.
+
+           Optional arguments:
+             zero_mean  --  When True, the average is not subtracted from the
+                            signals.
+
+           Returns an array with shape (lags, num_columns), see get_lags.
+        """
+        counts = self._select(self._counts).reshape(-1, 1)
+        result = self._select(self._prod)
+        if not zero_mean and self._size > 0:
+            mean = self._sum/self._size
+            result = result - mean*(self._select(self._early) + self._select(self._late)) + counts*mean**2
+        return result/counts
+
+    def get_msd(self):
+        """Return the mean square displacements.
+
+           Returns an array with shape (lags, num_columns), see get_lags.
+        """
+        return self._select(self._sqdiff)/self._select(self._counts).reshape(-1, 1)
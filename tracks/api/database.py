@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+from tracks.core import Track, TrackNotFoundError
+from tracks import context
+
+import numpy, os, glob
+
+
+__all__ = ["BlockCache", "LazyTrackArray", "TrackDatabase"]
+
+
+class BlockCache(object):
+    """A least-recently-used cache of frame blocks, bounded in memory."""
+
+    def __init__(self, max_size=None):
+        """Initialize the cache.
+
+        Optional argument:
+          max_size  --  The maximum number of bytes kept in the cache.
+                        [default=context.default_buffer_size]
+        """
+        if max_size is None:
+            max_size = context.default_buffer_size
+        self.max_size = max_size
+        self.size = 0
+        self._blocks = {}
+        self._counter = 0
+
+    def __getitem__(self, key):
+        tick, block = self._blocks[key]
+        self._counter += 1
+        self._blocks[key] = (self._counter, block)
+        return block
+
+    def __setitem__(self, key, block):
+        if key in self._blocks:
+            self.size -= self._blocks.pop(key)[1].nbytes
+        # drop the least recently used blocks until the new block fits
+        while self.size + block.nbytes > self.max_size and len(self._blocks) > 0:
+            old_key = min(self._blocks, key=(lambda k: self._blocks[k][0]))
+            self.size -= self._blocks.pop(old_key)[1].nbytes
+        if block.nbytes <= self.max_size:
+            self._counter += 1
+            self._blocks[key] = (self._counter, block)
+            self.size += block.nbytes
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def clear(self):
+        self._blocks.clear()
+        self.size = 0
+
+
+class LazyTrackArray(object):
+    """An array of tracks whose contents are only loaded when indexed.
+
+    The first index is the time step, the remaining indexes correspond to the
+    shape of the array of filenames. Only the tracks and frame blocks that are
+    needed for a given index are read. When a single (plain) track is selected,
+    a read-only view on the memory mapped track file is returned.
+    """
+
+    def __init__(self, database, filenames):
+        """Initialize the lazy array.
+
+        Arguments:
+          database  --  The TrackDatabase that owns this array.
+          filenames  --  An array with filenames, of dtype object.
+        """
+        self.database = database
+        self.filenames = filenames
+        self.num_frames = Track(filenames.flat[0]).size()
+
+    shape = property(lambda self: (self.num_frames,) + self.filenames.shape)
+    ndim = property(lambda self: 1 + len(self.filenames.shape))
+
+    def __len__(self):
+        return self.num_frames
+
+    def __array__(self):
+        return self[:]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        frame_key = key[0]
+        filenames = self.filenames[key[1:]]
+
+        # translate the frame key into a range of frames
+        if isinstance(frame_key, slice):
+            start, stop, step = frame_key.indices(self.num_frames)
+            if step < 0:
+                return self[(numpy.arange(start, stop, step),) + key[1:]]
+            return self._read(filenames, start, stop, step)
+        elif isinstance(frame_key, (int, long, numpy.integer)):
+            if frame_key < 0:
+                frame_key += self.num_frames
+            if frame_key < 0 or frame_key >= self.num_frames:
+                raise IndexError("Frame index out of range: %i" % key[0])
+            return self._read(filenames, frame_key, frame_key+1, 1)[0]
+        else:
+            # an array of frame indexes: only read the contiguous runs of
+            # frames that are selected
+            frames = numpy.arange(self.num_frames)[frame_key]
+            if len(frames) == 0:
+                return self._read(filenames, 0, 0, 1)
+            unique, inverse = numpy.unique(frames, return_inverse=True)
+            breaks = (numpy.diff(unique) != 1).nonzero()[0] + 1
+            parts = [
+                self._read(filenames, run[0], run[-1]+1, 1)
+                for run in numpy.split(unique, breaks)
+            ]
+            return numpy.concatenate(parts)[inverse]
+
+    def _read(self, filenames, start, stop, step):
+        # read the frames slice(start, stop, step) of the selected tracks
+        if isinstance(filenames, basestring):
+            if Track(filenames).is_quantized():
+                return self.database.read_columns([filenames], start, stop, step)[:,0]
+            else:
+                return self.database.get_memmap(filenames)[start:stop:step]
+        else:
+            columns = self.database.read_columns(list(filenames.flat), start, stop, step)
+            return columns.reshape((len(columns),) + filenames.shape)
+
+
+class TrackDatabase(object):
+    """A convenient interface to a directory with tracks.
+
+    Atomic tracks are exposed as lazily loaded arrays with shape
+    (frames, atoms, 3), e.g. db.pos[1000:2000, atom_indexes, :] reads only the
+    requested part of the tracks atom.pos.*.{x,y,z}. Other tracks are exposed as
+    lazy one-dimensional arrays, e.g. db.time. The cell vectors are available
+    as db.cell with shape (frames, 3, 3) where each row is a cell vector.
+    """
+
+    def __init__(self, directory="tracks", cache_size=None, block_size=4096):
+        """Initialize the track database.
+
+        Optional arguments:
+          directory  --  The directory with the tracks. [default='tracks']
+          cache_size  --  The maximum number of bytes used to cache frame
+                          blocks. [default=context.default_buffer_size]
+          block_size  --  The number of frames that are read at once from one
+                          track. [default=4096]
+        """
+        self.directory = directory
+        self.cache = BlockCache(cache_size)
+        self.block_size = block_size
+        self._memmaps = {}
+
+    def get_filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def get_atom_indexes(self, middle_word="pos"):
+        """Return the sorted atom indexes for which atomic tracks are present."""
+        prefix = self.get_filename("atom.%s." % middle_word)
+        result = []
+        for filename in glob.glob("%s???????.x" % prefix):
+            try:
+                result.append(int(filename[len(prefix):-2]))
+            except ValueError:
+                pass
+        result.sort()
+        return result
+
+    def get_atoms(self, middle_word="pos"):
+        """Return a lazy array with shape (frames, atoms, 3)."""
+        indexes = self.get_atom_indexes(middle_word)
+        if len(indexes) == 0:
+            raise TrackNotFoundError("No tracks found for atom.%s in %s" % (middle_word, self.directory))
+        filenames = numpy.zeros((len(indexes), 3), object)
+        for i, index in enumerate(indexes):
+            for j, c in enumerate("xyz"):
+                filenames[i,j] = self.get_filename("atom.%s.%07i.%s" % (middle_word, index, c))
+        return LazyTrackArray(self, filenames)
+
+    def get_cell(self, prefix="cell"):
+        """Return a lazy array with shape (frames, 3, 3)."""
+        filenames = numpy.zeros((3, 3), object)
+        for i, v in enumerate("abc"):
+            for j, c in enumerate("xyz"):
+                filenames[i,j] = self.get_filename("%s.%s.%s" % (prefix, v, c))
+        return LazyTrackArray(self, filenames)
+
+    def get_track(self, name):
+        """Return a lazy one-dimensional array for a single track."""
+        filename = self.get_filename(name)
+        if not os.path.isfile(filename):
+            raise TrackNotFoundError("File not found: %s" % filename)
+        return LazyTrackArray(self, numpy.array(filename, object))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name == "cell":
+            return self.get_cell()
+        if len(self.get_atom_indexes(name)) > 0:
+            return self.get_atoms(name)
+        try:
+            return self.get_track(name)
+        except TrackNotFoundError:
+            raise AttributeError("No tracks named %s in %s" % (name, self.directory))
+
+    def __getitem__(self, name):
+        return self.get_track(name)
+
+    def get_memmap(self, filename):
+        """Return a read-only memory map of the data in a track file."""
+        result = self._memmaps.get(filename)
+        if result is None or len(result) != Track(filename).size():
+            result = Track(filename).memmap()
+            self._memmaps[filename] = result
+        return result
+
+    def get_block(self, filename, index, size=None):
+        """Return a block of frames from a track, using the cache.
+
+        The cached blocks are only reused as long as the track has the same
+        size, such that blocks at the end of a growing track are read again.
+        The optional size argument avoids that the size of the track is
+        determined for each block.
+        """
+        if size is None:
+            size = Track(filename).size()
+        key = (filename, index, size)
+        if key in self.cache:
+            return self.cache[key]
+        block = Track(filename).read(slice(index*self.block_size, (index+1)*self.block_size))
+        self.cache[key] = block
+        return block
+
+    def read_columns(self, filenames, start, stop, step=1):
+        """Read frames slice(start, stop, step) of the given tracks.
+
+        Only the frame blocks that overlap with the selected range are read.
+        The result is a two-dimensional array with one column per track.
+        """
+        num = max(0, (stop - start - 1)/step + 1)
+        result = None
+        for column, filename in enumerate(filenames):
+            size = Track(filename).size()
+            row = 0
+            first = start
+            while first < stop:
+                index = first/self.block_size
+                block = self.get_block(filename, index, size)
+                offset = index*self.block_size
+                if result is None:
+                    result = numpy.zeros((num, len(filenames)), block.dtype)
+                last = min(stop, offset + len(block))
+                if last <= first:
+                    break
+                part = block[first-offset:last-offset:step]
+                result[row:row+len(part), column] = part
+                row += len(part)
+                first += len(part)*step
+            if row != num:
+                raise IndexError("Not all tracks contain the requested frames.")
+        if result is None:
+            result = numpy.zeros((num, len(filenames)), float)
+        return result
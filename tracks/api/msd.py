@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+
+import numpy
+
+
+__all__ = ["compute_msd_fft"]
+
+
+def compute_msd_fft(signals):
+    """Compute the mean square displacement of signals with FFTs.
+
+       Arguments:
+         signals  --  A two-dimensional array with one signal in each column,
+                      i.e. with shape (time steps, signals).
+
+       Returns an array with shape (time steps - 1, signals) with the mean
+       square displacement for the time differences 1, 2, ..., averaged over
+       all time origins. It is decomposed in two terms: the average of
+       x(t)**2 + x(t+d)**2, which follows from cumulative sums, and
+       -2*x(t)*x(t+d), an autocorrelation that is computed with zero-padded
+       fast Fourier transforms. The cost is O(N log N) instead of O(N**2) for
+       N time steps, and all columns are transformed in one call.
+    """
+    size = len(signals)
+    # the displacements do not depend on the mean, and without the mean, the
+    # two terms cancel less
+    signals = signals - signals.mean(axis=0)
+    lags = numpy.arange(1, size)
+    sq_sums = numpy.zeros((size + 1, signals.shape[1]), float)
+    sq_sums[1:] = (signals**2).cumsum(axis=0)
+    # the sum of x(t)**2 + x(t+d)**2 over all origins t
+    result = sq_sums[size - lags] + (sq_sums[size] - sq_sums[lags])
+    # the sum of x(t)*x(t+d) over all origins t, without circular overlap
+    fft_size = 2**int(numpy.ceil(numpy.log2(2*size)))
+    transformed = numpy.fft.rfft(signals, fft_size, axis=0)
+    result -= 2*numpy.fft.irfft(abs(transformed)**2, fft_size, axis=0)[1:size]
+    result /= (size - lags).reshape(-1, 1)
+    return result
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+
+from tracks import context
+
+import numpy
+
+
+__all__ = ["compute_pair_histograms"]
+
+
+def _bin_indexes(distances, rmax, nbins):
+    # The same bin indexes as numpy.histogram(distances, nbins, (0, rmax)) for
+    # distances in the range [0, rmax[, including the corrections for rounding
+    # errors near the bin edges.
+    edges = numpy.linspace(0, rmax, nbins + 1)
+    indexes = (distances*(nbins/rmax)).astype(int)
+    indexes[indexes == nbins] -= 1
+    indexes[distances < edges[indexes]] -= 1
+    indexes[(distances >= edges[indexes+1]) & (indexes != nbins - 1)] += 1
+    return indexes
+
+
+def compute_pair_histograms(coordinates, first, second, unit_cells, rmax, nbins, buffer_size=None):
+    """Compute histograms of the distances between pairs of atoms.
+
+       Arguments:
+         coordinates  --  An array with shape (frames, atoms, 3).
+         first, second  --  Arrays with the atom indexes of the pairs. The
+                            relative vectors are coordinates[:,first] -
+                            coordinates[:,second].
+         unit_cells  --  A list with a molmod UnitCell for each frame.
+         rmax  --  The maximum distance.
+         nbins  --  The number of bins in the histograms, from zero to rmax.
+
+       Optional argument:
+         buffer_size  --  The approximate amount of memory (in bytes) used for
+                          the intermediate arrays. The pairs are processed in
+                          tiles that fit in this buffer.
+                          [default=context.default_buffer_size]
+
+       Returns an integer array with shape (frames, nbins). The relative
+       vectors of all pairs in a tile are computed for all frames at once,
+       reduced to the minimum image in fractional coordinates (as in
+       UnitCell.shortest_vector) and all periodic images within rmax are
+       counted.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    num_frames = len(coordinates)
+    matrices = numpy.zeros((num_frames, 3, 3), float)
+    reciprocals = numpy.zeros((num_frames, 3, 3), float)
+    images = set()
+    last_uc = None
+    for i, uc in enumerate(unit_cells):
+        matrices[i] = uc.matrix
+        reciprocals[i] = uc.reciprocal
+        # a constant cell is the same object in every frame
+        if uc is not last_uc:
+            images.update(tuple(image) for image in uc.get_radius_indexes(rmax))
+            last_uc = uc
+    images = numpy.array(sorted(images), float)
+    # the cartesian translations of the periodic images in each frame
+    shifts = numpy.einsum("nij,mj->nmi", matrices, images)
+
+    counts = numpy.zeros(num_frames*nbins, int)
+    offsets = numpy.arange(num_frames)*nbins
+    # about a dozen intermediate values for each pair in each frame
+    tile_size = max(1, buffer_size/(100*max(1, num_frames)))
+    for begin in xrange(0, len(first), tile_size):
+        end = begin + tile_size
+        deltas = coordinates[:,first[begin:end]] - coordinates[:,second[begin:end]]
+        # the columns of the reciprocal matrix are the reciprocal cell vectors
+        fractional = numpy.einsum("nji,npj->npi", reciprocals, deltas)
+        deltas -= numpy.einsum("nij,npj->npi", matrices, numpy.floor(fractional + 0.5))
+        for shift in shifts.transpose((1, 0, 2)):
+            distances = numpy.sqrt(((deltas + shift.reshape((-1, 1, 3)))**2).sum(axis=2))
+            mask = distances < rmax
+            indexes = _bin_indexes(distances[mask], rmax, nbins)
+            indexes += numpy.repeat(offsets, mask.sum(axis=1))
+            counts += numpy.bincount(indexes, minlength=len(counts))
+    return counts.reshape((num_frames, nbins))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+from tracks.core import Error, Track
+from tracks.log import log
+from tracks.util import fix_slice
+from tracks import context
+
+import numpy, os
+
+
+__all__ = [
+    "Bundle", "columns_to_bundle", "bundle_to_columns",
+]
+
+
+class Bundle(object):
+    """A frame-major file with the data of several tracks.
+
+    A bundle is an ordinary track whose data is a flattened two-dimensional
+    array with one row per time step and one column per original track. The
+    names of the original tracks are stored, one per line, in the file
+    ${filename}.columns.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.track = Track(filename)
+
+    def _get_columns_filename(self):
+        return "%s.columns" % self.filename
+
+    columns_filename = property(_get_columns_filename)
+
+    def _get_columns(self):
+        f = file(self.columns_filename)
+        result = [line.strip() for line in f if len(line.strip()) > 0]
+        f.close()
+        return result
+
+    columns = property(_get_columns)
+
+    def create(self, columns, dtype, num_frames):
+        """Create an empty bundle with room for num_frames rows."""
+        f = file(self.columns_filename, "w")
+        for column in columns:
+            print >> f, column
+        f.close()
+        self.track.preallocate(dtype, num_frames*len(columns))
+
+    def memmap(self, mode="r"):
+        """Return a memory map of the bundle with shape (frames, columns)."""
+        num_columns = len(self.columns)
+        data = self.track.memmap(mode)
+        return data.reshape((len(data)/num_columns, num_columns))
+
+    def read(self, sub=None, columns=None):
+        """Read a block of rows from the bundle.
+
+        Optional arguments:
+          sub  --  A slice object to select time steps.
+          columns  --  A list of column indexes.
+        """
+        sub = fix_slice(sub)
+        data = self.memmap()[sub]
+        if columns is not None:
+            data = data[:,columns]
+        return numpy.array(data)
+
+
+def _iter_groups(num_columns, num_jobs):
+    # split the columns into one contiguous group per job
+    group_size = (num_columns - 1)/num_jobs + 1
+    for begin in xrange(0, num_columns, group_size):
+        yield begin, min(begin + group_size, num_columns)
+
+
+def _get_block_size(buffer_size, group_size, itemsize):
+    return max(1, buffer_size/(group_size*itemsize))
+
+
+def _columns_to_bundle_group(args):
+    filenames, begin, end, bundle_filename, sub, buffer_size = args
+    data = Bundle(bundle_filename).memmap("r+")
+    block_size = _get_block_size(buffer_size, end - begin, data.dtype.itemsize)
+    tracks = [Track(filename) for filename in filenames[begin:end]]
+    block = numpy.zeros((block_size, end - begin), data.dtype)
+    for first in xrange(0, len(data), block_size):
+        last = min(first + block_size, len(data))
+        for index, track in enumerate(tracks):
+            track.read_into(block[:,index], slice(
+                sub.start + first*sub.step, sub.start + last*sub.step, sub.step
+            ))
+        data[first:last, begin:end] = block[:last-first]
+    data.flush()
+    return end - begin
+
+
+def _bundle_to_columns_group(args):
+    filenames, begin, end, bundle_filename, sub, buffer_size = args
+    data = Bundle(bundle_filename).memmap()[sub]
+    block_size = _get_block_size(buffer_size, end - begin, data.dtype.itemsize)
+    tracks = [Track(filename, clear=True) for filename in filenames[begin:end]]
+    if len(data) == 0:
+        # write empty tracks
+        for track in tracks:
+            track.append(numpy.zeros(0, data.dtype))
+    for first in xrange(0, len(data), block_size):
+        # copy a block from the bundle into memory, transposed
+        block = numpy.array(data[first:first+block_size, begin:end].transpose())
+        for index, track in enumerate(tracks):
+            track.append(block[index])
+    return end - begin
+
+
+def _run_groups(fn, args_list, num_jobs):
+    if num_jobs == 1:
+        results = [fn(args) for args in args_list]
+    else:
+        from multiprocessing import Pool
+        pool = Pool(num_jobs)
+        try:
+            results = pool.map(fn, args_list)
+        finally:
+            pool.close()
+            pool.join()
+    return sum(results)
+
+
+def columns_to_bundle(filenames, bundle_filename, sub=None, num_jobs=1, buffer_size=None):
+    """Transpose a set of column tracks into a frame-major bundle.
+
+    The transposition is blocked: each job handles a group of columns and
+    copies blocks of frames that fit in buffer_size bytes, such that the memory
+    usage is bounded, independent of the length of the tracks.
+
+    Arguments:
+      filenames  --  The tracks that become the columns of the bundle.
+      bundle_filename  --  The filename of the bundle.
+
+    Optional arguments:
+      sub  --  A slice object to select time steps.
+      num_jobs  --  The number of processes that transpose groups of columns
+                    in parallel. [default=1]
+      buffer_size  --  The memory used by one job in bytes.
+                       [default=context.default_buffer_size]
+    """
+    sub = fix_slice(sub)
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    tracks = [Track(filename) for filename in filenames]
+    dtype = tracks[0].get_header_dtype()
+    for track in tracks:
+        if track.get_header_dtype() != dtype:
+            raise Error("All tracks in a bundle must have the same dtype.")
+    shortest = min(track.size() for track in tracks)
+    num_frames = max(0, (min(shortest, sub.stop) - sub.start - 1)/sub.step + 1)
+
+    directory = os.path.dirname(bundle_filename)
+    if len(directory) > 0 and not os.path.exists(directory):
+        os.makedirs(directory)
+    Bundle(bundle_filename).create(filenames, dtype, num_frames)
+
+    args_list = [
+        (filenames, begin, end, bundle_filename, sub, buffer_size)
+        for begin, end in _iter_groups(len(filenames), num_jobs)
+    ]
+    log("Transposing %i columns with %i frames into %s" % (len(filenames), num_frames, bundle_filename))
+    if num_frames == 0:
+        # an empty track can not be memory mapped
+        return
+    _run_groups(_columns_to_bundle_group, args_list, num_jobs)
+
+
+def bundle_to_columns(bundle_filename, filenames=None, sub=None, num_jobs=1, buffer_size=None):
+    """Transpose a frame-major bundle back into separate column tracks.
+
+    Arguments:
+      bundle_filename  --  The filename of the bundle.
+
+    Optional arguments:
+      filenames  --  The filenames of the output tracks. The default is the
+                     list of columns stored in the bundle.
+      sub  --  A slice object to select time steps.
+      num_jobs  --  The number of processes that transpose groups of columns
+                    in parallel. [default=1]
+      buffer_size  --  The memory used by one job in bytes.
+                       [default=context.default_buffer_size]
+    """
+    sub = fix_slice(sub)
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    bundle = Bundle(bundle_filename)
+    if filenames is None:
+        filenames = bundle.columns
+    elif len(filenames) != len(bundle.columns):
+        raise Error("The bundle %s has %i columns, got %i filenames." % (bundle_filename, len(bundle.columns), len(filenames)))
+    for filename in filenames:
+        directory = os.path.dirname(filename)
+        if len(directory) > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    args_list = [
+        (filenames, begin, end, bundle_filename, sub, buffer_size)
+        for begin, end in _iter_groups(len(filenames), num_jobs)
+    ]
+    log("Transposing %s into %i columns" % (bundle_filename, len(filenames)))
+    _run_groups(_bundle_to_columns_group, args_list, num_jobs)
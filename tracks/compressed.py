@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+"""Reading of compressed trajectory files.
+
+Files whose name ends with .gz, .bz2 or .xz are decompressed on the fly in a
+background thread, such that the decompression overlaps with the parsing of
+the text. Files that consist of independent members, i.e. gzip files in the
+BGZF format (written by bgzip) and bzip2 files with multiple streams (written
+by pbzip2 or lbzip2), are decompressed by several threads at once. The xz
+files are decompressed by the xz program, which also uses several threads
+when the file contains multiple blocks.
+"""
+
+
+from tracks.core import Error
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import threading, Queue, subprocess, zlib, bz2, struct, re, sys
+
+
+__all__ = ["get_compression", "open_input", "DecompressedFile"]
+
+
+def get_compression(filename):
+    """Return 'gz', 'bz2' or 'xz' for a compressed file and None otherwise."""
+    for suffix in "gz", "bz2", "xz":
+        if filename.endswith("." + suffix):
+            return suffix
+    return None
+
+
+def open_input(filename, num_threads=None):
+    """Open a file for reading, decompressing it on the fly when needed.
+
+    Compressed files are recognized by their extension, see get_compression.
+    Other files are opened as usual.
+    """
+    if get_compression(filename) is None:
+        return file(filename, "rb")
+    return DecompressedFile(filename, num_threads)
+
+
+def _iter_pipe_chunks(command, f, chunk_size):
+    # decompress with an external program that reads from f
+    try:
+        process = subprocess.Popen(command, stdin=f, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        raise Error("The program %s is needed to read this file." % command[0])
+    try:
+        while True:
+            text = process.stdout.read(chunk_size)
+            if len(text) == 0:
+                break
+            yield text
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    if process.wait() != 0:
+        raise Error("%s failed: %s" % (command[0], process.stderr.read().strip()))
+
+
+def _iter_gzip_chunks(f, chunk_size):
+    # decompress the members of a gzip file one after the other
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = f.read(chunk_size)
+        if len(data) == 0:
+            break
+        while len(data) > 0:
+            text = decompressor.decompress(data)
+            if len(text) > 0:
+                yield text
+            data = decompressor.unused_data
+            if len(data) > 0:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    text = decompressor.flush()
+    if len(text) > 0:
+        yield text
+
+
+def _is_bgzf(header):
+    # the first extra subfield of a BGZF member contains its size
+    return header[:4] == "\x1f\x8b\x08\x04" and header[12:16] == "BC\x02\x00"
+
+
+def _iter_bgzf_members(f):
+    while True:
+        header = f.read(18)
+        if len(header) == 0:
+            break
+        if len(header) < 18 or not _is_bgzf(header):
+            raise Error("Corrupt member in BGZF file.")
+        size = struct.unpack("<H", header[16:18])[0] + 1
+        yield header + f.read(size - 18)
+
+
+def _decompress_gzip_members(data):
+    result = []
+    while len(data) > 0:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return "".join(result)
+
+
+def _bz2_finished(decompressor):
+    # a BZ2Decompressor only complains about new data after the end of stream
+    try:
+        decompressor.decompress("")
+        return False
+    except EOFError:
+        return True
+
+
+def _iter_bz2_chunks(f, chunk_size):
+    # decompress the streams of a bzip2 file one after the other
+    decompressor = bz2.BZ2Decompressor()
+    while True:
+        data = f.read(chunk_size)
+        if len(data) == 0:
+            break
+        while len(data) > 0:
+            if _bz2_finished(decompressor):
+                decompressor = bz2.BZ2Decompressor()
+            text = decompressor.decompress(data)
+            if len(text) > 0:
+                yield text
+            data = decompressor.unused_data
+
+
+# the header of a bzip2 stream followed by the magic number of the first block
+_bz2_stream_re = re.compile("BZh[1-9]1AY&SY")
+
+
+def _iter_bz2_streams(f, chunk_size):
+    # split the file at the headers of the streams, which are byte-aligned
+    data = ""
+    while True:
+        more = f.read(chunk_size)
+        data += more
+        starts = [match.start() for match in _bz2_stream_re.finditer(data, 1)]
+        if len(more) == 0:
+            starts.append(len(data))
+        begin = 0
+        for end in starts:
+            yield data[begin:end]
+            begin = end
+        data = data[begin:]
+        if len(more) == 0:
+            break
+
+
+def _decompress_bz2_streams(data):
+    result = []
+    while len(data) > 0:
+        decompressor = bz2.BZ2Decompressor()
+        result.append(decompressor.decompress(data))
+        if not _bz2_finished(decompressor):
+            raise Error("Incomplete stream in bzip2 file.")
+        data = decompressor.unused_data
+    return "".join(result)
+
+
+def _iter_units(members, chunk_size):
+    # group small members into units of about chunk_size bytes
+    unit = []
+    size = 0
+    for member in members:
+        unit.append(member)
+        size += len(member)
+        if size >= chunk_size:
+            yield "".join(unit)
+            unit = []
+            size = 0
+    if len(unit) > 0:
+        yield "".join(unit)
+
+
+def _iter_parallel_chunks(units, decompress, num_threads):
+    # Decompress independent units with a pool of threads. (zlib and bz2
+    # release the GIL.) The next batch is decompressed while the results of
+    # the previous batch are consumed.
+    pool = ThreadPool(num_threads)
+    try:
+        pending = None
+        batch = []
+        for unit in units:
+            batch.append(unit)
+            if len(batch) == num_threads:
+                result = pool.map_async(decompress, batch)
+                batch = []
+                if pending is not None:
+                    for text in pending.get():
+                        yield text
+                pending = result
+        if pending is not None:
+            for text in pending.get():
+                yield text
+        for text in pool.map(decompress, batch):
+            yield text
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _iter_chunks(f, compression, num_threads, chunk_size):
+    # iterate over the decompressed contents of f, in chunks of variable size
+    if compression == "xz":
+        return _iter_pipe_chunks(["xz", "-dc", "-T%i" % num_threads], f, chunk_size)
+    if compression == "gz":
+        header = f.read(18)
+        f.seek(0)
+        if num_threads > 1 and _is_bgzf(header):
+            units = _iter_units(_iter_bgzf_members(f), chunk_size)
+            return _iter_parallel_chunks(units, _decompress_gzip_members, num_threads)
+        return _iter_gzip_chunks(f, chunk_size)
+    if compression == "bz2":
+        data = f.read(chunk_size)
+        f.seek(0)
+        if num_threads > 1 and _bz2_stream_re.search(data, 1) is not None:
+            units = _iter_units(_iter_bz2_streams(f, chunk_size), chunk_size)
+            return _iter_parallel_chunks(units, _decompress_bz2_streams, num_threads)
+        return _iter_bz2_chunks(f, chunk_size)
+    raise Error("Unknown compression: %s" % compression)
+
+
+class DecompressedFile(object):
+    """A read-only file object with the decompressed contents of a file.
+
+    The decompression runs in a background thread that stays at most
+    max_chunks chunks ahead of the reader. Only sequential reading is
+    supported: read, readline, iteration over the lines and tell.
+    """
+
+    def __init__(self, filename, num_threads=None, chunk_size=1024*1024, max_chunks=8):
+        """Initialize the decompressed file.
+
+        Arguments:
+          filename  --  A file with the extension .gz, .bz2 or .xz.
+
+        Optional arguments:
+          num_threads  --  The number of threads used for the decompression
+                           of independent members. [default=cpu_count()]
+          chunk_size  --  The number of compressed bytes that are read at
+                          once. [default=1MB]
+          max_chunks  --  The maximum number of decompressed chunks that are
+                          kept in memory. [default=8]
+        """
+        compression = get_compression(filename)
+        if compression is None:
+            raise Error("Unknown compression: %s" % filename)
+        if num_threads is None:
+            num_threads = cpu_count()
+        self.filename = filename
+        self._file = file(filename, "rb")
+        self._chunks = _iter_chunks(self._file, compression, num_threads, chunk_size)
+        self._queue = Queue.Queue(max_chunks)
+        self._closed = threading.Event()
+        self._buffer = ""
+        self._offset = 0 # the position of the reader in the buffer
+        self._position = 0 # the position of the buffer in the decompressed file
+        self._done = False
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        # wait for space in the queue, unless the file is closed
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            try:
+                for chunk in self._chunks:
+                    if not self._put(chunk):
+                        return
+                self._put(None)
+            except Exception, e:
+                self._put(e)
+        finally:
+            self._chunks.close()
+            self._file.close()
+
+    def _fill(self, size):
+        # make sure that size bytes after the offset are in the buffer, unless
+        # the end of the file is reached
+        parts = None
+        available = len(self._buffer) - self._offset
+        while available < size and not self._done:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._done = True
+                break
+            if isinstance(chunk, Exception):
+                self._done = True
+                raise chunk
+            if parts is None:
+                parts = [self._buffer[self._offset:]]
+                self._position += self._offset
+                self._offset = 0
+            parts.append(chunk)
+            available += len(chunk)
+        if parts is not None:
+            self._buffer = "".join(parts)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = sys.maxint
+        self._fill(size)
+        result = self._buffer[self._offset:self._offset+size]
+        self._offset += len(result)
+        return result
+
+    def readline(self):
+        while True:
+            end = self._buffer.find("\n", self._offset)
+            if end >= 0:
+                end += 1
+                break
+            if self._done:
+                end = len(self._buffer)
+                break
+            self._fill(len(self._buffer) - self._offset + 1)
+        result = self._buffer[self._offset:end]
+        self._offset = end
+        return result
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if len(line) == 0:
+            raise StopIteration
+        return line
+
+    def tell(self):
+        return self._position + self._offset
+
+    def close(self):
+        self._closed.set()
+        self._buffer = ""
+        self._offset = 0
+        self._done = True
@@ -33,20 +33,31 @@
 #--
 
 
-from tracks.core import MultiTracksReader, MultiTracksWriter
-from molmod.io import XYZReader, ATRJReader, DLPolyHistoryReader, \
-    DLPolyOutputReader, LAMMPSDumpReader, GroReader, XYZWriter, \
-    CPMDTrajectoryReader
-from molmod.units import angstrom, femtosecond, deg, amu, picosecond, bar
+from tracks.core import MultiTracksReader, MultiTracksWriter, Track, Error, \
+    load_track, dump_track
+from tracks.util import fix_slice
+from tracks.log import log
+from tracks.compressed import get_compression, open_input
+# keeps the pyramids of the tracks up to date, see tracks.core.finish_hooks
+import tracks.pyramid
+from tracks import context
+from molmod.io import DLPolyOutputReader, CPMDTrajectoryReader
+from molmod.units import angstrom, femtosecond, deg, amu, picosecond, bar, \
+    nanometer, kcalmol
 
-import os, numpy, itertools
+import os, re, sys, time, glob, fnmatch, struct, numpy, itertools, \
+    threading, Queue
 
 
 __all__ = [
     "xyz_to_tracks", "cp2k_ener_to_tracks", "cpmd_ener_to_tracks",
     "cp2k_cell_to_tracks", "cp2k_stress_to_tracks", "cpmd_traj_to_tracks",
     "tracks_to_xyz", "atrj_to_tracks", "dlpoly_history_to_tracks",
-    "dlpoly_output_to_tracks",
+    "dlpoly_output_to_tracks", "get_frame_offsets", "get_xyz_frame_offsets",
+    "iter_xyz_frames", "iter_table_blocks", "iter_binary_blocks",
+    "format_table_block", "follow_conversion",
+    "iter_dcd_frames", "dcd_to_tracks", "tracks_to_dcd", "npy_to_tracks",
+    "tracks_to_npy", "get_segment_offsets",
 ]
 
 
@@ -57,102 +68,1209 @@ def iter_real_lines(f):
             yield line
 
 
-def xyz_to_tracks(filename, middle_word, destination, sub=slice(None), file_unit=angstrom, atom_indexes=None, clear=True):
-    """Convert an xyz file into separate tracks."""
-    xyz_reader = XYZReader(filename, sub, file_unit=file_unit)
+def _get_max_errors(**max_errors):
+    # only keep the fields for which a maximum error is given
+    return dict((name, max_error) for name, max_error in max_errors.iteritems() if max_error is not None)
 
-    filenames = []
-    if atom_indexes is None:
-        atom_indexes = range(len(xyz_reader.numbers))
+
+def _read_xyz_num_atoms(f):
+    try:
+        return int(f.readline())
+    except ValueError:
+        raise Error("The first line of an XYZ file must contain the number of atoms.")
+
+
+def _scan_frames(f, begin, lines_per_frame, buffer_size):
+    # Return the offsets of the ends of all complete frames after begin. The
+    # newlines are located with numpy in large blocks of the file.
+    f.seek(begin)
+    ends = []
+    counter = 0 # the number of newlines after begin
+    position = begin
+    last_newline = begin - 1
+    while True:
+        block = f.read(buffer_size)
+        if len(block) == 0:
+            break
+        newlines = numpy.flatnonzero(numpy.frombuffer(block, numpy.uint8) == ord("\n"))
+        if len(newlines) > 0:
+            # the newline that completes the first frame in this block
+            first = (-counter - 1) % lines_per_frame
+            ends.append(newlines[first::lines_per_frame] + (position + 1))
+            last_newline = position + newlines[-1]
+            counter += len(newlines)
+        position += len(block)
+    if counter % lines_per_frame == lines_per_frame - 1 and position > last_newline + 1:
+        # the last line of the file has no newline
+        ends.append(numpy.array([position]))
+    if len(ends) == 0:
+        return numpy.zeros(0, numpy.int64)
+    return numpy.concatenate(ends).astype(numpy.int64)
+
+
+def get_frame_offsets(filename, lines_per_frame, begin=0, buffer_size=None):
+    """Return the byte offsets of the frames in a trajectory file.
+
+    Arguments:
+      filename  --  A text file in which each frame has the same number of
+                    lines.
+      lines_per_frame  --  The number of lines in one frame.
+
+    Optional arguments:
+      begin  --  The offset of the first frame, i.e. the size of the header of
+                 the file. [default=0]
+      buffer_size  --  The size of the blocks in which the file is scanned.
+                       [default=context.default_buffer_size]
+
+    The result contains one element more than the number of complete frames
+    in the file. The last element is the offset of the end of the last frame.
+    The offsets are cached in the track ${filename}.offsets, unless
+    context.cache_frame_offsets is False. The first three elements of the
+    cache are lines_per_frame and the size and the modification time (in
+    microseconds) of the file when it was scanned. When the file has only
+    grown since the last call, e.g. because the simulation is still running,
+    only the new part of the file is scanned.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    stat = os.stat(filename)
+    size = stat.st_size
+    mtime = int(round(stat.st_mtime*1e6))
+    index_filename = filename + ".offsets"
+    f = file(filename, "rb")
+    f.seek(begin)
+    first_word = f.readline().split()[:1]
+
+    offsets = None
+    if context.cache_frame_offsets and os.path.isfile(index_filename):
+        cached = load_track(index_filename)
+        offsets = cached[3:]
+        if len(cached) < 4 or cached[0] != lines_per_frame or offsets[0] != begin:
+            offsets = None
+        elif cached[1] > size or offsets[-1] > size:
+            offsets = None
+        elif cached[1] == size and cached[2] != mtime:
+            # the file was modified without changing its size
+            offsets = None
+        elif offsets[-1] < size:
+            # the file has grown, check that the new part looks like a frame
+            f.seek(offsets[-1])
+            line = f.readline()
+            if line.endswith("\n") and line.split()[:1] != first_word:
+                offsets = None
+    if offsets is None or offsets[-1] < size:
+        if offsets is None:
+            offsets = numpy.array([begin], numpy.int64)
+        ends = _scan_frames(f, offsets[-1], lines_per_frame, buffer_size)
+        offsets = numpy.concatenate([offsets, ends])
+        cached = offsets
+        if len(offsets) > 1 and offsets[-1] == size:
+            f.seek(size - 1)
+            if f.read(1) != "\n":
+                # the last line may still be written, it is scanned again later
+                cached = offsets[:-1]
+        if context.cache_frame_offsets:
+            header = numpy.array([lines_per_frame, size, mtime], numpy.int64)
+            try:
+                dump_track(index_filename, numpy.concatenate([header, cached]))
+            except (IOError, OSError):
+                # the cache is optional, e.g. when the directory is read-only
+                pass
+    f.close()
+    return offsets
+
+
+def get_xyz_frame_offsets(filename, buffer_size=None):
+    """Return the byte offsets of the frames in an XYZ file.
+
+    See get_frame_offsets for more details.
+    """
+    f = file(filename)
+    lines_per_frame = _read_xyz_num_atoms(f) + 2
+    f.close()
+    return get_frame_offsets(filename, lines_per_frame, buffer_size=buffer_size)
+
+
+def _get_line_layout(f, offsets, line_indexes):
+    # Learn the layout of the lines in a frame from the first frame. Return
+    # the number of lines per frame, the byte positions of the selected lines
+    # in a frame and the positions that must contain a newline when a frame
+    # has the same layout. The positions are None when the selected lines are
+    # not much smaller than a frame.
+    f.seek(offsets[0])
+    text = f.read(offsets[1] - offsets[0])
+    lines_per_frame = text.count("\n") + (not text.endswith("\n"))
+    if not text.endswith("\n"):
+        return lines_per_frame, None, None
+    ends = numpy.flatnonzero(numpy.frombuffer(text, numpy.uint8) == ord("\n")) + 1
+    starts = numpy.concatenate([[0], ends[:-1]])
+    positions = numpy.concatenate([numpy.arange(starts[i], ends[i]) for i in line_indexes])
+    if 2*len(positions) > len(text):
+        return lines_per_frame, None, None
+    # the newline before and at the end of each selected line
+    newlines = numpy.concatenate([starts[line_indexes] - 1, ends[line_indexes] - 1])
+    return lines_per_frame, positions, newlines[newlines >= 0]
+
+
+def _select_frame_lines(text, num_frames, lines_per_frame, line_indexes):
+    # the text with only the selected lines of each frame
+    lines = _split_frame_lines(text, num_frames, lines_per_frame)[:,line_indexes]
+    return "\n".join(lines.ravel()) + "\n"
+
+
+def _read_frame_blocks(f, offsets, sub, buffer_size, line_indexes=None):
+    # Iterate over the text of blocks of frames selected by sub. The blocks
+    # take a fraction of the buffer_size because the text and the parsed
+    # words take much more memory than the values. When line_indexes is
+    # given, the text only contains these lines of each frame. For the blocks
+    # in which all frames have the layout of the first frame, only the bytes
+    # of these lines are read, from a memory map of the file. The positions
+    # are relative to the end of a frame, such that only the lines after the
+    # selected lines must have the same size, e.g. not the title of an XYZ
+    # frame.
+    frames = numpy.arange(len(offsets)-1)[sub]
+    if len(frames) == 0:
+        return
+    frame_size = max(1, (offsets[-1] - offsets[0])/(len(offsets) - 1))
+    positions = None
+    if line_indexes is not None:
+        lines_per_frame, positions, newlines = _get_line_layout(f, offsets, line_indexes)
+    if positions is not None:
+        data = numpy.memmap(f, numpy.uint8, "r")
+        lowest = positions.min()
+        # the positions of the characters take more memory than the characters
+        frame_size = 9*len(positions)
+    block_size = max(1, buffer_size/16/frame_size)
+    for first in xrange(0, len(frames), block_size):
+        selection = frames[first:first+block_size]
+        if positions is not None:
+            starts = offsets[selection+1] - (offsets[1] - offsets[0])
+        if positions is not None and (starts + lowest >= offsets[selection]).all():
+            starts = starts.reshape(-1, 1)
+            chars = data[starts + positions]
+            if (data[starts + newlines] == ord("\n")).all() and \
+               (chars == ord("\n")).sum() == len(selection)*len(line_indexes):
+                yield chars.tostring(), len(selection)
+                continue
+        if sub.step == 1:
+            f.seek(offsets[selection[0]])
+            text = f.read(offsets[selection[-1]+1] - offsets[selection[0]])
+        else:
+            parts = []
+            for frame in selection:
+                f.seek(offsets[frame])
+                parts.append(f.read(offsets[frame+1] - offsets[frame]))
+            text = "".join(parts)
+        if line_indexes is not None:
+            text = _select_frame_lines(text, len(selection), lines_per_frame, line_indexes)
+        yield text, len(selection)
+
+
+def _select_block(sub, counter, size):
+    # the slice of a block of size items, after counter items, selected by sub
+    begin = max(0, sub.start - counter)
+    skip = (counter + begin - sub.start) % sub.step
+    if skip > 0:
+        begin += sub.step - skip
+    return slice(begin, min(size, sub.stop - counter), sub.step)
+
+
+def _iter_stream_frame_blocks(f, lines_per_frame, sub, buffer_size):
+    # Iterate over the text of blocks of frames selected by sub, reading the
+    # file sequentially, e.g. when it is decompressed on the fly. The ends of
+    # the frames in each block are located with numpy as in _scan_frames.
+    block_size = max(1, buffer_size/16)
+    counter = 0 # the number of frames before the current block
+    rest = "" # the incomplete frame at the end of the previous block
+    while counter < sub.stop:
+        data = f.read(block_size)
+        text = rest + data
+        if len(text) == 0:
+            break
+        newlines = numpy.flatnonzero(numpy.frombuffer(text, numpy.uint8) == ord("\n"))
+        ends = list(newlines[lines_per_frame-1::lines_per_frame] + 1)
+        if len(data) == 0 and len(newlines) % lines_per_frame == lines_per_frame - 1 and \
+           (len(newlines) == 0 or len(text) > newlines[-1] + 1):
+            # the last line of the file has no newline
+            ends.append(len(text))
+        starts = [0] + ends[:-1]
+        selection = range(len(ends))[_select_block(sub, counter, len(ends))]
+        if len(selection) > 0:
+            if sub.step == 1:
+                yield text[starts[selection[0]]:ends[selection[-1]]], len(selection)
+            else:
+                yield "".join(text[starts[i]:ends[i]] for i in selection), len(selection)
+        counter += len(ends)
+        if len(data) == 0:
+            break
+        if len(ends) > 0:
+            rest = text[ends[-1]:]
+        else:
+            rest = text
+
+
+def _iter_frame_blocks(filename, begin, lines_per_frame, sub, buffer_size, line_indexes=None):
+    # Iterate over the text of blocks of frames selected by sub. Compressed
+    # files are read sequentially, other files with the frame offsets. When
+    # line_indexes is given, the text only contains these lines of each frame.
+    if get_compression(filename) is None:
+        offsets = get_frame_offsets(filename, lines_per_frame, begin, buffer_size)
+        f = file(filename, "rb")
+        blocks = _read_frame_blocks(f, offsets, sub, buffer_size, line_indexes)
+    else:
+        f = open_input(filename)
+        f.read(begin)
+        blocks = _iter_stream_frame_blocks(f, lines_per_frame, sub, buffer_size)
+        if line_indexes is not None:
+            blocks = (
+                (_select_frame_lines(text, num_frames, lines_per_frame, line_indexes), num_frames)
+                for text, num_frames in blocks
+            )
+    try:
+        for text, num_frames in blocks:
+            yield text, num_frames
+    finally:
+        f.close()
+
+
+def _split_frame_lines(text, num_frames, lines_per_frame):
+    # return an object array with the lines of the frames, shape=(frames, lines)
+    lines = text.split("\n")
+    if len(lines) < num_frames*lines_per_frame:
+        raise Error("Incomplete frame in trajectory file.")
+    lines = numpy.array(lines[:num_frames*lines_per_frame], object)
+    return lines.reshape((num_frames, lines_per_frame))
+
+
+class _PipelineError(object):
+    # an exception in one of the threads of a pipeline, passed on to the end
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _run_pipeline(blocks, transform, write, max_blocks=2):
+    # Run a conversion as three stages that work concurrently: the iteration
+    # over raw blocks, the transformation of each block and the writing of the
+    # transformed blocks. The first two stages run in threads and the stages
+    # are connected by queues with at most max_blocks blocks, such that the
+    # throughput approaches that of the slowest stage. The time spent in each
+    # stage, apart from waiting on the other stages, is logged at the end.
+    timings = [0.0, 0.0, 0.0]
+    stopped = threading.Event()
+    end = object()
+
+    def put(queue, item):
+        # wait for space in the queue, unless the pipeline is stopped
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def get(queue):
+        while True:
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                if stopped.is_set():
+                    return end
+
+    def read(output):
+        iterator = iter(blocks)
+        try:
+            while True:
+                start = time.time()
+                try:
+                    block = iterator.next()
+                except StopIteration:
+                    break
+                timings[0] += time.time() - start
+                if not put(output, block):
+                    return
+            put(output, end)
+        except Exception:
+            put(output, _PipelineError(sys.exc_info()))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def run_transform(input, output):
+        try:
+            while True:
+                block = get(input)
+                if block is end or isinstance(block, _PipelineError):
+                    put(output, block)
+                    return
+                start = time.time()
+                block = transform(block)
+                timings[1] += time.time() - start
+                if not put(output, block):
+                    return
+        except Exception:
+            put(output, _PipelineError(sys.exc_info()))
+
+    raw_blocks = Queue.Queue(max_blocks)
+    transformed_blocks = Queue.Queue(max_blocks)
+    threads = [
+        threading.Thread(target=read, args=(raw_blocks,)),
+        threading.Thread(target=run_transform, args=(raw_blocks, transformed_blocks)),
+    ]
+    wall_start = time.time()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            block = get(transformed_blocks)
+            if block is end:
+                break
+            if isinstance(block, _PipelineError):
+                raise block.exc_info[0], block.exc_info[1], block.exc_info[2]
+            start = time.time()
+            write(block)
+            timings[2] += time.time() - start
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
+    log("Time spent in the stages of the conversion: reading %.2fs, parsing %.2fs, writing %.2fs (total %.2fs)" % tuple(timings + [time.time() - wall_start]))
+
+
+def _convert_frames_job(args):
+    # convert a range of frames and write them in the preallocated tracks
+    filename, offsets, sub, filenames, dtype, to_buffer, to_buffer_args, start, buffer_size, line_indexes = args
+    log.verbose = False
+    mtw = MultiTracksWriter(filenames, dtype, buffer_size=dtype.itemsize, clear=False, roots=[])
+    f = file(filename, "rb")
+
+    def write((buffer, num_frames)):
+        mtw.write_buffer(buffer, start[0])
+        start[0] += num_frames
+
+    start = [start]
+    _run_pipeline(
+        _read_frame_blocks(f, offsets, sub, buffer_size, line_indexes),
+        lambda (text, num_frames): (to_buffer(text, num_frames, dtype, *to_buffer_args), num_frames),
+        write
+    )
+    f.close()
+    return start[0]
+
+
+def _get_follow_filename(filenames):
+    # the progress of the follow mode is stored next to the first track
+    directory, name = os.path.split(filenames[0])
+    return os.path.join(directory, ".%s.follow" % name)
+
+
+def _get_num_rows(filename):
+    if os.path.isfile(filename):
+        return Track(filename).size()
+    return 0
+
+
+def _load_follow_state(filenames):
+    # Return the number of frames (or rows) of the input file and the byte
+    # offset up to which it was converted by a previous call in follow mode.
+    # None is returned when the tracks were modified since that call.
+    follow_filename = _get_follow_filename(filenames)
+    if not os.path.isfile(follow_filename):
+        return None
+    done, offset, num_rows = load_track(follow_filename)
+    if num_rows != _get_num_rows(filenames[0]):
+        log("The tracks were modified after the previous conversion. Starting from scratch.")
+        return None
+    return done, offset
+
+
+def _dump_follow_state(filenames, done, offset):
+    dump_track(_get_follow_filename(filenames), numpy.array([done, offset, _get_num_rows(filenames[0])], numpy.int64))
+
+
+def _follow_slice(sub, done, size):
+    # the part of sub after the first done items, limited to size items
+    start = sub.start
+    if done > start:
+        start += ((done - start - 1)/sub.step + 1)*sub.step
+    return slice(start, min(sub.stop, size), sub.step)
+
+
+def follow_conversion(convert, interval=None):
+    """Call convert(), and repeat this every interval seconds when given.
+
+    This is used with the follow mode of the converters, to append the new
+    frames of a growing trajectory file to the tracks until the program is
+    interrupted.
+    """
+    convert()
+    if interval is None:
+        return
+    try:
+        while True:
+            time.sleep(interval)
+            convert()
+    except KeyboardInterrupt:
+        pass
+
+
+def _convert_frames(filename, begin, lines_per_frame, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, follow=False, frame_step=None, line_indexes=None):
+    # In follow mode, only the complete frames after those converted by a
+    # previous call in follow mode are appended to the tracks. The number of
+    # frames and the offset of the next frame are stored next to the tracks.
+    # When filename is a list of restart segments, the overlapping frames are
+    # detected with frame_step, see get_segment_offsets. When line_indexes is
+    # given, to_buffer only gets these lines of each frame, see
+    # _read_frame_blocks.
+    sub = fix_slice(sub)
+    if not isinstance(filename, basestring):
+        if follow:
+            raise Error("Restart segments can not be followed.")
+        _write_segments(filename, begin, lines_per_frame, frame_step, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes)
+        return
+    if not follow:
+        _write_frames(filename, begin, lines_per_frame, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes)
+        return
+    if get_compression(filename) is not None:
+        raise Error("A compressed file can not be followed.")
+    offsets = get_frame_offsets(filename, lines_per_frame, begin, buffer_size)
+    num_frames = len(offsets) - 1
+    if num_frames > 0:
+        f = file(filename, "rb")
+        f.seek(offsets[-1] - 1)
+        if f.read(1) != "\n":
+            # the last frame is still being written
+            num_frames -= 1
+        f.close()
+    done = 0
+    state = _load_follow_state(filenames)
+    if state is not None and state[0] <= num_frames and offsets[state[0]] == state[1]:
+        done = state[0]
+        clear = False
+    sub = _follow_slice(sub, done, num_frames)
+    if sub.start < sub.stop:
+        _write_frames(filename, begin, lines_per_frame, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes)
+    done = max(done, sub.stop)
+    _dump_follow_state(filenames, done, offsets[done])
+
+
+def _write_frames(filename, begin, lines_per_frame, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes=None):
+    # Convert the frames selected by sub into tracks. The function to_buffer
+    # returns an array with the given dtype for the text of a block of frames:
+    # to_buffer(text, num_frames, dtype, *to_buffer_args). With more than one
+    # job, the tracks are preallocated and each process converts a contiguous
+    # range of frames, which it writes at its final position in the tracks.
+    # The result is identical to the conversion in a single process. Quantized
+    # tracks can not be preallocated and compressed files can only be read
+    # sequentially, so these are always converted in one process.
+    if num_jobs == 1 or len(max_errors) > 0 or get_compression(filename) is not None:
+        mtw = MultiTracksWriter(filenames, dtype, clear=clear, max_errors=max_errors)
+        _run_pipeline(
+            _iter_frame_blocks(filename, begin, lines_per_frame, sub, buffer_size, line_indexes),
+            lambda (text, num_frames): to_buffer(text, num_frames, dtype, *to_buffer_args),
+            mtw.dump_buffer
+        )
+        mtw.finish()
+        return
+    offsets = get_frame_offsets(filename, lines_per_frame, begin, buffer_size)
+    _write_pieces([(filename, offsets)], sub, filenames, dtype, to_buffer, to_buffer_args, clear, {}, num_jobs, buffer_size, line_indexes)
+
+
+def _select_pieces(pieces, sub):
+    # Return the part of sub in each piece (filename, offsets) of a
+    # concatenated trajectory, as a slice of the frames in that piece, and the
+    # number of selected frames.
+    result = []
+    counter = 0 # the number of frames before the current piece
+    for filename, offsets in pieces:
+        size = len(offsets) - 1
+        local_sub = _select_block(sub, counter, size)
+        count = len(xrange(local_sub.start, max(0, local_sub.stop), local_sub.step))
+        result.append((filename, offsets, local_sub, count))
+        counter += size
+    return result
+
+
+def _iter_piece_blocks(selections, buffer_size, line_indexes):
+    # the blocks of frames in the selected parts of the pieces, in order
+    for filename, offsets, local_sub, count in selections:
+        f = file(filename, "rb")
+        try:
+            for block in _read_frame_blocks(f, offsets, local_sub, buffer_size, line_indexes):
+                yield block
+        finally:
+            f.close()
+
+
+def _write_pieces(pieces, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes=None):
+    # Convert the frames selected by sub in the concatenation of the pieces
+    # (filename, offsets). With more than one job, the tracks are
+    # preallocated and each process converts a contiguous range of frames
+    # from one piece, which it writes at its final position in the tracks.
+    selections = [selection for selection in _select_pieces(pieces, sub) if selection[3] > 0]
+    if num_jobs == 1 or len(max_errors) > 0:
+        mtw = MultiTracksWriter(filenames, dtype, clear=clear, max_errors=max_errors)
+        _run_pipeline(
+            _iter_piece_blocks(selections, buffer_size, line_indexes),
+            lambda (text, num_frames): to_buffer(text, num_frames, dtype, *to_buffer_args),
+            mtw.dump_buffer
+        )
+        mtw.finish()
+        return
+    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
+    num_frames = sum(selection[3] for selection in selections)
+    start = mtw.preallocate(num_frames)
+    args_list = []
+    job_size = max(1, (num_frames - 1)/num_jobs + 1)
+    for filename, offsets, local_sub, count in selections:
+        for first in xrange(0, count, job_size):
+            last = min(first + job_size, count)
+            job_sub = slice(
+                local_sub.start + first*local_sub.step,
+                local_sub.start + (last-1)*local_sub.step + 1, local_sub.step
+            )
+            args_list.append((
+                filename, offsets, job_sub, filenames, dtype, to_buffer,
+                to_buffer_args, start + first, buffer_size/num_jobs, line_indexes
+            ))
+        start += count
+    log("Converting %i frames in %i processes" % (num_frames, len(args_list)))
+    from multiprocessing import Pool
+    pool = Pool(num_jobs)
+    pool.map(_convert_frames_job, args_list)
+    pool.close()
+    pool.join()
+    mtw.finish()
+
+
+def _get_segments(filename):
+    # the converters accept a single filename or a list of restart segments
+    if isinstance(filename, basestring):
+        return [filename]
+    return list(filename)
+
+
+def _read_frame_step(f, offset, frame_step):
+    # the step (or time) in the first two lines of the frame at offset
+    f.seek(offset)
+    return frame_step([f.readline(), f.readline()])
+
+
+def _count_frames_before(f, offsets, limit, frame_step):
+    # The number of frames whose step is lower than limit. The steps increase
+    # within a segment, so the frames are located with a binary search.
+    low, high = 0, len(offsets) - 1
+    while low < high:
+        middle = (low + high)/2
+        if _read_frame_step(f, offsets[middle], frame_step) < limit:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def get_segment_offsets(filenames, lines_per_frame, frame_step, begin=0, num_jobs=1, buffer_size=None):
+    """Return the frames of restart segments that form one trajectory.
+
+    Arguments:
+      filenames  --  The segments in the order in which they were written.
+                     All segments contain the same number of lines per frame.
+      lines_per_frame  --  The number of lines in one frame.
+      frame_step  --  A function that returns the step (or time) of a frame,
+                      given the first two lines of the frame.
+
+    Optional arguments:
+      begin  --  The offset of the first frame in each segment, or a list
+                 with one offset per segment. [default=0]
+      num_jobs  --  The number of threads that scan the segments for frames.
+                    [default=1]
+      buffer_size  --  See get_frame_offsets.
+
+    A simulation that is restarted from an earlier step overwrites the
+    frames from that step on. Therefore, the frames of a segment that are not
+    before the first step of a later segment are left out. The result is a
+    list of (filename, offsets) pairs, where offsets are the frame offsets as
+    returned by get_frame_offsets, without the frames that are left out.
+    Segments without any remaining frames are not included.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    if not isinstance(begin, list):
+        begin = [begin]*len(filenames)
+    for filename in filenames:
+        if get_compression(filename) is not None:
+            raise Error("Restart segments can not be compressed files: %s" % filename)
+    scan = lambda args: get_frame_offsets(args[0], lines_per_frame, args[1], buffer_size)
+    if num_jobs > 1 and len(filenames) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(num_jobs, len(filenames)))
+        all_offsets = pool.map(scan, zip(filenames, begin))
+        pool.close()
+        pool.join()
+    else:
+        all_offsets = [scan(args) for args in zip(filenames, begin)]
+
+    # go through the segments from the last to the first, and only keep the
+    # frames before the first step of all later segments
+    sizes = []
+    limit = None
+    for filename, offsets in reversed(zip(filenames, all_offsets)):
+        size = len(offsets) - 1
+        if size > 0:
+            f = file(filename, "rb")
+            if limit is not None:
+                size = _count_frames_before(f, offsets, limit, frame_step)
+            if size > 0:
+                first_step = _read_frame_step(f, offsets[0], frame_step)
+                if limit is None or first_step < limit:
+                    limit = first_step
+            f.close()
+        sizes.insert(0, size)
+
+    result = []
+    for filename, offsets, size in zip(filenames, all_offsets, sizes):
+        log("Using %i of the %i frames in %s" % (size, len(offsets) - 1, filename))
+        if size > 0:
+            result.append((filename, offsets[:size+1]))
+    return result
+
+
+def _write_segments(segments, begin, lines_per_frame, frame_step, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes=None):
+    # convert the frames selected by sub in the concatenation of the segments
+    if frame_step is None:
+        raise Error("Restart segments are not supported for this file format.")
+    pieces = get_segment_offsets(segments, lines_per_frame, frame_step, begin, num_jobs, buffer_size)
+    _write_pieces(pieces, sub, filenames, dtype, to_buffer, to_buffer_args, clear, max_errors, num_jobs, buffer_size, line_indexes)
+
+
+_pow10 = 10**numpy.arange(19, dtype=numpy.int64)
+# powers of ten that are exact floats
+_pow10_float = numpy.array([float(10**i) for i in xrange(23)])
+
+
+def _get_fixed_chars(lines):
+    # Return the characters of the lines as an uint8 array with shape
+    # (lines, width), or None when not all lines have the same length.
+    if len(lines) == 0:
+        return None
+    width = len(lines[0])
+    chars = numpy.frombuffer("\n".join(lines) + "\n", numpy.uint8)
+    if len(chars) != len(lines)*(width+1):
+        return None
+    chars = chars.reshape((len(lines), width+1))
+    if (chars[:,width] != ord("\n")).any():
+        return None
+    return chars[:,:width]
+
+
+def _get_fixed_fields(chars, num_fields):
+    # Return the column ranges of the first num_fields right-aligned fields,
+    # based on the word ends in the first line, or None when the fields are
+    # not aligned in all lines.
+    nonspace = chars[0] != ord(" ")
+    ends = numpy.flatnonzero(nonspace & ~numpy.append(nonspace[1:], False)) + 1
+    if len(ends) < num_fields:
+        return None
+    ends = ends[:num_fields]
+    for end in ends:
+        if (chars[:,end-1] == ord(" ")).any():
+            return None
+        if end < chars.shape[1] and (chars[:,end] != ord(" ")).any():
+            return None
+    return zip([0] + list(ends[:-1]), ends)
+
+
+def _parse_fixed_decimals(chars):
+    # Return the mantissas (as integer floats), the numbers of decimals and the
+    # signs of right-aligned decimal numbers without exponent, or None when
+    # the characters can not be parsed.
+    isspace = chars == ord(" ")
+    isdot = chars == ord(".")
+    isminus = chars == ord("-")
+    isdigit = (chars >= ord("0")) & (chars <= ord("9"))
+    issign = isminus | (chars == ord("+"))
+    if not (isspace | isdot | issign | isdigit).all():
+        return None
+    # each line must contain a single number
+    if (~isspace[:,:-1] & isspace[:,1:]).any():
+        return None
+    # a sign must be directly followed by the digits or the decimal point
+    after_space = numpy.concatenate([numpy.ones((len(chars), 1), bool), isspace[:,:-1]], axis=1)
+    before_digits = numpy.concatenate([(isdigit | isdot)[:,1:], numpy.zeros((len(chars), 1), bool)], axis=1)
+    if (issign & ~(after_space & before_digits)).any() or not isdigit.any(axis=1).all():
+        return None
+    width = chars.shape[1]
+    dot = numpy.flatnonzero(isdot[0])
+    if len(dot) == 1 and isdot[:,dot[0]].all() and isdot.sum() == len(chars):
+        # all decimal points are aligned: the value of each digit only
+        # depends on its column
+        dot = dot[0]
+        decimals = width - dot - 1
+        power = decimals + dot - numpy.arange(width) - (numpy.arange(width) < dot)
+        if (isdigit[:,power >= 15]).any():
+            return None
+        weights = 10.0**power
+        weights[dot] = 0.0
+        # all characters other than digits are smaller than '0'
+        digits = (numpy.maximum(chars, ord("0")) - ord("0")).astype(float)
+        mantissa = numpy.dot(digits, weights)
+        decimals = numpy.zeros(len(chars), int) + decimals
     else:
+        num_digits = isdigit.sum(axis=1)
+        if num_digits.min() == 0 or num_digits.max() > 15 or \
+           isdot.sum(axis=1).max() > 1 or isminus.sum(axis=1).max() > 1:
+            return None
+        # the number of digits to the right of each character
+        right = isdigit[:,::-1].cumsum(axis=1)[:,::-1] - isdigit
+        digits = numpy.where(isdigit, chars - ord("0"), 0).astype(numpy.int64)
+        mantissa = (digits*_pow10[right]).sum(axis=1).astype(float)
+        decimals = (right*isdot).sum(axis=1)
+    return mantissa, decimals, isminus.any(axis=1)
+
+
+def _parse_fixed_floats(chars):
+    """Parse a field with right-aligned numbers.
+
+    The argument is an uint8 array with shape (lines, width) and the result is
+    an array with one float per line, which is identical to the result of
+    float(). The numbers are parsed without a Python loop. An exponent (E or D)
+    is only supported when it is in the same column on all lines. None is
+    returned when the field contains something else.
+    """
+    chars = numpy.ascontiguousarray(chars)
+    # an upper case letter becomes lower case, digits and signs are unchanged
+    lower = chars | 32
+    isexp = (lower == ord("e")) | (lower == ord("d"))
+    exponent = 0
+    if isexp.any():
+        column = numpy.flatnonzero(isexp[0])
+        if len(column) != 1 or not isexp[:,column[0]].all() or isexp.sum() != len(chars):
+            return None
+        column = column[0]
+        parsed = _parse_fixed_decimals(numpy.ascontiguousarray(chars[:,column+1:]))
+        if parsed is None or parsed[1].any():
+            return None
+        exponent = numpy.where(parsed[2], -parsed[0], parsed[0]).astype(int)
+        chars = numpy.ascontiguousarray(chars[:,:column])
+    parsed = _parse_fixed_decimals(chars)
+    if parsed is None:
+        return None
+    mantissa, decimals, negative = parsed
+    # the mantissa is an exact integer and the powers of ten are exact, so the
+    # result is correctly rounded
+    scale = decimals - exponent
+    if abs(scale).max() >= len(_pow10_float):
+        return None
+    result = numpy.where(
+        scale >= 0,
+        mantissa/_pow10_float[numpy.maximum(scale, 0)],
+        mantissa*_pow10_float[numpy.maximum(-scale, 0)],
+    )
+    result[negative] *= -1
+    return result
+
+
+def _parse_char_fields(chars, fields):
+    # parse the fields (begin, end) of a character array, or return None
+    result = numpy.zeros((len(chars), len(fields)), float)
+    for i, (begin, end) in enumerate(fields):
+        if begin >= end or end > chars.shape[1]:
+            return None
+        values = _parse_fixed_floats(chars[:,begin:end])
+        if values is None:
+            return None
+        result[:,i] = values
+    return result
+
+
+def _parse_fixed_columns(lines, columns):
+    # parse the given columns of fixed-width lines, or return None
+    chars = _get_fixed_chars(lines)
+    if chars is None:
+        return None
+    fields = _get_fixed_fields(chars, max(columns)+1)
+    if fields is None:
+        return None
+    return _parse_char_fields(chars, [fields[column] for column in columns])
+
+
+def _split_columns(lines, columns):
+    # Parse the given columns of lines with words separated by whitespace.
+    # All lines are split at once, with a marker word in between the lines to
+    # check that all lines have the same number of words. A ValueError is
+    # raised when the lines can not be parsed.
+    words = " | ".join(lines).split()
+    stride = (len(words) + 1)/max(1, len(lines))
+    if stride <= max(columns)+1 or stride*len(lines) != len(words) + 1 or \
+       words[stride-1::stride].count("|") != len(lines) - 1:
+        # not all lines have the same number of words
+        stride = max(columns)+1
+        words = []
+        for line in lines:
+            line_words = line.split()[:stride]
+            if len(line_words) != stride:
+                raise ValueError("Not all lines contain %i words." % stride)
+            words.extend(line_words)
+    result = numpy.zeros((len(lines), len(columns)), float)
+    for i, column in enumerate(columns):
+        result[:,i] = numpy.array(words[column::stride], float)
+    return result
+
+
+def _parse_xyz_block(text, num_frames, lines_per_frame, atom_indexes, selected=False):
+    # Parse all coordinate lines of a block of frames at once. When selected
+    # is True, the text only contains the lines of the atoms in atom_indexes.
+    if selected:
+        lines = _split_frame_lines(text, num_frames, len(atom_indexes)).ravel()
+    else:
+        lines = _split_frame_lines(text, num_frames, lines_per_frame)
+        lines = lines[:,atom_indexes+2].ravel()
+    coordinates = _parse_fixed_columns(lines, [1, 2, 3])
+    if coordinates is None:
+        # free format
+        try:
+            coordinates = _split_columns(lines, [1, 2, 3])
+        except ValueError:
+            raise Error("Could not parse the coordinates in the XYZ file.")
+    return coordinates.reshape((num_frames, len(atom_indexes), 3))
+
+
+def iter_xyz_frames(filename, sub=slice(None), atom_indexes=None, file_unit=angstrom, buffer_size=None):
+    """Iterate over the coordinates in an XYZ file in blocks of frames.
+
+    Each iteration yields an array with shape (frames, atoms, 3) in atomic
+    units, that only contains the frames selected by sub and the atoms in
+    atom_indexes. The frame offsets from get_xyz_frame_offsets are used to
+    read the selected frames directly. Compressed files (see
+    tracks.compressed) are decompressed on the fly and read sequentially. The
+    coordinates of a block of frames are parsed at once, and lines of other
+    atoms are not parsed at all. When all frames have the same size, only the
+    lines of the atoms in atom_indexes are read, see _read_frame_blocks.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    f = open_input(filename)
+    num_atoms = _read_xyz_num_atoms(f)
+    f.close()
+    lines_per_frame = num_atoms + 2
+    selected = atom_indexes is not None
+    if selected:
+        atom_indexes = numpy.array(atom_indexes, int)
+        line_indexes = atom_indexes + 2
+    else:
+        atom_indexes = numpy.arange(num_atoms)
+        line_indexes = None
+    for text, num_frames in _iter_frame_blocks(filename, 0, lines_per_frame, sub, buffer_size, line_indexes):
+        yield _parse_xyz_block(text, num_frames, lines_per_frame, atom_indexes, selected)*file_unit
+
+
+def _xyz_frame_step(lines):
+    # the step or the time in the title of an XYZ frame written by CP2K
+    match = re.search(r"\bi\s*=\s*(-?\d+)", lines[1])
+    if match is None:
+        match = re.search(r"\btime\s*=\s*(\S+?),?(\s|$)", lines[1])
+    if match is None:
+        raise Error("Could not find the step or the time in the title of an XYZ frame: %s" % lines[1].strip())
+    return float(match.group(1))
+
+
+def _xyz_to_buffer(text, num_frames, dtype, lines_per_frame, atom_indexes, selected, file_unit):
+    buffer = numpy.zeros(num_frames, dtype)
+    buffer["cor"] = _parse_xyz_block(text, num_frames, lines_per_frame, atom_indexes, selected)*file_unit
+    return buffer
+
+
+def xyz_to_tracks(filename, middle_word, destination, sub=slice(None), file_unit=angstrom, atom_indexes=None, clear=True, max_error=None, num_jobs=1, follow=False, buffer_size=None):
+    """Convert an xyz file into separate tracks.
+
+    When max_error is given, the tracks are stored in the quantized format
+    with the given maximum absolute error. When num_jobs is larger than one,
+    ranges of frames are converted in parallel processes. When follow is
+    True, only the complete frames that were added to the file since the
+    previous call with follow=True are appended to the tracks. When
+    atom_indexes is given, only the lines of these atoms are read if possible.
+    See iter_xyz_frames for the details of the XYZ reader.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    filenames = []
+    f = open_input(_get_segments(filename)[0])
+    num_atoms = _read_xyz_num_atoms(f)
+    f.close()
+    selected = atom_indexes is not None
+    if selected:
         atom_indexes = list(atom_indexes)
+        line_indexes = numpy.array(atom_indexes, int) + 2
+    else:
+        atom_indexes = range(num_atoms)
+        line_indexes = None
     for index in atom_indexes:
         for cor in ["x", "y", "z"]:
             filenames.append(os.path.join(destination, "atom.%s.%07i.%s" % (middle_word, index, cor)))
 
     shape = (len(atom_indexes),3)
     dtype = numpy.dtype([("cor", float, shape)])
+    _convert_frames(
+        filename, 0, num_atoms + 2, sub, filenames, dtype, _xyz_to_buffer,
+        (num_atoms + 2, numpy.array(atom_indexes, int), selected, file_unit), clear,
+        _get_max_errors(cor=max_error), num_jobs, buffer_size, follow,
+        _xyz_frame_step, line_indexes
+    )
+
+
+def iter_table_blocks(f, columns, sub=slice(None), skip_comments=False, buffer_size=None):
+    """Iterate over blocks of rows in a text file with a table of numbers.
+
+    Arguments:
+      f  --  A file object, e.g. sys.stdin.
+      columns  --  The indexes of the columns that are read.
+
+    Optional arguments:
+      sub  --  A slice object that selects the lines. [default=slice(None)]
+      skip_comments  --  When True, comments (after a '#') and empty lines
+                         are ignored. They do not count for sub.
+                         [default=False]
+      buffer_size  --  The size of the blocks of lines that are parsed at
+                       once, in bytes. [default=context.default_buffer_size]
+
+    Each iteration yields an array with shape (rows, len(columns)). The words
+    of a block of lines are split and converted to floats at once.
+    """
+    for lines in _iter_line_blocks(f, columns, sub, skip_comments, buffer_size):
+        yield _parse_table_block(lines, columns)
+
+
+def _iter_line_blocks(f, columns, sub, skip_comments, buffer_size):
+    # iterate over the blocks of lines selected by sub, without parsing them
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    # the text of a line takes much more memory than the values
+    block_size = max(1, buffer_size/16/(8*(max(columns)+1)))
+    counter = 0 # the number of lines before the current block
+    while counter < sub.stop:
+        block = list(itertools.islice(f, min(block_size, sub.stop - counter)))
+        if len(block) == 0:
+            break
+        if skip_comments:
+            # only look at the individual lines when there are comments
+            if "#" in "".join(block):
+                block = [line[:line.find("#")] if "#" in line else line for line in block]
+            block = [line for line in block if line.strip()]
+        selection = block[_select_block(sub, counter, len(block))]
+        counter += len(block)
+        if len(selection) > 0:
+            yield selection
+
+
+def _parse_table_block(lines, columns):
+    try:
+        return _split_columns(lines, columns)
+    except ValueError:
+        raise Error("Could not read %i numbers from each line." % (max(columns)+1))
+
+
+def iter_binary_blocks(f, num_columns, sub=slice(None), buffer_size=None):
+    """Iterate over blocks of rows in a raw binary file with a table of numbers.
+
+    Arguments:
+      f  --  A file object, e.g. sys.stdin.
+      num_columns  --  The number of double precision floating point numbers
+                       in one row. They are stored in the native byte order.
+
+    Optional arguments:
+      sub  --  A slice object that selects the rows. [default=slice(None)]
+      buffer_size  --  The size of the blocks that are read at once, in bytes.
+                       [default=context.default_buffer_size]
+
+    Each iteration yields an array with shape (rows, num_columns).
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    row_size = 8*num_columns
+    block_size = max(1, buffer_size/row_size)
+    counter = 0 # the number of rows before the current block
+    while counter < sub.stop:
+        data = f.read(min(block_size, sub.stop - counter)*row_size)
+        if len(data) % row_size != 0:
+            raise Error("The binary input does not contain a whole number of rows with %i values." % num_columns)
+        if len(data) == 0:
+            break
+        block = numpy.frombuffer(data, float).reshape((-1, num_columns))
+        selection = block[_select_block(sub, counter, len(block))]
+        counter += len(block)
+        if len(selection) > 0:
+            yield selection
+
+
+def format_table_block(columns, formats):
+    """Format a block of rows as text, with one call to the % operator.
+
+    Arguments:
+      columns  --  A list with one array per column. All arrays have the same
+                   length, i.e. the number of rows.
+      formats  --  A list with a format string for each column, e.g. '%i' or
+                   '%.6e'.
+
+    The columns of a row are tab separated and each row ends with a newline.
+    """
+    num_rows = len(columns[0])
+    values = numpy.zeros((num_rows, len(columns)), object)
+    for index, column in enumerate(columns):
+        values[:,index] = column
+    row_format = "\t".join(formats) + "\n"
+    return (row_format*num_rows) % tuple(values.ravel().tolist())
+
+
+class _CompleteLines(object):
+    # Iterate over the complete lines of a file that may still be growing.
+    # The size of these lines and the number of rows in the table (lines that
+    # are not empty and not a comment, if skip_comments is True) are counted.
+    def __init__(self, f, skip_comments):
+        self.f = f
+        self.skip_comments = skip_comments
+        self.size = 0
+        self.rows = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.f.next()
+        if not line.endswith("\n"):
+            raise StopIteration
+        self.size += len(line)
+        if not self.skip_comments or len(line[:line.find("#")].strip()) > 0:
+            self.rows += 1
+        return line
+
+
+def _convert_table(filename, filenames, dtype, columns, skip_comments, to_buffer, sub, clear, follow, buffer_size):
+    # Convert the rows selected by sub from a table into tracks. The function
+    # to_buffer returns an array with the given dtype for a block of values:
+    # to_buffer(values, dtype). In follow mode, only the complete lines after
+    # those converted by a previous call in follow mode are appended.
+    sub = fix_slice(sub)
+    if follow:
+        if get_compression(filename) is not None:
+            raise Error("A compressed file can not be followed.")
+        f = file(filename, "rb")
+        done, offset = 0, 0
+        state = _load_follow_state(filenames)
+        if state is not None and 0 < state[1] <= os.path.getsize(filename):
+            f.seek(state[1] - 1)
+            if f.read(1) == "\n":
+                done, offset = state
+                clear = False
+        f.seek(offset)
+        lines = _CompleteLines(f, skip_comments)
+        sub = _follow_slice(sub, done, sys.maxint)
+        sub = slice(sub.start - done, sub.stop - done, sub.step)
+    else:
+        f = lines = open_input(filename)
     mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    for title, coordinates in xyz_reader:
-        mtw.dump_row((coordinates[atom_indexes],))
+    _run_pipeline(
+        _iter_line_blocks(lines, columns, sub, skip_comments, buffer_size),
+        lambda block: to_buffer(_parse_table_block(block, columns), dtype),
+        mtw.dump_buffer
+    )
     mtw.finish()
+    f.close()
+    if follow:
+        _dump_follow_state(filenames, done + lines.rows, offset + lines.size)
 
 
-def cp2k_ener_to_tracks(filename, destination, sub=slice(None), clear=True):
-    """Convert a cp2k energy file into separate tracks."""
+def _columns_to_buffer(values, dtype):
+    buffer = numpy.zeros(len(values), dtype)
+    for i, name in enumerate(dtype.names):
+        buffer[name] = values[:,i]
+    return buffer
+
+
+def _cp2k_ener_to_buffer(values, dtype):
+    values[:,1] *= femtosecond
+    return _columns_to_buffer(values, dtype)
+
+
+def cp2k_ener_to_tracks(filename, destination, sub=slice(None), clear=True, follow=False, buffer_size=None):
+    """Convert a cp2k energy file into separate tracks.
+
+    When follow is True, only the new complete lines are appended, see
+    xyz_to_tracks.
+    """
     names = ["step", "time", "kinetic_energy", "temperature", "potential_energy", "conserved_quantity"]
     filenames = list(os.path.join(destination, name) for name in names)
     dtypes = [int, float, float, float, float, float]
     dtype = numpy.dtype([  (name, t, 1) for name, t in zip(names, dtypes)  ])
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    f = file(filename)
-    for line in itertools.islice(iter_real_lines(f), sub.start, sub.stop, sub.step):
-        row = [float(word) for word in line.split()[:6]]
-        row[1] = row[1]*femtosecond
-        mtw.dump_row(tuple(row))
-    f.close()
-    mtw.finish()
+    _convert_table(filename, filenames, dtype, range(6), True, _cp2k_ener_to_buffer, sub, clear, follow, buffer_size)
 
 
-def cpmd_ener_to_tracks(filename, destination, sub=slice(None), clear=True):
+def cpmd_ener_to_tracks(filename, destination, sub=slice(None), clear=True, follow=False, buffer_size=None):
     """Convert a cp2k energy file into separate tracks."""
     names = ["step", "fict_kinectic_energy", "temperature", "potential_energy", "classical_energy", "hamiltonian_energy", "ms_displacement"]
     filenames = list(os.path.join(destination, name) for name in names)
     dtypes = [int, float, float, float, float, float, float]
     dtype = numpy.dtype([  (name, t, 1) for name, t in zip(names, dtypes)  ])
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    f = file(filename)
-    for line in itertools.islice(f, sub.start, sub.stop, sub.step):
-        row = tuple(float(word) for word in line.split()[:7])
-        mtw.dump_row(row)
-    f.close()
-    mtw.finish()
+    _convert_table(filename, filenames, dtype, range(7), False, _columns_to_buffer, sub, clear, follow, buffer_size)
+
+
+def _cell_norms_angles(cells):
+    # Return the lengths of the cell vectors and the angles alpha, beta and
+    # gamma for an array of cell matrices with shape (frames, 3, 3), in which
+    # the columns are the cell vectors.
+    norms = numpy.sqrt((cells**2).sum(axis=1))
+    angles = numpy.zeros(norms.shape, float)
+    for i in xrange(3):
+        j, k = (i+1)%3, (i+2)%3
+        cos = (cells[:,:,j]*cells[:,:,k]).sum(axis=1)/norms[:,j]/norms[:,k]
+        angles[:,i] = numpy.arccos(numpy.clip(cos, -1, 1))
+    return norms, angles
+
 
+def _cp2k_cell_to_buffer(values, dtype):
+    buffer = numpy.zeros(len(values), dtype)
+    buffer["step"] = values[:,0]
+    buffer["time"] = values[:,1]*femtosecond
+    cells = values[:,2:11].reshape((-1,3,3)).transpose((0,2,1))*angstrom
+    buffer["cell"] = cells
+    buffer["volume"] = values[:,11]*angstrom**3
+    buffer["norms"], buffer["angles"] = _cell_norms_angles(cells)
+    return buffer
 
-def cp2k_cell_to_tracks(filename, destination, sub=slice(None), clear=True):
+
+def cp2k_cell_to_tracks(filename, destination, sub=slice(None), clear=True, follow=False, buffer_size=None):
     names = ["step", "time", "cell.a.x", "cell.a.y", "cell.a.z", "cell.b.x", "cell.b.y", "cell.b.z", "cell.c.x", "cell.c.y", "cell.c.z", "volume", "cell.a", "cell.b", "cell.c", "cell.alpha", "cell.beta", "cell.gamma"]
     filenames = list(os.path.join(destination, name) for name in names)
     dtype = numpy.dtype([("step", int),("time", float),("cell", float, (3,3)),("volume", float),("norms", float, 3),("angles", float, 3)])
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    f = file(filename)
-    for line in itertools.islice(iter_real_lines(f), sub.start, sub.stop, sub.step):
-        values = [float(word) for word in line.split()[:12]]
-        row = [int(values[0]),values[1]*femtosecond]
-        cell = numpy.array(values[2:11]).reshape(3,3).transpose()*angstrom
-        row.append(cell)
-        row.append(values[11] * angstrom**3)
-        norms = numpy.sqrt((cell**2).sum(axis=0))
-        row.append(norms)
-        alpha = numpy.arccos(numpy.clip(numpy.dot(cell[:,1],cell[:,2])/norms[1]/norms[2], -1,1))
-        beta = numpy.arccos(numpy.clip(numpy.dot(cell[:,2],cell[:,0])/norms[2]/norms[0], -1,1))
-        gamma = numpy.arccos(numpy.clip(numpy.dot(cell[:,0],cell[:,1])/norms[0]/norms[1], -1,1))
-        row.append(numpy.array([alpha,beta,gamma]))
-        mtw.dump_row(tuple(row))
-    f.close()
-    mtw.finish()
+    _convert_table(filename, filenames, dtype, range(12), True, _cp2k_cell_to_buffer, sub, clear, follow, buffer_size)
 
 
-def cp2k_stress_to_tracks(filename, destination, sub=slice(None), clear=True):
+def _cp2k_stress_to_buffer(values, dtype):
+    buffer = numpy.zeros(len(values), dtype)
+    buffer["step"] = values[:,0]
+    buffer["time"] = values[:,1]*femtosecond
+    stress = values[:,2:11].reshape((-1,3,3)).transpose((0,2,1))*bar
+    buffer["stress"] = stress
+    buffer["pressure"] = (stress[:,0,0]+stress[:,1,1]+stress[:,2,2])/3
+    return buffer
+
+
+def cp2k_stress_to_tracks(filename, destination, sub=slice(None), clear=True, follow=False, buffer_size=None):
     names = ["step", "time", "stress.xx", "stress.xy", "stress.xz", "stress.yx", "stress.yy", "stress.yz", "stress.zx", "stress.zy", "stress.zz", "pressure"]
     filenames = list(os.path.join(destination, name) for name in names)
     dtype = numpy.dtype([("step", int),("time", float),("stress", float, (3,3)),("pressure", float)])
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    f = file(filename)
-    for line in itertools.islice(iter_real_lines(f), sub.start, sub.stop, sub.step):
-        values = [float(word) for word in line.split()[:11]]
-        row = [int(values[0]),values[1]*femtosecond]
-        cell = numpy.array(values[2:11]).reshape(3,3).transpose()*bar
-        row.append(cell)
-        row.append((cell[0,0]+cell[1,1]+cell[2,2])/3)
-        mtw.dump_row(tuple(row))
-    f.close()
-    mtw.finish()
+    _convert_table(filename, filenames, dtype, range(11), True, _cp2k_stress_to_buffer, sub, clear, follow, buffer_size)
 
 
-def cpmd_traj_to_tracks(filename, num_atoms, destination, sub=slice(None), atom_indexes=None, clear=True):
+def cpmd_traj_to_tracks(filename, num_atoms, destination, sub=slice(None), atom_indexes=None, clear=True, max_pos_error=None, max_vel_error=None):
     """Convert a cpmd trajectory file into separate tracks.
 
-    num_atoms must be the number of atoms in the system.
+    num_atoms must be the number of atoms in the system. When max_pos_error or
+    max_vel_error are given, the corresponding tracks are stored in the
+    quantized format.
     """
     if atom_indexes is None:
         atom_indexes = range(num_atoms)
@@ -171,7 +1289,8 @@ def cpmd_traj_to_tracks(filename, num_atoms, destination, sub=slice(None), atom_
 
     shape = (len(atom_indexes), 3)
     dtype = numpy.dtype([("pos", float, shape), ("vel", float, shape)])
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
+    max_errors = _get_max_errors(pos=max_pos_error, vel=max_vel_error)
+    mtw = MultiTracksWriter(filenames, dtype, clear=clear, max_errors=max_errors)
 
     ctr = CPMDTrajectoryReader(filename, sub)
     for pos, vel in ctr:
@@ -179,61 +1298,202 @@ def cpmd_traj_to_tracks(filename, num_atoms, destination, sub=slice(None), atom_
     mtw.finish()
 
 
-def tracks_to_xyz(prefix, destination, symbols, sub=slice(None), file_unit=angstrom, atom_indexes=None, unit_cell_iter=None, groups=None):
-    """Converts a set of tracks into an xyz file."""
-    if atom_indexes is None:
-        atom_indexes = range(len(symbols))
+def _reduce_groups(groups, atom_indexes):
+    # reduce the groups to the selected atoms and use the index of the
+    # reduced set.
+    reverse_indexes = dict((atom_index, counter) for counter, atom_index in enumerate(atom_indexes))
+    new_groups = []
+    for group in groups:
+        new_group = []
+        for atom_index in group:
+            new_index = reverse_indexes.get(atom_index)
+            if new_index is not None:
+                new_group.append(new_index)
+        if len(new_group) > 0:
+            new_groups.append(new_group)
+    return new_groups
+
+
+def _get_group_permutation(groups):
+    # Concatenate the groups into one permutation of the atoms, such that the
+    # group centers of a block of frames follow from a single reduceat call.
+    # Return the permutation and the offsets and sizes of the groups in it.
+    sizes = numpy.array([len(group) for group in groups], int)
+    permutation = numpy.array(sum((list(group) for group in groups), []), int)
+    offsets = sizes.cumsum() - sizes
+    return permutation, offsets, sizes
+
+
+def _wrap_coordinates(coordinates, unit_cell_iter, groups):
+    # Wrap a block of coordinates with shape (frames, atoms, 3) in place, with
+    # the next unit cells from unit_cell_iter. The groups argument is None or
+    # the result of _get_group_permutation. Return the cell matrices.
+    matrices = numpy.zeros((len(coordinates), 3, 3), float)
+    reciprocals = numpy.zeros((len(coordinates), 3, 3), float)
+    for i in xrange(len(coordinates)):
+        try:
+            uc = unit_cell_iter.next()
+        except StopIteration:
+            raise ValueError("Not enough frames in the unit cell tracks.")
+        matrices[i] = uc.matrix
+        reciprocals[i] = uc.reciprocal
+    # the columns of the reciprocal matrix are the reciprocal cell vectors
+    if groups is None:
+        fractional = numpy.einsum("nji,naj->nai", reciprocals, coordinates)
+        coordinates -= numpy.einsum("nij,naj->nai", matrices, numpy.floor(fractional))
     else:
-        atom_indexes = list(atom_indexes)
-        if groups is not None:
-            # reduce the groups to the selected atoms and use the index of the
-            # reduced set.
-            reverse_indexes = dict((atom_index, counter) for counter, atom_index in enumerate(atom_indexes))
-            new_groups = []
-            for group in groups:
-                new_group = []
-                for atom_index in group:
-                    new_index = reverse_indexes.get(atom_index)
-                    if new_index is not None:
-                        new_group.append(new_index)
-                if len(new_group) > 0:
-                    new_groups.append(new_group)
-            groups = new_groups
-    symbols = [symbols[index] for index in atom_indexes]
+        permutation, offsets, sizes = groups
+        if len(permutation) > 0:
+            centers = numpy.add.reduceat(coordinates[:,permutation], offsets, axis=1)
+            centers /= sizes.reshape((1, -1, 1))
+            fractional = numpy.einsum("nji,ngj->ngi", reciprocals, centers)
+            shifts = numpy.einsum("nij,ngj->ngi", matrices, numpy.floor(fractional))
+            coordinates[:,permutation] -= numpy.repeat(shifts, sizes, axis=1)
+    return matrices
+
 
+def _iter_coordinate_blocks(prefix, atom_indexes, sub, unit_cell_iter, groups, buffer_size):
+    # Iterate over blocks of coordinates with shape (frames, atoms, 3) from the
+    # tracks ${prefix}.${index}.{x,y,z}. When unit_cell_iter is given, the
+    # atoms (or the groups of atoms) are wrapped in the periodic cell for a
+    # block of frames at once. Each iteration yields the coordinates and the
+    # cell matrices (or None).
     filenames = []
     for index in atom_indexes:
         for c in 'xyz':
             filenames.append("%s.%07i.%s" % (prefix, index, c))
-
-    f = file(destination, 'w')
-    xyz_writer = XYZWriter(f, symbols, file_unit=file_unit)
+    if groups is not None:
+        groups = _get_group_permutation(groups)
     dtype = numpy.dtype([("cor", float, (len(atom_indexes), 3))])
-    mtr = MultiTracksReader(filenames, dtype, sub=sub)
-    for row in mtr:
-        coordinates = row["cor"]
+    mtr = MultiTracksReader(filenames, dtype, buffer_size=buffer_size, sub=sub)
+    for buffer in mtr.iter_buffers():
+        coordinates = buffer["cor"]
+        matrices = None
         if unit_cell_iter is not None:
-            try:
-                uc = unit_cell_iter.next()
-            except StopIteration:
-                raise ValueError("Not enough frames in the unit cell tracks.")
-            if groups is None:
-                coordinates -= numpy.dot(uc.matrix, numpy.floor(numpy.dot(uc.reciprocal, coordinates.transpose()))).transpose()
-            else:
-                for group in groups:
-                    center = coordinates[group].mean(axis=0)
-                    coordinates[group] -= numpy.dot(uc.matrix, numpy.floor(numpy.dot(uc.reciprocal, center)))
-        xyz_writer.dump("None", coordinates)
+            matrices = _wrap_coordinates(coordinates, unit_cell_iter, groups)
+        yield coordinates, matrices
+
+
+def tracks_to_xyz(prefix, destination, symbols, sub=slice(None), file_unit=angstrom, atom_indexes=None, unit_cell_iter=None, groups=None, buffer_size=None):
+    """Converts a set of tracks into an xyz file.
+
+    The coordinates are read from the tracks ${prefix}.${index}.{x,y,z} in
+    blocks of frames. When unit_cell_iter is given, the atoms (or the groups of
+    atoms) are wrapped in the periodic cell. Each block of frames is formatted
+    at once and written with a single write call, in the same format as
+    molmod's XYZWriter.
+    """
+    if atom_indexes is None:
+        atom_indexes = range(len(symbols))
+    else:
+        atom_indexes = list(atom_indexes)
+    if groups is not None:
+        groups = _reduce_groups(groups, atom_indexes)
+    symbols = [symbols[index] for index in atom_indexes]
+
+    # the format string of one frame, with the title and the symbols filled in
+    frame_format = "% 8i\nNone\n" % len(symbols) + "".join(
+        "% 2s %% 12.9f %% 12.9f %% 12.9f\n" % symbol for symbol in symbols
+    )
+    f = file(destination, 'w')
+    for coordinates, matrices in _iter_coordinate_blocks(prefix, atom_indexes, sub, unit_cell_iter, groups, buffer_size):
+        values = (coordinates/file_unit).ravel().tolist()
+        f.write((frame_format*len(coordinates)) % tuple(values))
     f.close()
 
 
-def atrj_to_tracks(filename, destination, sub=slice(None), atom_indexes=None, clear=True):
-    atrj_reader = ATRJReader(filename, sub)
+def _read_atrj_header(f):
+    # Return the offset of the first frame, the number of atoms, the number of
+    # lines per frame and the indexes of the Time/Energy and the Coordinates
+    # lines in a frame. The layout of the frames is learned from the first
+    # frame.
+    num_atoms = None
+    while True:
+        begin = f.tell()
+        line = f.readline()
+        if len(line) == 0:
+            raise Error("Could not find a frame in the ATRJ file.")
+        if line.startswith("FilNum:"):
+            num_atoms = int(line[line.find(":")+1:].split()[4])
+        elif line.startswith("Frame Number:"):
+            break
+    if num_atoms is None:
+        raise Error("Could not find the number of atoms in the ATRJ file.")
+    labels = {}
+    lines_per_frame = 1
+    while True:
+        line = f.readline()
+        if len(line) == 0 or line.startswith("Frame Number:"):
+            break
+        if not line[:1].isspace():
+            labels.setdefault(line[:line.find(":")], lines_per_frame)
+        lines_per_frame += 1
+    if "Time/Energy" not in labels or "Coordinates" not in labels:
+        raise Error("Could not find the Time/Energy and Coordinates sections in the first frame of the ATRJ file.")
+    return begin, num_atoms, lines_per_frame, labels["Time/Energy"], labels["Coordinates"]
+
+
+def _parse_atrj_block(text, num_frames, atom_indexes):
+    # Parse the times, the steps, the energies and the coordinates of a block
+    # of frames in an ATRJ file. The text only contains the first line, the
+    # Time/Energy line and the coordinate lines of the atoms in atom_indexes
+    # of each frame.
+    lines = _split_frame_lines(text, num_frames, 2 + len(atom_indexes))
+    if not all(line.startswith("Frame Number:") for line in lines[:,0]):
+        raise Error("The frames in the ATRJ file do not have the same layout as the first frame.")
+    words = " ".join(lines[:,1]).split()
+    if len(words) != 4*num_frames or words[::4] != ["Time/Energy:"]*num_frames:
+        raise Error("The Time/Energy line of each frame in the ATRJ file must contain three numbers.")
+    try:
+        times = numpy.array(words[1::4], float)
+        steps = numpy.array(words[2::4], int)
+        energies = numpy.array(words[3::4], float)
+    except ValueError:
+        raise Error("Could not convert all numbers on the Time/Energy line of a frame in the ATRJ file.")
+    atom_lines = lines[:,2:]
+    for i, index in enumerate(atom_indexes):
+        if index == 0:
+            # the first coordinate line starts with the label of the section
+            atom_lines[:,i] = [line[line.find(":")+1:] for line in atom_lines[:,i]]
+    atom_lines = atom_lines.ravel()
+    coordinates = _parse_fixed_columns(atom_lines, [1, 2, 3])
+    if coordinates is None:
+        try:
+            coordinates = _split_columns(atom_lines, [1, 2, 3])
+        except ValueError:
+            raise Error("Could not parse the coordinates in the ATRJ file.")
+    return times, steps, energies, coordinates.reshape((num_frames, len(atom_indexes), 3))
+
+
+def _atrj_to_buffer(text, num_frames, dtype, atom_indexes):
+    times, steps, energies, coordinates = _parse_atrj_block(text, num_frames, atom_indexes)
+    buffer = numpy.zeros(num_frames, dtype)
+    buffer["cor"] = coordinates*angstrom
+    buffer["time"] = times*picosecond
+    buffer["step"] = steps
+    buffer["tote"] = energies*kcalmol
+    return buffer
+
+
+def atrj_to_tracks(filename, destination, sub=slice(None), atom_indexes=None, clear=True, max_pos_error=None, buffer_size=None):
+    """Convert an ATRJ file into separate tracks.
+
+    The positions of the sections in a frame are learned from the first
+    frame. Only the Time/Energy line and the coordinate lines of the atoms in
+    atom_indexes are parsed, and when all frames have the same size, the
+    other lines are not even read. See _read_frame_blocks.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    f = open_input(filename)
+    begin, num_atoms, lines_per_frame, time_line, coordinates_line = _read_atrj_header(f)
+    f.close()
 
     if atom_indexes is None:
-        atom_indexes = range(atrj_reader.num_atoms)
+        atom_indexes = range(num_atoms)
     else:
         atom_indexes = list(atom_indexes)
+    line_indexes = [0, time_line] + [coordinates_line + index for index in atom_indexes]
 
     filenames = []
     fields = []
@@ -250,26 +1510,160 @@ def atrj_to_tracks(filename, destination, sub=slice(None), atom_indexes=None, cl
     fields.append( ("tote", float, 1) )
 
     dtype = numpy.dtype(fields)
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    for frame in atrj_reader:
-        mtw.dump_row((
-           frame.coordinates[atom_indexes],
-           frame.time, frame.step, frame.total_energy
-        ))
-    mtw.finish()
+    _convert_frames(
+        filename, begin, lines_per_frame, sub, filenames, dtype, _atrj_to_buffer,
+        (atom_indexes,), clear, _get_max_errors(cor=max_pos_error), 1,
+        buffer_size, line_indexes=line_indexes
+    )
+
+
+def _read_dlpoly_history_header(f):
+    # Return the offset of the first frame, the number of atoms, keytrj and
+    # imcon. A history restart file has no header and starts with a frame
+    # line.
+    line = f.readline()
+    words = line.split()
+    if len(words) == 6 and words[0] == "timestep" and \
+       all(word.isdigit() for word in words[1:5]):
+        try:
+            float(words[5])
+            return 0, int(words[2]), int(words[3]), int(words[4])
+        except ValueError:
+            pass
+    try:
+        keytrj, imcon, num_atoms = (int(word) for word in f.readline().split())
+    except ValueError:
+        raise Error("The second line of a DL_POLY history file must contain three integers.")
+    return f.tell(), num_atoms, keytrj, imcon
+
+
+def _dlpoly_history_slice(sub):
+    # The frames in a DL_POLY history file are counted from one, as in the
+    # molmod reader, so return the equivalent slice that counts from zero.
+    sub = fix_slice(sub)
+    start = sub.start
+    if start < 1:
+        # the first frame in the slice that exists
+        start += ((sub.step - start)/sub.step)*sub.step
+    stop = sub.stop
+    if stop != sys.maxint:
+        stop -= 1
+        if stop < start:
+            # nothing is selected, but a stop of zero would mean no stop
+            return slice(start, start, sub.step)
+    return slice(start - 1, stop, sub.step)
+
+
+def _parse_dlpoly_vectors(lines):
+    # Parse three floats on each line. The fields are right-aligned in
+    # columns of twelve characters, unless the lines are in free format.
+    chars = _get_fixed_chars(lines)
+    if chars is not None:
+        fields = _get_fixed_fields(chars, 3)
+        if fields is None:
+            fields = [(0, 12), (12, 24), (24, chars.shape[1])]
+        values = _parse_char_fields(chars, fields)
+        if values is not None:
+            return values
+    try:
+        return _split_columns(lines, [0, 1, 2])
+    except ValueError:
+        raise Error("Expecting three floating point values on each cell and atom line of the DL_POLY history file.")
+
+
+def _parse_dlpoly_history_block(text, num_frames, num_atoms, keytrj, imcon, atom_indexes, selected=False):
+    # Parse the steps, the time steps, the cell vectors and the atom vectors
+    # of a block of frames in a DL_POLY history file. When selected is True,
+    # the text only contains the first four lines of each frame and the lines
+    # of the atoms in atom_indexes.
+    lines_per_atom = keytrj + 2
+    if selected:
+        num_rows, rows = len(atom_indexes), numpy.arange(len(atom_indexes))
+    else:
+        num_rows, rows = num_atoms, atom_indexes
+    lines = _split_frame_lines(text, num_frames, 4 + num_rows*lines_per_atom)
+    words = " ".join(lines[:,0]).split()
+    if len(words) != 6*num_frames or words[::6] != ["timestep"]*num_frames:
+        raise Error("The first line of each time frame must contain 6 words, starting with 'timestep'.")
+    try:
+        steps = numpy.array(words[1::6], int)
+        if (numpy.array(words[2::6], int) != num_atoms).any():
+            raise Error("The number of atoms has changed in the DL_POLY history file.")
+        if (numpy.array(words[3::6], int) != keytrj).any():
+            raise Error("keytrj has changed in the DL_POLY history file.")
+        if (numpy.array(words[4::6], int) != imcon).any():
+            raise Error("imcon has changed in the DL_POLY history file.")
+        timesteps = numpy.array(words[5::6], float)
+    except ValueError:
+        raise Error("Could not convert all numbers on the first line of a time frame.")
+    cells = _parse_dlpoly_vectors(lines[:,1:4].ravel()).reshape((num_frames, 3, 3))
+    # each cell line contains a cell vector
+    cells = cells.transpose((0, 2, 1))
+    atom_lines = lines[:,4:].reshape((num_frames, num_rows, lines_per_atom))[:,rows]
+    vectors = []
+    for i in xrange(1, lines_per_atom):
+        vectors.append(_parse_dlpoly_vectors(atom_lines[:,:,i].ravel()).reshape((num_frames, len(atom_indexes), 3)))
+    return steps, timesteps, cells, vectors
+
+
+def _dlpoly_history_to_buffer(text, num_frames, dtype, num_atoms, keytrj, imcon, atom_indexes, selected, units, time_unit):
+    steps, timesteps, cells, vectors = _parse_dlpoly_history_block(
+        text, num_frames, num_atoms, keytrj, imcon, atom_indexes, selected
+    )
+    buffer = numpy.zeros(num_frames, dtype)
+    buffer["step"] = steps
+    buffer["time"] = timesteps*time_unit*steps
+    cells *= units[0]
+    buffer["cell"] = cells
+    buffer["norms"], buffer["angles"] = _cell_norms_angles(cells)
+    for name, values, unit in zip(["pos", "vel", "frc"], vectors, units):
+        buffer[name] = values*unit
+    return buffer
+
+
+def _dlpoly_history_frame_step(lines):
+    # the step in the first line of a DL_POLY history frame
+    return int(lines[0].split()[1])
 
 
 def dlpoly_history_to_tracks(
     filename, destination, sub=slice(None), atom_indexes=None, clear=True,
     pos_unit=angstrom, vel_unit=angstrom/picosecond, frc_unit=amu*angstrom/picosecond**2, time_unit=picosecond,
-    mass_unit=amu
+    mass_unit=amu, max_pos_error=None, max_vel_error=None, num_jobs=1, follow=False, buffer_size=None
 ):
-    hist_reader = DLPolyHistoryReader(filename, sub, pos_unit, vel_unit, frc_unit, time_unit, mass_unit)
+    """Convert a DL_POLY history file into separate tracks.
 
-    if atom_indexes is None:
-        atom_indexes = range(hist_reader.num_atoms)
-    else:
+    The frames selected by sub are counted from one, as in DL_POLY and the
+    molmod reader. They are read directly with the offsets from
+    get_frame_offsets, or sequentially from a compressed file. The cell and
+    atom lines of a block of frames are parsed at once, and the lines of atoms
+    that are not in atom_indexes are not parsed at all. When all frames have
+    the same size, they are not even read. When num_jobs is
+    larger than one, ranges of frames are converted in parallel processes.
+    When follow is True, only the new complete frames are appended, see
+    xyz_to_tracks. The masses are not stored, so mass_unit is not used.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    begins = []
+    for segment in _get_segments(filename):
+        f = open_input(segment)
+        begin, num_atoms, keytrj, imcon = _read_dlpoly_history_header(f)
+        f.close()
+        begins.append(begin)
+    if not isinstance(filename, basestring):
+        # each restart segment may have its own header
+        begin = begins
+
+    selected = atom_indexes is not None
+    if selected:
         atom_indexes = list(atom_indexes)
+        line_indexes = range(4) + [
+            4 + index*(keytrj + 2) + i for index in atom_indexes for i in xrange(keytrj + 2)
+        ]
+    else:
+        atom_indexes = range(num_atoms)
+        line_indexes = None
 
     filenames = []
     fields = []
@@ -292,34 +1686,26 @@ def dlpoly_history_to_tracks(
         for cor in "xyz":
             filenames.append(os.path.join(destination, "atom.pos.%07i.%s" % (index, cor)))
     fields.append( ("pos", float, (len(atom_indexes),3)) )
-    if hist_reader.keytrj > 0:
+    if keytrj > 0:
         for index in atom_indexes:
             for cor in "xyz":
                 filenames.append(os.path.join(destination, "atom.vel.%07i.%s" % (index, cor)))
         fields.append( ("vel", float, (len(atom_indexes),3)) )
-    if hist_reader.keytrj > 1:
+    if keytrj > 1:
         for index in atom_indexes:
             for cor in "xyz":
                 filenames.append(os.path.join(destination, "atom.frc.%07i.%s" % (index, cor)))
         fields.append( ("frc", float, (len(atom_indexes),3)) )
 
     dtype = numpy.dtype(fields)
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    for frame in hist_reader:
-        cell = frame["cell"]
-        norms = numpy.sqrt((cell**2).sum(axis=0))
-        frame["norms"] = norms
-        alpha = numpy.arccos(numpy.clip(numpy.dot(cell[:,1],cell[:,2])/norms[1]/norms[2], -1,1))
-        beta = numpy.arccos(numpy.clip(numpy.dot(cell[:,2],cell[:,0])/norms[2]/norms[0], -1,1))
-        gamma = numpy.arccos(numpy.clip(numpy.dot(cell[:,0],cell[:,1])/norms[0]/norms[1], -1,1))
-        frame["angles"] = [alpha, beta, gamma]
-        frame["pos"] = frame["pos"][atom_indexes]
-        if hist_reader.keytrj > 0:
-            frame["vel"] = frame["vel"][atom_indexes]
-        if hist_reader.keytrj > 0:
-            frame["frc"] = frame["frc"][atom_indexes]
-        mtw.dump_row(tuple(frame[name] for name, type, shape in fields))
-    mtw.finish()
+    max_errors = _get_max_errors(pos=max_pos_error, vel=max_vel_error)
+    lines_per_frame = 4 + num_atoms*(keytrj + 2)
+    _convert_frames(
+        filename, begin, lines_per_frame, _dlpoly_history_slice(sub), filenames, dtype, _dlpoly_history_to_buffer,
+        (num_atoms, keytrj, imcon, atom_indexes, selected, [pos_unit, vel_unit, frc_unit], time_unit),
+        clear, max_errors, num_jobs, buffer_size, follow, _dlpoly_history_frame_step,
+        line_indexes
+    )
 
 
 def dlpoly_output_to_tracks(
@@ -348,17 +1734,90 @@ def dlpoly_output_to_tracks(
     mtw.finish()
 
 
-def lammps_dump_to_tracks(filename, destination, meta, sub=slice(None), clear=True):
+def _read_lammps_header(f):
+    # Return the number of atoms and the column labels of the atoms section
+    # (if any) from the header of the first frame.
+    lines = [f.readline().strip() for i in xrange(9)]
+    if lines[0] != "ITEM: TIMESTEP" or lines[2] != "ITEM: NUMBER OF ATOMS" or \
+       not lines[4].startswith("ITEM: BOX BOUNDS") or not lines[8].startswith("ITEM: ATOMS"):
+        raise Error("Unexpected header in LAMMPS dump file.")
+    try:
+        num_atoms = int(lines[3])
+    except ValueError:
+        raise Error("Could not read the number of atoms. Expected an integer. Got '%s'" % lines[3])
+    return num_atoms, lines[8].split()[2:]
+
+
+def _parse_lammps_block(text, num_frames, num_atoms, id_column, columns):
+    # Parse the steps and the selected columns of a block of frames. The atoms
+    # in each frame are sorted by their id.
+    lines = _split_frame_lines(text, num_frames, num_atoms+9)
+    for line in lines[:,0]:
+        if line.strip() != "ITEM: TIMESTEP":
+            raise Error("Expecting line 'ITEM: TIMESTEP' at the beginning of a time frame.")
+    try:
+        steps = numpy.array([int(line) for line in lines[:,1]])
+    except ValueError:
+        raise Error("Could not read the step number. Expected an integer.")
+    words = " ".join(lines[:,9:].ravel()).split()
+    num_columns = len(words)/(num_frames*num_atoms)
+    if num_columns*num_frames*num_atoms != len(words) or num_columns <= max(columns + [id_column]):
+        raise Error("Not all atom lines in the LAMMPS dump file contain the same number of fields.")
+    shape = (num_frames, num_atoms)
+    values = numpy.zeros(shape + (len(columns),), float)
+    try:
+        order = numpy.array(words[id_column::num_columns], int).reshape(shape).argsort(axis=1)
+        for i, column in enumerate(columns):
+            values[:,:,i] = numpy.array(words[column::num_columns], float).reshape(shape)
+    except ValueError:
+        raise Error("Could not parse the atom fields in the LAMMPS dump file.")
+    return steps, values[numpy.arange(num_frames).reshape(-1,1), order]
 
-    units = []
+
+def _lammps_dump_to_buffer(text, num_frames, dtype, num_atoms, id_column, columns, meta):
+    steps, values = _parse_lammps_block(text, num_frames, num_atoms, id_column, columns)
+    buffer = numpy.zeros(num_frames, dtype)
+    buffer["step"] = steps
+    column = 0
     for unit, name, isvector in meta:
         if isvector:
-            units.extend([unit, unit, unit])
+            for cor in "xyz":
+                buffer["atom.%s.%s" % (name, cor)] = values[:,:,column]*unit
+                column += 1
         else:
-            units.append(unit)
+            buffer["atom.%s" % name] = values[:,:,column]*unit
+            column += 1
+    return buffer
+
 
-    dump_reader = LAMMPSDumpReader(filename, units, sub)
-    num_atoms = dump_reader.num_atoms
+def _lammps_frame_step(lines):
+    # the step on the line after ITEM: TIMESTEP
+    return int(lines[1])
+
+
+def lammps_dump_to_tracks(filename, destination, meta, sub=slice(None), clear=True, num_jobs=1, follow=False, buffer_size=None):
+    """Convert a LAMMPS dump file into separate tracks.
+
+    The argument meta is a list of (unit, name, isvector) tuples that describe
+    the columns in the atoms section after the first column, which contains
+    the atom ids. The atoms are sorted by their id. Only the columns described
+    in meta are parsed, for a block of frames at once. The frames selected by
+    sub are read directly with the offsets from get_frame_offsets, or
+    sequentially from a compressed file. When
+    num_jobs is larger than one, ranges of frames are converted in parallel
+    processes. When follow is True, only the new complete frames are appended,
+    see xyz_to_tracks.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    f = open_input(_get_segments(filename)[0])
+    num_atoms, labels = _read_lammps_header(f)
+    f.close()
+    if "id" in labels:
+        id_column = labels.index("id")
+    else:
+        id_column = 0
+    columns = range(1, 1 + sum((3 if isvector else 1) for unit, name, isvector in meta))
 
     filenames = [os.path.join(destination, "step")]
     fields = [("step", int)]
@@ -381,15 +1840,123 @@ def lammps_dump_to_tracks(filename, destination, meta, sub=slice(None), clear=Tr
 
 
     dtype = numpy.dtype(fields)
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    for frame in dump_reader:
-        mtw.dump_row(tuple(frame))
-    mtw.finish()
+    _convert_frames(
+        filename, 0, num_atoms + 9, sub, filenames, dtype, _lammps_dump_to_buffer,
+        (num_atoms, id_column, columns, meta), clear, {}, num_jobs, buffer_size,
+        follow, _lammps_frame_step
+    )
+
+
+def _get_gro_fields(line):
+    # Return the number of fields (3 without and 6 with velocities) in an
+    # atom line of a gro file, and the column ranges of these fields. The
+    # widths of the fields follow from the distances between the decimal
+    # points. The ranges are None if the fields are not aligned in this way.
+    # As in the molmod reader, the fields are read from column 22 onwards, so
+    # the first two characters of the x field are skipped.
+    num_fields = len(line[22:].split())
+    if num_fields < 3:
+        raise Error("An atom line in a gro file must contain at least three coordinates.")
+    num_fields = 6 if num_fields >= 6 else 3
+    dots = [i for i in xrange(22, len(line)) if line[i] == "."]
+    if len(dots) < num_fields:
+        return num_fields, None
+    width = dots[1] - dots[0]
+    fields = [(20 + i*width, 20 + (i+1)*width) for i in xrange(3)]
+    fields[0] = (22, fields[0][1])
+    if num_fields == 6:
+        vel_width = dots[4] - dots[3]
+        begin = 20 + 3*width
+        fields.extend((begin + i*vel_width, begin + (i+1)*vel_width) for i in xrange(3))
+    return num_fields, fields
+
+
+def _parse_gro_block(text, num_frames, num_atoms, num_fields, columns):
+    # Parse the times, the atom fields and the cells of a block of frames.
+    lines = _split_frame_lines(text, num_frames, num_atoms+3)
+    times = numpy.zeros(num_frames, float)
+    for i, title in enumerate(lines[:,0]):
+        # the time in the title line is optional
+        pos = title.rfind("t=")
+        if pos >= 0:
+            try:
+                times[i] = float(title[pos+2:].split()[0])
+            except (ValueError, IndexError):
+                raise Error("Could not read the time in the title line of a gro file.")
+    try:
+        if (numpy.array(lines[:,1], int) != num_atoms).any():
+            raise Error("The number of atoms must be the same over the entire gro file.")
+    except ValueError:
+        raise Error("The second line of a frame in a gro file must contain the number of atoms.")
+    atom_lines = lines[:,2:num_atoms+2].ravel()
+    values = None
+    if columns is not None:
+        chars = _get_fixed_chars(atom_lines)
+        if chars is not None:
+            values = _parse_char_fields(chars, columns)
+    if values is None:
+        # free format after the atom number
+        try:
+            values = _split_columns([line[22:] for line in atom_lines], range(num_fields))
+        except ValueError:
+            raise Error("Could not parse the atom lines in the gro file.")
+    values = values.reshape((num_frames, num_atoms, num_fields))
+    cells = numpy.zeros((num_frames, 3, 3), float)
+    for i, line in enumerate(lines[:,-1]):
+        try:
+            words = [float(word) for word in line.split()]
+        except ValueError:
+            raise Error("Could not parse the cell line in the gro file.")
+        if len(words) >= 3:
+            cells[i,0,0], cells[i,1,1], cells[i,2,2] = words[:3]
+        if len(words) == 9:
+            cells[i,1,0], cells[i,2,0], cells[i,0,1], cells[i,2,1], cells[i,0,2], cells[i,1,2] = words[3:]
+    return times, values, cells
+
+
+def _gro_to_buffer(text, num_frames, dtype, num_atoms, num_fields, columns):
+    times, values, cells = _parse_gro_block(text, num_frames, num_atoms, num_fields, columns)
+    buffer = numpy.zeros(num_frames, dtype)
+    buffer["time"] = times*picosecond
+    buffer["pos"] = values[:,:,:3]*nanometer
+    if num_fields == 6:
+        buffer["vel"] = values[:,:,3:]*(nanometer/picosecond)
+    buffer["cell"] = cells*nanometer
+    return buffer
+
+
+def _gro_frame_step(lines):
+    # the step or the time in the title of a gro frame
+    match = re.search(r"\bstep=\s*(-?\d+)", lines[0])
+    if match is None:
+        match = re.search(r"\bt=\s*(\S+)", lines[0])
+    if match is None:
+        raise Error("Could not find the step or the time in the title of a gro frame: %s" % lines[0].strip())
+    return float(match.group(1))
 
 
-def gro_to_tracks(filename, destination, sub=slice(None), clear=True):
-    gro_reader = GroReader(filename, sub)
-    num_atoms = gro_reader.num_atoms
+def gro_to_tracks(filename, destination, sub=slice(None), clear=True, max_pos_error=None, max_vel_error=None, num_jobs=1, follow=False, buffer_size=None):
+    """Convert a gro file into separate tracks.
+
+    The frames selected by sub are read directly with the offsets from
+    get_frame_offsets, or sequentially from a compressed file. The atom lines
+    of a block of frames are parsed at
+    once, based on the fixed-width columns of the gro format. The velocities
+    are zero when they are not present in the file. When num_jobs is larger
+    than one, ranges of frames are converted in parallel processes. When
+    follow is True, only the new complete frames are appended, see
+    xyz_to_tracks.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    f = open_input(_get_segments(filename)[0])
+    f.readline()
+    try:
+        num_atoms = int(f.readline())
+    except ValueError:
+        raise Error("The second line of a gro file must contain the number of atoms.")
+    num_fields, columns = _get_gro_fields(f.readline().rstrip("\r\n"))
+    f.close()
 
     names = ["time"]
     fields = [("time", numpy.float32)]
@@ -414,9 +1981,464 @@ def gro_to_tracks(filename, destination, sub=slice(None), clear=True):
 
     dtype = numpy.dtype(fields)
     filenames = [os.path.join(destination, name) for name in names]
-    mtw = MultiTracksWriter(filenames, dtype, clear=clear)
-    for time, pos, vel, cell in gro_reader:
-        mtw.dump_row((time, pos, vel, cell))
+    max_errors = _get_max_errors(pos=max_pos_error, vel=max_vel_error)
+    _convert_frames(
+        filename, 0, num_atoms + 3, sub, filenames, dtype, _gro_to_buffer,
+        (num_atoms, num_fields, columns), clear, max_errors, num_jobs, buffer_size,
+        follow, _gro_frame_step
+    )
+
+
+# the time unit of CHARMM and NAMD
+_akma_time = 48.88821*femtosecond
+
+
+def _read_fortran_record(f, order, name):
+    # read one unformatted Fortran record, with 32-bit record markers
+    marker = f.read(4)
+    if len(marker) != 4:
+        raise Error("Could not read the %s record of the DCD file." % name)
+    size = numpy.frombuffer(marker, order + "i4")[0]
+    data = f.read(size)
+    marker = f.read(4)
+    if len(data) != size or len(marker) != 4 or numpy.frombuffer(marker, order + "i4")[0] != size:
+        raise Error("Corrupt %s record in the DCD file." % name)
+    return data
+
+
+def _read_dcd_header(f):
+    # Return the byte order, the size of the header, the number of atoms, the
+    # first step, the interval between the steps, the time step and whether
+    # the frames contain a unit cell and a fourth dimension.
+    marker = f.read(4)
+    for order in "<", ">":
+        if len(marker) == 4 and numpy.frombuffer(marker, order + "i4")[0] == 84:
+            break
+    else:
+        raise Error("Not a DCD file, or a DCD file with 64-bit record markers.")
+    f.seek(0)
+    data = _read_fortran_record(f, order, "first")
+    if data[:4] != "CORD":
+        raise Error("A DCD file must start with 'CORD'.")
+    icntrl = numpy.frombuffer(data[4:84], order + "i4")
+    if icntrl[8] != 0:
+        raise Error("DCD files with fixed atoms are not supported.")
+    if icntrl[19] != 0:
+        # CHARMM format
+        delta = float(numpy.frombuffer(data[40:44], order + "f4")[0])
+        has_cell = icntrl[10] != 0
+        has_w = icntrl[11] != 0
+    else:
+        # X-PLOR format
+        delta = float(numpy.frombuffer(data[40:48], order + "f8")[0])
+        has_cell = False
+        has_w = False
+    _read_fortran_record(f, order, "title")
+    data = _read_fortran_record(f, order, "number of atoms")
+    if len(data) != 4:
+        raise Error("Corrupt number of atoms record in the DCD file.")
+    num_atoms = int(numpy.frombuffer(data, order + "i4")[0])
+    return order, f.tell(), num_atoms, int(icntrl[1]), int(icntrl[2]), delta, has_cell, has_w
+
+
+def _get_dcd_frame_fields(order, num_atoms, has_cell, has_w):
+    # the records in a frame, including the record markers, and their sizes
+    fields = []
+    records = []
+    if has_cell:
+        fields.extend([("cell_begin", order + "i4"), ("cell", order + "f8", 6), ("cell_end", order + "i4")])
+        records.append(("cell", 48))
+    for c in ("xyzw" if has_w else "xyz"):
+        fields.extend([(c + "_begin", order + "i4"), (c, order + "f4", num_atoms), (c + "_end", order + "i4")])
+        records.append((c, 4*num_atoms))
+    return numpy.dtype(fields), records
+
+
+def _get_dcd_cells(values):
+    # Return the cell matrices, in which the columns are the cell vectors,
+    # for unit cell records [A, gamma, B, beta, alpha, C]. The angles are
+    # cosines in recent CHARMM versions and degrees otherwise.
+    lengths = values[:,[0,2,5]]
+    angles = values[:,[4,3,1]]
+    is_cos = (abs(angles) <= 1).all(axis=1).reshape(-1, 1)
+    cos_alpha, cos_beta, cos_gamma = numpy.where(is_cos, angles, numpy.cos(angles*deg)).transpose()
+    sin_gamma = numpy.sqrt(1 - cos_gamma**2)
+    sin_gamma[sin_gamma == 0] = 1
+    cells = numpy.zeros((len(values), 3, 3), float)
+    cells[:,0,0] = lengths[:,0]
+    cells[:,0,1] = lengths[:,1]*cos_gamma
+    cells[:,1,1] = lengths[:,1]*sin_gamma
+    cells[:,0,2] = lengths[:,2]*cos_beta
+    cells[:,1,2] = lengths[:,2]*(cos_alpha - cos_beta*cos_gamma)/sin_gamma
+    cells[:,2,2] = numpy.sqrt(numpy.clip(lengths[:,2]**2 - cells[:,0,2]**2 - cells[:,1,2]**2, 0, numpy.inf))
+    return cells
+
+
+def iter_dcd_frames(filename, sub=slice(None), atom_indexes=None, buffer_size=None):
+    """Iterate over the frames in a DCD file in blocks of frames.
+
+    Each iteration yields a tuple (steps, pos, cells) for the frames selected
+    by sub. The positions have shape (frames, atoms, 3) and only contain the
+    atoms in atom_indexes. The cells have shape (frames, 3, 3), with the cell
+    vectors as columns, or are None when the file has no unit cell. Both are
+    in atomic units.
+
+    The file is memory mapped and the records of the selected frames and
+    atoms are copied for a block of frames at once, so the skipped frames are
+    not read at all. The record markers of the selected frames are checked.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    f = file(filename, "rb")
+    order, header_size, num_atoms, istart, nsavc, delta, has_cell, has_w = _read_dcd_header(f)
+    f.close()
+    if atom_indexes is None:
+        atom_indexes = numpy.arange(num_atoms)
+    else:
+        atom_indexes = numpy.array(atom_indexes, int)
+    dtype, records = _get_dcd_frame_fields(order, num_atoms, has_cell, has_w)
+    num_frames = (os.path.getsize(filename) - header_size)/dtype.itemsize
+    frames = numpy.arange(num_frames)[sub]
+    if len(frames) == 0:
+        return
+    mmap = numpy.memmap(filename, dtype, "r", header_size, (num_frames,))
+    block_size = max(1, buffer_size/16/(24*len(atom_indexes) + 72))
+    for first in xrange(0, len(frames), block_size):
+        selection = frames[first:first+block_size]
+        for name, size in records:
+            if (mmap[name + "_begin"][selection] != size).any() or \
+               (mmap[name + "_end"][selection] != size).any():
+                raise Error("Corrupt record markers in a frame of the DCD file.")
+        pos = numpy.zeros((len(selection), len(atom_indexes), 3), float)
+        for i, c in enumerate("xyz"):
+            pos[:,:,i] = mmap[c][selection.reshape(-1, 1), atom_indexes]
+        pos *= angstrom
+        if has_cell:
+            cells = _get_dcd_cells(mmap["cell"][selection])*angstrom
+        else:
+            cells = None
+        yield istart + selection*nsavc, pos, cells
+    del mmap
+
+
+def dcd_to_tracks(filename, destination, sub=slice(None), atom_indexes=None, clear=True, max_pos_error=None, buffer_size=None):
+    """Convert a CHARMM/NAMD DCD file into separate tracks.
+
+    The tracks step, time, atom.pos.${index}.{x,y,z} and, when the file
+    contains a unit cell, cell.{a,b,c}.{x,y,z}, cell.{a,b,c} and
+    cell.{alpha,beta,gamma} are written. See iter_dcd_frames for the details
+    of the DCD reader.
+    """
+    f = file(filename, "rb")
+    order, header_size, num_atoms, istart, nsavc, delta, has_cell, has_w = _read_dcd_header(f)
+    f.close()
+    if atom_indexes is None:
+        atom_indexes = range(num_atoms)
+    else:
+        atom_indexes = list(atom_indexes)
+
+    names = ["step", "time"]
+    fields = [("step", int), ("time", float)]
+    if has_cell:
+        names.extend([
+            "cell.a.x", "cell.b.x", "cell.c.x",
+            "cell.a.y", "cell.b.y", "cell.c.y",
+            "cell.a.z", "cell.b.z", "cell.c.z",
+            "cell.a", "cell.b", "cell.c",
+            "cell.alpha", "cell.beta", "cell.gamma",
+        ])
+        fields.extend([("cell", float, (3,3)), ("norms", float, 3), ("angles", float, 3)])
+    for index in atom_indexes:
+        for cor in "xyz":
+            names.append("atom.pos.%07i.%s" % (index, cor))
+    fields.append(("pos", float, (len(atom_indexes), 3)))
+
+    dtype = numpy.dtype(fields)
+    filenames = [os.path.join(destination, name) for name in names]
+
+    def to_buffer((steps, pos, cells)):
+        buffer = numpy.zeros(len(steps), dtype)
+        buffer["step"] = steps
+        buffer["time"] = steps*delta*_akma_time
+        if has_cell:
+            buffer["cell"] = cells
+            buffer["norms"], buffer["angles"] = _cell_norms_angles(cells)
+        buffer["pos"] = pos
+        return buffer
+
+    mtw = MultiTracksWriter(filenames, dtype, clear=clear, max_errors=_get_max_errors(pos=max_pos_error))
+    _run_pipeline(iter_dcd_frames(filename, sub, atom_indexes, buffer_size), to_buffer, mtw.dump_buffer)
     mtw.finish()
 
 
+def _dcd_header(num_frames, istart, nsavc, delta, num_atoms, has_cell):
+    # the header of a DCD file in the CHARMM format, without fixed atoms
+    def record(data):
+        marker = struct.pack("<i", len(data))
+        return marker + data + marker
+    icntrl = [num_frames, istart, nsavc, nsavc*num_frames] + [0]*16
+    icntrl[10] = int(has_cell)
+    icntrl[19] = 24
+    return record("CORD" + struct.pack("<9if10i", *(icntrl[:9] + [delta] + icntrl[10:]))) + \
+        record(struct.pack("<i", 1) + "Created with MD-Tracks".ljust(80)) + \
+        record(struct.pack("<i", num_atoms))
+
+
+def tracks_to_dcd(prefix, destination, sub=slice(None), atom_indexes=None, unit_cell_iter=None, groups=None, buffer_size=None, time_step=None):
+    """Convert a set of tracks into a DCD file.
+
+    The coordinates are read from the tracks ${prefix}.${index}.{x,y,z} in
+    blocks of frames. When atom_indexes is not given, all atoms with tracks
+    are written. When unit_cell_iter is given, the atoms (or the groups of
+    atoms) are wrapped in the periodic cell and the unit cell is included in
+    the frames. Each block of frames is written with a single write call.
+
+    When time_step (the time between two rows of the tracks in atomic units)
+    is given, the step of each frame in the DCD file is its row in the tracks
+    and the time of the first row is zero. Otherwise the time is not stored,
+    i.e. the first step, the interval between the steps and the time step in
+    the header are 0, 1 and 0.
+    """
+    sub = fix_slice(sub)
+    if time_step is None:
+        istart, nsavc, delta = 0, 1, 0.0
+    else:
+        istart, nsavc, delta = sub.start, sub.step, time_step/_akma_time
+    if atom_indexes is None:
+        atom_indexes = sorted(int(filename[-9:-2]) for filename in glob.glob("%s.???????.x" % prefix))
+        if len(atom_indexes) == 0:
+            raise Error("No tracks found with prefix %s." % prefix)
+    else:
+        atom_indexes = list(atom_indexes)
+    if groups is not None:
+        groups = _reduce_groups(groups, atom_indexes)
+    has_cell = unit_cell_iter is not None
+    dtype, records = _get_dcd_frame_fields("<", len(atom_indexes), has_cell, False)
+
+    f = file(destination, "wb")
+    f.write(_dcd_header(0, istart, nsavc, delta, len(atom_indexes), has_cell))
+    num_frames = 0
+    for coordinates, matrices in _iter_coordinate_blocks(prefix, atom_indexes, sub, unit_cell_iter, groups, buffer_size):
+        frames = numpy.zeros(len(coordinates), dtype)
+        for name, size in records:
+            frames[name + "_begin"] = size
+            frames[name + "_end"] = size
+        if has_cell:
+            # the cell parameters in the order [A, gamma, B, beta, alpha, C]
+            norms, angles = _cell_norms_angles(matrices)
+            frames["cell"][:,[0,2,5]] = norms/angstrom
+            frames["cell"][:,[4,3,1]] = angles/deg
+        for i, c in enumerate("xyz"):
+            frames[c] = coordinates[:,:,i]/angstrom
+        f.write(frames.tostring())
+        num_frames += len(frames)
+    # update the number of frames in the header
+    f.seek(0)
+    f.write(_dcd_header(num_frames, istart, nsavc, delta, len(atom_indexes), has_cell))
+    f.close()
+
+
+def _load_npy(filename, key):
+    # A .npy file is memory mapped. The arrays in a .npz archive can only be
+    # loaded into memory.
+    if filename.endswith(".npz"):
+        archive = numpy.load(filename)
+        if key is None:
+            if len(archive.files) != 1:
+                raise Error("The archive %s contains several arrays. Select one with key." % filename)
+            key = archive.files[0]
+        return archive[key]
+    return numpy.load(filename, mmap_mode="r")
+
+
+def _get_npy_filenames(prefix, shape, atom_indexes):
+    # the tracks that correspond to an array with the given shape
+    if len(shape) == 1:
+        return [prefix]
+    elif len(shape) == 2:
+        return ["%s.%07i" % (prefix, index) for index in atom_indexes]
+    elif len(shape) == 3 and shape[2] == 3:
+        return ["%s.%07i.%s" % (prefix, index, c) for index in atom_indexes for c in "xyz"]
+    else:
+        raise Error("Only arrays with shape (T,), (T,N) or (T,N,3) can be converted, got %s." % (shape,))
+
+
+def _get_npy_layout(prefix, atom_indexes, names):
+    # Find the tracks ${prefix}, ${prefix}.${index} or ${prefix}.${index}.x
+    # that are present as files or, when names is not None, in this list.
+    # Return the shape of an array without the frame index and the tracks.
+    if names is None:
+        exists = os.path.isfile
+        listing = glob.glob
+    else:
+        exists = (lambda name: name in names)
+        listing = (lambda pattern: fnmatch.filter(names, pattern))
+    if atom_indexes is None:
+        if exists(prefix):
+            return (), [prefix]
+        for pattern in "%s.???????.x", "%s.???????":
+            matches = listing(pattern % prefix)
+            if len(matches) > 0:
+                atom_indexes = sorted(int(match[len(prefix)+1:len(prefix)+8]) for match in matches)
+                break
+        else:
+            raise Error("No tracks found with prefix %s." % prefix)
+    else:
+        atom_indexes = list(atom_indexes)
+    if exists("%s.%07i.x" % (prefix, atom_indexes[0])):
+        shape = (len(atom_indexes), 3)
+    else:
+        shape = (len(atom_indexes),)
+    return shape, _get_npy_filenames(prefix, (None,) + shape, atom_indexes)
+
+
+def npy_to_tracks(filename, prefix, sub=slice(None), atom_indexes=None, key=None, file_unit=1, clear=True, max_error=None, bundle_filename=None, buffer_size=None):
+    """Convert an array from a .npy or .npz file into tracks.
+
+    An array with shape (T,) becomes the track ${prefix}, an array with shape
+    (T,N) the tracks ${prefix}.${index} and an array with shape (T,N,3) the
+    tracks ${prefix}.${index}.{x,y,z}. The first axis is the time axis and
+    the atom indexes select items along the second axis. The values in the
+    file are in file_unit.
+
+    A .npy file is memory mapped and copied in blocks of frames. When the
+    data do not have to be converted, these blocks are passed on to the
+    tracks without an intermediate copy. An array from a .npz archive is
+    loaded in memory first. When bundle_filename is given, the data are
+    written into a frame-major bundle instead, with the names of the tracks as
+    columns. See tracks.bundle. A bundle is not quantized, so max_error can
+    not be combined with bundle_filename.
+    """
+    if max_error is not None and bundle_filename is not None:
+        raise Error("A bundle can not be quantized. Do not combine max_error with bundle_filename.")
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    data = _load_npy(filename, key)
+    if atom_indexes is None:
+        if len(data.shape) > 1:
+            atom_indexes = range(data.shape[1])
+    elif len(data.shape) == 1:
+        raise Error("Atoms can not be selected in an array with shape (T,).")
+    else:
+        atom_indexes = list(atom_indexes)
+    filenames = _get_npy_filenames(prefix, data.shape, atom_indexes)
+    if data.dtype.kind in "iuf" and file_unit == 1:
+        item_dtype = numpy.dtype(data.dtype.str[1:])
+    else:
+        item_dtype = numpy.dtype(float)
+    stop = min(sub.stop, len(data))
+    num_frames = max(0, (stop - sub.start - 1)/sub.step + 1)
+
+    def iter_blocks(block_size):
+        # blocks of selected frames with shape (frames, columns)
+        for first in xrange(sub.start, stop, block_size*sub.step):
+            block = data[first:min(first + block_size*sub.step, stop):sub.step]
+            if len(data.shape) > 1 and len(atom_indexes) != data.shape[1]:
+                block = block[:,atom_indexes]
+            if file_unit != 1:
+                block = block*file_unit
+            yield numpy.ascontiguousarray(block, item_dtype).reshape((len(block), len(filenames)))
+
+    block_size = max(1, buffer_size/(len(filenames)*item_dtype.itemsize))
+    if bundle_filename is None:
+        if len(data.shape) == 1:
+            dtype = numpy.dtype([("data", item_dtype)])
+        else:
+            dtype = numpy.dtype([("data", item_dtype, (len(atom_indexes),) + data.shape[2:])])
+        mtw = MultiTracksWriter(filenames, dtype, clear=clear, max_errors=_get_max_errors(data=max_error))
+        for block in iter_blocks(block_size):
+            # a contiguous block is a valid buffer for the writer
+            mtw.dump_buffer(block.view(dtype)[:,0])
+        mtw.finish()
+    else:
+        from tracks.bundle import Bundle
+        directory = os.path.dirname(bundle_filename)
+        if len(directory) > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+        bundle = Bundle(bundle_filename)
+        bundle.create(filenames, item_dtype, num_frames)
+        if num_frames > 0:
+            destination = bundle.memmap("r+")
+            row = 0
+            for block in iter_blocks(block_size):
+                destination[row:row+len(block)] = block
+                row += len(block)
+            destination.flush()
+
+
+def tracks_to_npy(prefix, destination, sub=slice(None), atom_indexes=None, key=None, file_unit=1, bundle_filename=None, buffer_size=None):
+    """Convert tracks into an array in a .npy or .npz file.
+
+    This is the inverse of npy_to_tracks: the track ${prefix} becomes an array
+    with shape (T,), the tracks ${prefix}.${index} an array with shape (T,N)
+    and the tracks ${prefix}.${index}.{x,y,z} an array with shape (T,N,3).
+    When atom_indexes is not given, all atoms with tracks are included. The
+    values are written in file_unit.
+
+    A .npy file is memory mapped and filled with blocks of frames in a single
+    pass over the tracks. A .npz archive is built in memory and stored under
+    the name key (default='arr_0'). When bundle_filename is given, the tracks
+    are read from the columns of a bundle instead, which has the same layout
+    as the array in the .npy file. See tracks.bundle.
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    sub = fix_slice(sub)
+    if bundle_filename is None:
+        shape, filenames = _get_npy_layout(prefix, atom_indexes, None)
+        tracks = [Track(filename) for filename in filenames]
+        item_dtype = tracks[0].get_header_dtype()
+        shortest = min(track.size() for track in tracks)
+    else:
+        from tracks.bundle import Bundle
+        bundle = Bundle(bundle_filename)
+        columns = bundle.columns
+        shape, filenames = _get_npy_layout(prefix, atom_indexes, columns)
+        column_indexes = dict((column, index) for index, column in enumerate(columns))
+        try:
+            selection = [column_indexes[filename] for filename in filenames]
+        except KeyError, e:
+            raise Error("The bundle %s has no column %s." % (bundle_filename, e.args[0]))
+        item_dtype = bundle.track.get_header_dtype()
+        shortest = bundle.track.size()/len(columns)
+    if file_unit != 1:
+        item_dtype = numpy.dtype(float)
+    num_frames = max(0, (min(shortest, sub.stop) - sub.start - 1)/sub.step + 1)
+
+    shape = (num_frames,) + shape
+    if destination.endswith(".npz") or num_frames == 0:
+        result = numpy.zeros(shape, item_dtype)
+    else:
+        result = numpy.lib.format.open_memmap(destination, "w+", item_dtype, shape)
+    rows = result.reshape((num_frames, len(filenames)))
+
+    row = 0
+    if bundle_filename is None:
+        if len(shape) == 1:
+            dtype = numpy.dtype([("data", item_dtype)])
+        else:
+            dtype = numpy.dtype([("data", item_dtype, shape[1:])])
+        mtr = MultiTracksReader(filenames, dtype, buffer_size=buffer_size, sub=sub)
+        for buffer in mtr.iter_buffers():
+            rows[row:row+len(buffer)] = buffer["data"].reshape((len(buffer), -1))/file_unit
+            row += len(buffer)
+    elif num_frames > 0:
+        source = bundle.memmap()[sub.start:sub.stop:sub.step]
+        if selection == range(len(columns)):
+            selection = slice(None)
+        block_size = max(1, buffer_size/(len(columns)*item_dtype.itemsize))
+        for first in xrange(0, num_frames, block_size):
+            block = source[first:first+block_size]
+            rows[first:first+len(block)] = block[:,selection]/file_unit
+
+    if destination.endswith(".npz"):
+        if key is None:
+            numpy.savez(destination, result)
+        else:
+            numpy.savez(destination, **{key: result})
+    elif num_frames == 0:
+        numpy.save(destination, result)
+    else:
+        result.flush()
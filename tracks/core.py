@@ -37,7 +37,8 @@ from tracks.log import log
 from tracks.util import fix_slice
 from tracks import context
 
-import numpy, os
+from multiprocessing.pool import ThreadPool
+import numpy, os, sys, struct, ast, bisect
 
 
 __all__ = [
@@ -45,6 +46,8 @@ __all__ = [
     "Track",
     "load_track", "dump_track", "track_size",
     "MultiTracksReader", "MultiTracksWriter",
+    "write_stream_header", "read_stream_header",
+    "read_stripe_manifest",
 ]
 
 
@@ -57,32 +60,86 @@ class TrackNotFoundError(Error):
 
 
 class Track(object):
+    """A one-dimensional array stored in a file.
+
+    A track file starts with a header of header_size bytes that contains the
+    file format and the dtype of the data. In the plain format (TRACKS_1) the
+    header is followed by the raw data. In the quantized format (TRACKQ_1) the
+    header is extended with the maximum absolute error, and the data is stored
+    in chunks. Each chunk has a small header with the number of values, the
+    first value and the size of the integers that follow. These integers are
+    the differences between subsequent values, rounded to multiples of twice
+    the maximum error. The decoded values never deviate more than the maximum
+    error from the original data, apart from the round-off of the dtype.
+    Quantized tracks are decoded transparently by Track.read. The positions of
+    the chunks are kept in an index on the Track object, such that consecutive
+    reads only decode the chunks they need. When the file grows, only the new
+    chunks are added to the index.
+    """
     header_size = 14
-
-    def __init__(self, filename, clear=False):
+    quantized_header_size = 22
+    chunk_format = "<qdq"
+    chunk_header_size = struct.calcsize(chunk_format)
+    chunk_size = 4096
+
+    def __init__(self, filename, clear=False, max_error=None):
+        """Initialize a Track object.
+
+        Arguments:
+          filename  --  The file that contains the data of the track.
+
+        Optional arguments:
+          clear  --  Remove an existing file. [default=False]
+          max_error  --  When given, a new file is written in the quantized
+                         format with this maximum absolute error. This only
+                         works for floating point data and has no effect when
+                         data are appended to an existing file.
+        """
         self.filename = filename
+        self.max_error = max_error
+        self._reset_chunk_index()
         if clear:
             self.clear()
 
     def _init_buffer(self, dtype):
         f = file(self.filename, "wb")
         # write the header
-        f.write("TRACKS_1") # file format and version
+        if self.max_error is None:
+            f.write("TRACKS_1") # file format and version
+        else:
+            if dtype.kind != "f":
+                raise Error("Only floating point data can be quantized.")
+            if not self.max_error > 0:
+                raise Error("The maximum error of a quantized track must be strictly positive.")
+            f.write("TRACKQ_1")
         f.write(dtype.str[:2]) # byte order and data type
         f.write("%04i" % dtype.itemsize) # the itemsize of the array in text format
         if f.tell() != self.header_size:
             raise Error("Inconsistent header size!")
+        if self.max_error is not None:
+            f.write(struct.pack("<d", self.max_error))
         return f
 
-    def _get_header_dtype(self):
+    def _read_header(self):
         if not os.path.isfile(self.filename):
             raise TrackNotFoundError("File not found: %s" % self.filename)
         f = file(self.filename, "rb")
         header = f.read(self.header_size)
-        f.close()
-        if header[:8] != "TRACKS_1":
+        if header[:8] == "TRACKS_1":
+            max_error = None
+        elif header[:8] == "TRACKQ_1":
+            max_error = struct.unpack("<d", f.read(8))[0]
+        else:
+            f.close()
             raise Error("Wrong header: %s is not a correct track filename" % self.filename)
-        return numpy.dtype(header[8:].replace("0",""))
+        f.close()
+        return numpy.dtype(header[8:].replace("0","")), max_error
+
+    def get_header_dtype(self):
+        return self._read_header()[0]
+
+    def is_quantized(self):
+        return self._read_header()[1] is not None
 
     def _get_data_size(self):
         if not os.path.isfile(self.filename):
@@ -96,7 +153,7 @@ class Track(object):
     def _get_read_buffer(self, start):
         if not os.path.isfile(self.filename):
             raise TrackNotFoundError("File not found: %s" % self.filename)
-        dtype = self._get_header_dtype()
+        dtype = self.get_header_dtype()
         f = file(self.filename, "rb")
         f.seek(start*dtype.itemsize+14)
         return dtype, f
@@ -105,17 +162,116 @@ class Track(object):
         if not os.path.isfile(self.filename):
             return self._init_buffer(dtype)
         else:
-            dtype_file = self._get_header_dtype()
+            dtype_file = self.get_header_dtype()
             if dtype != dtype_file:
                 raise Error("The given data has dtype=%s, while the data in the track has dtype=%s" % (dtype, dtype_file))
             return file(self.filename, "ab")
 
+    def _reset_chunk_index(self):
+        # the index of the first value in each chunk of a quantized track, the
+        # chunk headers, the number of values in all chunks and the position
+        # in the file up to which the chunks are indexed
+        self._chunk_starts = []
+        self._chunks = []
+        self._chunk_total = 0
+        self._chunk_end = self.quantized_header_size
+
+    def _update_chunk_index(self):
+        # add the chunks that were appended to the file since the last update
+        file_size = os.path.getsize(self.filename)
+        if file_size < self._chunk_end:
+            # the file was replaced
+            self._reset_chunk_index()
+        if file_size == self._chunk_end:
+            return
+        f = file(self.filename, "rb")
+        if len(self._chunks) > 0:
+            # check that the file was appended to and not replaced
+            count, first, itemsize, position = self._chunks[-1]
+            f.seek(position - self.chunk_header_size)
+            if f.read(self.chunk_header_size) != struct.pack(self.chunk_format, count, first, itemsize):
+                self._reset_chunk_index()
+        f.seek(self._chunk_end)
+        while True:
+            header = f.read(self.chunk_header_size)
+            if len(header) < self.chunk_header_size:
+                break
+            count, first, itemsize = struct.unpack(self.chunk_format, header)
+            position = f.tell()
+            if position + count*itemsize > file_size:
+                # a chunk that is still being written
+                break
+            self._chunk_starts.append(self._chunk_total)
+            self._chunks.append((count, first, itemsize, position))
+            self._chunk_total += count
+            self._chunk_end = position + count*itemsize
+            f.seek(self._chunk_end)
+        f.close()
+
+    def _read_quantized(self, sub, destination=None):
+        # decode the values selected by sub, directly into destination when
+        # given, and return the number of values
+        dtype, max_error = self._read_header()
+        self._update_chunk_index()
+        stop = min(sub.stop, self._chunk_total)
+        size = max(0, (stop - sub.start - 1)/sub.step + 1)
+        if destination is None:
+            destination = numpy.zeros(size, dtype)
+        if size == 0:
+            return destination[:0]
+        f = file(self.filename, "rb")
+        row = 0
+        # the last chunk that starts before or at sub.start
+        index = bisect.bisect_right(self._chunk_starts, sub.start) - 1
+        while index < len(self._chunks) and self._chunk_starts[index] < stop:
+            start = self._chunk_starts[index]
+            count, first, itemsize, position = self._chunks[index]
+            begin = _first_selected(sub, start)
+            end = min(start + count, stop)
+            if begin < end:
+                # only the deltas up to the last selected value are needed
+                f.seek(position)
+                deltas = numpy.fromfile(f, numpy.dtype("<i%i" % itemsize), end - start, '')
+                values = first + deltas.cumsum(dtype=numpy.int64)*(2*max_error)
+                part = values[begin-start::sub.step]
+                destination[row:row+len(part)] = part
+                row += len(part)
+            index += 1
+        f.close()
+        return destination[:row]
+
+    def _append_quantized(self, f, data, max_error):
+        for begin in xrange(0, len(data), self.chunk_size):
+            chunk = data[begin:begin+self.chunk_size].astype(float)
+            if not numpy.isfinite(chunk).all():
+                raise Error("Only finite values can be quantized.")
+            first = chunk[0]
+            indexes = numpy.round((chunk - first)/(2*max_error)).astype(numpy.int64)
+            deltas = numpy.zeros(len(chunk), numpy.int64)
+            deltas[1:] = indexes[1:] - indexes[:-1]
+            largest = abs(deltas).max()
+            for itemsize in 1, 2, 4, 8:
+                if largest <= numpy.iinfo(numpy.dtype("<i%i" % itemsize)).max:
+                    break
+            f.write(struct.pack(self.chunk_format, len(chunk), first, itemsize))
+            deltas.astype("<i%i" % itemsize).tofile(f)
+
     def clear(self):
+        if os.path.islink(self.filename):
+            # also remove the file on the stripe, see MultiTracksWriter
+            directory, name = os.path.split(self.filename)
+            physical = read_stripe_manifest(directory).get(name)
+            if physical is not None and os.path.isfile(physical):
+                os.remove(physical)
+            os.remove(self.filename)
         if os.path.isfile(self.filename):
             os.remove(self.filename)
+        self._reset_chunk_index()
 
     def read(self, sub=None):
         sub = fix_slice(sub)
+        if self.is_quantized():
+            return self._read_quantized(sub)
         dtype, f = self._get_read_buffer(sub.start)
         stop_bytes = min(sub.stop*dtype.itemsize, self._get_data_size())
         length = stop_bytes/dtype.itemsize - sub.start
@@ -127,6 +283,8 @@ class Track(object):
 
     def read_into(self, destination, sub=None):
         sub = fix_slice(sub)
+        if self.is_quantized():
+            return len(self._read_quantized(sub, destination))
         dtype, f = self._get_read_buffer(sub.start)
         stop_bytes = min(sub.stop*dtype.itemsize, self._get_data_size())
         length = stop_bytes/dtype.itemsize - sub.start
@@ -139,34 +297,221 @@ class Track(object):
     def append(self, data):
         if len(data.shape) != 1:
             raise Error("Only 1-dimensional arrays can be stored in tracks.")
+        if os.path.isfile(self.filename):
+            max_error = self._read_header()[1]
+        else:
+            max_error = self.max_error
         f = self._get_append_buffer(data.dtype)
-        data.tofile(f)
+        if max_error is None:
+            data.tofile(f)
+        else:
+            self._append_quantized(f, data, max_error)
         f.close()
 
     def size(self):
-        dtype = self._get_header_dtype()
+        if self.is_quantized():
+            self._update_chunk_index()
+            return self._chunk_total
+        dtype = self.get_header_dtype()
         size_bytes = self._get_data_size()
         return size_bytes/dtype.itemsize
 
+    def preallocate(self, dtype, size):
+        """Create a track with room for size items of the given dtype.
+
+        The data in the new track are zero until they are overwritten through
+        a memory map, see Track.memmap.
+        """
+        f = self._init_buffer(numpy.dtype(dtype))
+        f.truncate(self.header_size + size*numpy.dtype(dtype).itemsize)
+        f.close()
+
+    def grow(self, dtype, size):
+        """Add room for size items of the given dtype at the end of the track.
+
+        The track is created when it does not exist yet. The new items are
+        zero until they are overwritten with Track.write. The original size
+        of the track is returned. Quantized tracks can not grow in place.
+        """
+        dtype = numpy.dtype(dtype)
+        if os.path.isfile(self.filename):
+            dtype_file, max_error = self._read_header()
+            if max_error is not None:
+                raise Error("A quantized track can not grow in place: %s" % self.filename)
+            if dtype != dtype_file:
+                raise Error("The given dtype=%s differs from the dtype=%s of the data in the track." % (dtype, dtype_file))
+            old_size = self.size()
+            f = file(self.filename, "r+b")
+        elif self.max_error is not None:
+            raise Error("A quantized track can not grow in place: %s" % self.filename)
+        else:
+            old_size = 0
+            f = self._init_buffer(dtype)
+        f.truncate(self.header_size + (old_size + size)*dtype.itemsize)
+        f.close()
+        return old_size
+
+    def write(self, data, start):
+        """Overwrite the items of the track from index start on with data.
+
+        The track must already contain room for these items, see Track.grow.
+        This does not work for quantized tracks.
+        """
+        dtype, max_error = self._read_header()
+        if max_error is not None:
+            raise Error("A quantized track can not be overwritten: %s" % self.filename)
+        if data.dtype != dtype:
+            raise Error("The given data has dtype=%s, while the data in the track has dtype=%s" % (data.dtype, dtype))
+        if start < 0 or start + len(data) > self.size():
+            raise Error("Can not write beyond the end of the track: %s" % self.filename)
+        f = file(self.filename, "r+b")
+        f.seek(self.header_size + start*dtype.itemsize)
+        data.tofile(f)
+        f.close()
+
+    def memmap(self, mode="r"):
+        """Return a memory map of the data in the track.
+
+        The mode argument is passed on to numpy.memmap. Use 'r+' to modify
+        the data in place.
+        """
+        if self.is_quantized():
+            raise Error("A quantized track can not be memory mapped: %s" % self.filename)
+        dtype = self.get_header_dtype()
+        size = self.size()
+        if size == 0:
+            return numpy.zeros(0, dtype)
+        return numpy.memmap(self.filename, dtype, mode, self.header_size, (size,))
+
+
+def _first_selected(sub, start):
+    # the first index selected by sub that is not smaller than start
+    if start <= sub.start:
+        return sub.start
+    else:
+        return sub.start + ((start - sub.start - 1)/sub.step + 1)*sub.step
+
 
 def load_track(filename, sub=None):
     return Track(filename).read(sub)
 
-def dump_track(filename, data):
-    Track(filename, clear=True).append(data)
+def dump_track(filename, data, max_error=None):
+    Track(filename, clear=True, max_error=max_error).append(data)
 
 def track_size(filename):
     return Track(filename).size()
 
 
+stream_magic = "TRSTRM_1"
+stream_size_format = "<q"
+stream_size_size = struct.calcsize(stream_size_format)
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise Error("Unexpected end of the binary stream.")
+    return data
+
+def write_stream_header(f, dtype):
+    """Write the header of a binary tracks stream to the file object f.
+
+    The header consists of a magic word, followed by the size and the text
+    representation of the structured dtype of the records in the stream.
+    """
+    descr = repr(dtype.descr)
+    f.write(stream_magic)
+    f.write(struct.pack(stream_size_format, len(descr)))
+    f.write(descr)
+
+def read_stream_header(f):
+    """Read the header of a binary tracks stream and return its dtype."""
+    if f.read(len(stream_magic)) != stream_magic:
+        raise Error("Wrong header: the input is not a binary tracks stream.")
+    size = struct.unpack(stream_size_format, _read_exactly(f, stream_size_size))[0]
+    return numpy.dtype(ast.literal_eval(_read_exactly(f, size)))
+
+def _iter_column_dtypes(dtype):
+    for name in dtype.names:
+        sub_dtype = dtype.fields[name][0]
+        for flat_index in xrange(numpy.product(sub_dtype.shape,dtype=int)):
+            yield sub_dtype.base
+
+
+stripe_manifest_name = ".stripes"
+
+
+def read_stripe_manifest(directory):
+    """Return a dictionary with the striped tracks in a directory.
+
+    The keys are the names of the tracks in the directory and the values are
+    the files on the stripes to which they link. See MultiTracksWriter.
+    """
+    result = {}
+    filename = os.path.join(directory, stripe_manifest_name)
+    if os.path.isfile(filename):
+        f = file(filename)
+        for line in f:
+            name, physical = line.rstrip("\n").split("\t")
+            result[name] = physical
+        f.close()
+    return result
+
+def _write_stripe_manifest(directory, stripes):
+    f = file(os.path.join(directory, stripe_manifest_name), "w")
+    for name, physical in sorted(stripes.iteritems()):
+        print >> f, "%s\t%s" % (name, physical)
+    f.close()
+
+def _init_stripes(filenames, roots):
+    # distribute the new files over the roots and link them from the
+    # original locations
+    manifests = {}
+    for counter, filename in enumerate(filenames):
+        if os.path.lexists(filename):
+            continue
+        root = roots[counter % len(roots)]
+        physical = os.path.join(os.path.abspath(root), os.path.abspath(filename).lstrip(os.sep))
+        directory = os.path.dirname(physical)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if os.path.isfile(physical):
+            os.remove(physical)
+        os.symlink(physical, filename)
+        directory, name = os.path.split(filename)
+        manifests.setdefault(directory, {})[name] = physical
+    for directory, stripes in manifests.iteritems():
+        manifest = read_stripe_manifest(directory)
+        manifest.update(stripes)
+        _write_stripe_manifest(directory, manifest)
+
+def _get_device(filename):
+    filename = os.path.realpath(filename)
+    if not os.path.exists(filename):
+        filename = os.path.dirname(filename)
+    return os.stat(filename).st_dev
+
+
+# Functions that are called when a MultiTracksWriter finishes, with the list of
+# written filenames and a flag that is True when the tracks were cleared first.
+# Modules that maintain files derived from tracks register themselves here,
+# e.g. tracks.pyramid.
+finish_hooks = []
+
+
 class MultiTrackBase(object):
+    # the threads that read or write tracks on different devices in parallel
+    _pool = None
+
     def init_buffer(self, buffer_size, dtype):
         # allocate the buffer array
         buffer_length = buffer_size/dtype.itemsize
         self.buffer = numpy.zeros(buffer_length, dtype)
 
-    def init_tracks(self, filenames, dtype, clear=False):
+    def init_tracks(self, filenames, dtype, clear=False, max_errors=None):
         # create the tracks dictonary. it maps buffer array segments to filenames
+        if max_errors is None:
+            max_errors = {}
         self.tracks = {}
         counter = 0
         for name in dtype.names:
@@ -174,7 +519,7 @@ class MultiTrackBase(object):
             self.tracks[name] = l
             sub_dtype = dtype.fields[name][0]
             for flat_index in xrange(numpy.product(sub_dtype.shape,dtype=int)):
-                track = Track(filenames[counter], clear=clear)
+                track = Track(filenames[counter], clear=clear, max_error=max_errors.get(name))
                 if len(sub_dtype.shape) == 0:
                     index = tuple([])
                 else:
@@ -182,6 +527,46 @@ class MultiTrackBase(object):
                 l.append((index, track))
                 counter += 1
 
+    def init_devices(self):
+        # the storage device of each track, used to read or write the tracks
+        # on different devices in parallel
+        self.devices = {}
+        for tracks in self.tracks.itervalues():
+            for index, track in tracks:
+                self.devices[track.filename] = _get_device(track.filename)
+
+    def _map_fields(self, function, buffer=None):
+        # call function(track, column) for all fields, with one thread per
+        # storage device, and return the results in the order of the fields
+        groups = {}
+        order = []
+        for track, column in self._iter_fields(buffer):
+            device = self.devices[track.filename]
+            if device not in groups:
+                groups[device] = []
+                order.append(device)
+            groups[device].append((track, column))
+        def process(group):
+            return [function(track, column) for track, column in group]
+        if len(order) > 1:
+            # one pool is reused for all buffers, see close
+            if self._pool is None:
+                self._pool = ThreadPool(len(order))
+            results = self._pool.map(process, [groups[device] for device in order])
+        else:
+            results = [process(groups[device]) for device in order]
+        return sum(results, [])
+
+    def close(self):
+        """Stop the threads that read or write the tracks in parallel."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __del__(self):
+        self.close()
+
     def _iter_fields(self, buffer=None):
         if buffer is None:
             buffer = self.buffer
@@ -194,7 +579,17 @@ class MultiTrackBase(object):
 
 
 class MultiTracksReader(MultiTrackBase):
-    def __init__(self, filenames, dtype, buffer_size=None, dot_interval=None, sub=slice(None)):
+    """Reads rows from a set of tracks, or from a binary stream.
+
+    When filenames is a bare minus sign, the rows are read from the binary
+    stream (default=sys.stdin) as written by a MultiTracksWriter. In that case
+    dtype may be None to adopt the dtype from the stream header, or any dtype
+    whose sequence of columns has the same types as the stream.
+
+    Tracks that reside on different storage devices, e.g. striped tracks, are
+    read in parallel.
+    """
+    def __init__(self, filenames, dtype, buffer_size=None, dot_interval=None, sub=slice(None), stream=None):
         MultiTrackBase.__init__(self)
         if buffer_size is None:
             buffer_size = context.default_buffer_size
@@ -206,22 +601,52 @@ class MultiTracksReader(MultiTrackBase):
         self.row_counter = 0
         self.sub = fix_slice(sub)
 
-        self.init_buffer(buffer_size, dtype)
-        self.init_tracks(filenames, dtype)
-        self.init_shortest()
+        if filenames == "-":
+            if stream is None:
+                stream = sys.stdin
+            self.stream = stream
+            dtype = self.init_stream(dtype)
+            self.init_buffer(buffer_size, dtype)
+            self._shortest = None
+        else:
+            self.stream = None
+            self.init_buffer(buffer_size, dtype)
+            self.init_tracks(filenames, dtype)
+            self.init_devices()
+            self.init_shortest()
+
+    def init_stream(self, dtype):
+        stream_dtype = read_stream_header(self.stream)
+        if dtype is None:
+            return stream_dtype
+        if dtype.itemsize != stream_dtype.itemsize or \
+           list(_iter_column_dtypes(dtype)) != list(_iter_column_dtypes(stream_dtype)):
+            raise Error("The dtype of the stream, %s, is not compatible with %s." % (stream_dtype, dtype))
+        return dtype
 
     def init_shortest(self):
         # compute the length of the shortest track in the reader
-        self.shortest = None
+        shortest = None
         for tracks in self.tracks.itervalues():
             for i, track in tracks:
                 size = track.size()
-                if self.shortest is None or self.shortest > size:
-                    self.shortest = size
+                if shortest is None or shortest > size:
+                    shortest = size
         # take into account the slicing
-        self.shortest = (min(self.shortest, self.sub.stop) - self.sub.start)/self.sub.step
+        self._shortest = (min(shortest, self.sub.stop) - self.sub.start)/self.sub.step
+
+    def _get_shortest(self):
+        if self.stream is not None:
+            raise Error("The number of rows in a stream is not known in advance.")
+        return self._shortest
+
+    shortest = property(_get_shortest)
 
     def iter_buffers(self):
+        if self.stream is not None:
+            for buffer in self._iter_stream_buffers():
+                yield buffer
+            return
         buffer_counter = 0
         while True:
             # determin the part that will be read from disk
@@ -233,13 +658,11 @@ class MultiTracksReader(MultiTrackBase):
             # read the part slice(start, stop, step) from each track and store
             # it in the buffer array
             log(" %i " % start, False)
-            first_size = None
-            for track, column in self._iter_fields():
-                size = track.read_into(column, slice(start, stop, self.sub.step))
-                if first_size is None:
-                    first_size = size
-                elif first_size != size:
-                    raise Error("Not all tracks are of equal length!")
+            sub = slice(start, stop, self.sub.step)
+            sizes = self._map_fields(lambda track, column: track.read_into(column, sub))
+            size = sizes[0]
+            if sizes.count(size) != len(sizes):
+                raise Error("Not all tracks are of equal length!")
 
             # yield the relevant part of the buffer array
             if size == len(self.buffer):
@@ -248,9 +671,42 @@ class MultiTracksReader(MultiTrackBase):
                 yield self.buffer[:size]
                 break
             buffer_counter += 1
+        self.close()
         log(" %i " % stop, False)
         log.finish()
 
+    def _iter_stream_blocks(self):
+        # read the blocks from the stream in pieces that fit in the buffer
+        dtype = self.buffer.dtype
+        while True:
+            data = self.stream.read(stream_size_size)
+            if len(data) == 0:
+                # tolerate a stream that is cut off after a complete block
+                break
+            data += _read_exactly(self.stream, stream_size_size - len(data))
+            size = struct.unpack(stream_size_format, data)[0]
+            if size == 0:
+                break
+            while size > 0:
+                length = min(size, len(self.buffer))
+                yield numpy.fromstring(_read_exactly(self.stream, length*dtype.itemsize), dtype)
+                size -= length
+
+    def _iter_stream_buffers(self):
+        start = 0
+        for block in self._iter_stream_blocks():
+            stop = start + len(block)
+            log(" %i " % start, False)
+            first = _first_selected(self.sub, start)
+            last = min(stop, self.sub.stop)
+            if first < last:
+                yield block[first-start:last-start:self.sub.step]
+            start = stop
+            if start >= self.sub.stop:
+                break
+        log(" %i " % start, False)
+        log.finish()
+
     def iter_rows(self):
         for buffer in self.iter_buffers():
             for row in buffer:
@@ -263,33 +719,70 @@ class MultiTracksReader(MultiTrackBase):
 
 
 class MultiTracksWriter(MultiTrackBase):
-    def __init__(self, filenames, dtype, buffer_size=None, dot_interval=None, clear=True):
+    """Writes rows to a set of tracks, or to a binary stream.
+
+    When filenames is a bare minus sign, the rows are written as a binary
+    stream (default=sys.stdout): a header with the dtype, followed by blocks
+    of records, each prefixed with the number of records. A block of size zero
+    marks the end of the stream.
+
+    The optional argument max_errors is a dictionary that maps field names of
+    the dtype to a maximum absolute error. The tracks of these fields are
+    written in the quantized format. See the Track class for more info.
+
+    The optional argument roots is a list of directories, e.g. on different
+    disks, over which new tracks are distributed in a round-robin fashion
+    (default=context.stripe_roots). The file of a track is then stored under
+    ${root}/${absolute_filename} and the filename itself becomes a symbolic
+    link. The links in a directory are recorded in the manifest file .stripes
+    in that directory. Tracks on different devices are written in parallel.
+    """
+    def __init__(self, filenames, dtype, buffer_size=None, dot_interval=None, clear=True, stream=None, max_errors=None, roots=None):
         MultiTrackBase.__init__(self)
         if buffer_size is None:
             buffer_size = context.default_buffer_size
         if dot_interval is None:
             dot_interval = context.default_dot_interval
 
-        # make sure the files can be created
-        for filename in filenames:
-            directory = os.path.dirname(filename)
-            if len(directory) > 0 and not os.path.exists(directory):
-                os.makedirs(directory)
-
         self.init_buffer(buffer_size, dtype)
-        self.init_tracks(filenames, dtype, clear)
+        if filenames == "-":
+            if stream is None:
+                stream = sys.stdout
+            self.stream = stream
+            write_stream_header(self.stream, dtype)
+        else:
+            self.stream = None
+            # make sure the files can be created
+            for filename in filenames:
+                directory = os.path.dirname(filename)
+                if len(directory) > 0 and not os.path.exists(directory):
+                    os.makedirs(directory)
+            self.init_tracks(filenames, dtype, clear, max_errors)
+            if roots is None:
+                roots = context.stripe_roots
+            if roots is not None and len(roots) > 0:
+                _init_stripes(filenames, roots)
+            self.init_devices()
 
         # some residual parameters
         self.current_row = 0
         self.dot_interval = dot_interval
         self.row_counter = 0
+        self.clear = clear
         log(" 0 ", False)
 
+    def _write_block(self, buffer):
+        self.stream.write(struct.pack(stream_size_format, len(buffer)))
+        self.stream.write(buffer.tostring())
+
     def _flush_buffer(self):
         if self.current_row == 0:
             return
-        for track, column in self._iter_fields():
-            track.append(column[:self.current_row])
+        if self.stream is None:
+            size = self.current_row
+            self._map_fields(lambda track, column: track.append(column[:size]))
+        else:
+            self._write_block(self.buffer[:self.current_row])
         log(" %i " % self.row_counter, False)
         self.current_row = 0
 
@@ -308,11 +801,41 @@ class MultiTracksWriter(MultiTrackBase):
         #if buffer.dtype != self.buffer.dtype:
         #    raise Error("The given buffer must have the same dtype as the internal buffer.")
         self._flush_buffer()
-        for track, column in self._iter_fields(buffer):
-            track.append(column)
+        if self.stream is None:
+            self._map_fields(lambda track, column: track.append(column), buffer)
+        elif len(buffer) > 0:
+            self._write_block(buffer)
+
+    def preallocate(self, num_rows):
+        """Add room for num_rows rows at the end of the tracks.
+
+        The index of the first new row is returned. The new rows can be
+        written in any order with write_buffer, e.g. by several processes
+        that each create a MultiTracksWriter with clear=False. This does not
+        work for streams and quantized tracks.
+        """
+        if self.stream is not None:
+            raise Error("Rows can not be preallocated in a stream.")
+        self._flush_buffer()
+        starts = set(self._map_fields(lambda track, column: track.grow(column.dtype, num_rows)))
+        if len(starts) > 1:
+            raise Error("Can not preallocate rows in tracks with different lengths.")
+        return starts.pop()
+
+    def write_buffer(self, buffer, start):
+        """Overwrite the rows from index start on with the given buffer."""
+        self._map_fields(lambda track, column: track.write(column, start), buffer)
 
     def finish(self):
         self._flush_buffer()
+        self.close()
+        if self.stream is None:
+            filenames = [track.filename for track, column in self._iter_fields()]
+            for hook in finish_hooks:
+                hook(filenames, self.clear)
+        if self.stream is not None:
+            self.stream.write(struct.pack(stream_size_format, 0))
+            self.stream.flush()
         log.finish()
 
 
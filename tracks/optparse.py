@@ -55,6 +55,72 @@ def add_append_option(parser):
         help="Append to existing tracks if possible."
     )
 
+def add_stream_option(parser):
+    parser.add_option(
+        "--stream", action="store_true", default=False,
+        help="Use a binary stream with the data in atomic units instead of "
+             "text. This is much faster when the data are piped between two "
+             "tr-* commands."
+    )
+
+def add_binary_option(parser):
+    parser.add_option(
+        "--binary", action="store_true", default=False,
+        help="Use raw binary data instead of text: one row of double precision "
+             "numbers (in the native byte order) per time step, without any "
+             "header. This is convenient to exchange data with other programs."
+    )
+
+def add_stripe_option(parser):
+    parser.add_option(
+        "--stripe", default=None,
+        help="A comma-separated list of directories, e.g. on different disks. "
+             "The new output tracks are distributed over these directories "
+             "and linked from the output directory. Tracks on different disks "
+             "are written and read in parallel."
+    )
+
+def add_follow_options(parser):
+    parser.add_option(
+        "--follow", action="store_true", default=False,
+        help="Only convert the complete frames that were added to the input "
+             "file since the previous call with --follow, and append them to "
+             "the tracks. This is useful for a simulation that is still "
+             "running."
+    )
+    parser.add_option(
+        "--follow-interval", default=None, type="float", metavar="SECONDS",
+        help="Keep following the input file and convert the new frames every "
+             "SECONDS until the program is interrupted. This implies --follow."
+    )
+
+def add_segment_option(parser):
+    parser.add_option(
+        "--segment", action="append", default=None, metavar="FILENAME",
+        help="A later restart segment of the same simulation, converted after "
+             "the given filename. This option can be repeated for more "
+             "segments."
+    )
+
+def add_jobs_option(parser):
+    parser.add_option(
+        "-j", "--jobs", default=1, type="int",
+        help="The number of processes that work in parallel. [default=%default]"
+    )
+
+def add_max_error_options(parser, names=[None]):
+    for name in names:
+        if name is None:
+            option, kind = "--max-error", "output"
+        else:
+            option, kind = "--max-%s-error" % name, "atom.%s" % name
+        parser.add_option(
+            option, default=None,
+            help="Store the %s tracks in a compact quantized format. The "
+                 "given value, including a unit, is the guaranteed maximum "
+                 "absolute error on each value, e.g. 1e-4*angstrom." % kind
+        )
+
 def add_cell_option(parser):
     parser.add_option(
         "-c", "--cell", dest="unit_cell_str", default=None,
@@ -45,6 +45,7 @@ import sys, numpy
 __all__ = [
     "parse_slice", "get_delta", "parse_x_step",
     "parse_x_duration", "parse_x_length", "iter_unit_cells",
+    "parse_max_errors", "parse_stripe_roots", "parse_segments",
 ]
 
 
@@ -117,6 +118,45 @@ def parse_x_length(s):
     return _parse_x_track(s, fn, int)
 
 
+def parse_max_errors(options, names=[None]):
+    """Convert the options from add_max_error_options into keyword arguments.
+
+    The result is a dictionary, e.g. {'max_pos_error': 1.8e-4}, that only
+    contains the options that were given on the command line.
+    """
+    result = {}
+    for name in names:
+        if name is None:
+            key = "max_error"
+        else:
+            key = "max_%s_error" % name
+        value = getattr(options, key)
+        if value is not None:
+            result[key] = parse_unit(value)
+    return result
+
+
+def parse_stripe_roots(s):
+    """Convert the option from add_stripe_option into a list of directories.
+
+    None is returned when the option is not given.
+    """
+    if s is None:
+        return None
+    return [root for root in s.split(",") if len(root) > 0]
+
+
+def parse_segments(filename, segments):
+    """Combine the filename argument of a converter with its --segment options.
+
+    Without segments, the filename is returned as such. Otherwise the result
+    is a list with the filename followed by the restart segments.
+    """
+    if not segments:
+        return filename
+    return [filename] + list(segments)
+
+
 def iter_unit_cells(unit_cell_str, sub=None):
     sub = fix_slice(sub)
     if len(unit_cell_str) == 0:
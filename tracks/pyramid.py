@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# MD-Tracks is a trajectory analysis toolkit for molecular dynamics
+# and monte carlo simulations.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MD-Tracks.
+#
+# MD-Tracks is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "MD-TRACKS: A productive solution for the advanced analysis of Molecular
+# Dynamics and Monte Carlo simulations", Toon Verstraelen, Marc Van Houteghem,
+# Veronique Van Speybroeck and Michel Waroquier, Journal of Chemical Information
+# and Modeling, 48 (12), 2414-2424, 2008
+# DOI:10.1021/ci800233y
+#
+# MD-Tracks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+from tracks.core import Track, dump_track, finish_hooks
+from tracks import context
+
+import numpy, os
+
+
+__all__ = [
+    "get_pyramid_filename", "has_pyramid", "has_current_pyramid",
+    "update_pyramid", "clear_pyramid", "get_pyramid_levels",
+    "choose_pyramid_level", "load_pyramid_level",
+]
+
+
+kinds = ["min", "max", "mean"]
+
+
+def get_pyramid_filename(filename, level, kind):
+    """Return the filename of one level of the pyramid of a track.
+
+    Level zero is the track itself. At level ${level}, each value is the
+    minimum, maximum or mean (depending on ${kind}) of 2**level subsequent
+    values of the track.
+    """
+    if level == 0:
+        return filename
+    return "%s.pyramid.%02i.%s" % (filename, level, kind)
+
+
+def has_pyramid(filename):
+    return os.path.isfile(get_pyramid_filename(filename, 1, "mean"))
+
+
+def has_current_pyramid(filename):
+    """Return True when the pyramid covers all the (paired) values of a track.
+
+    A pyramid becomes outdated when the track is written without updating the
+    pyramid, e.g. with dump_track. Such a pyramid should not be used.
+    """
+    if not has_pyramid(filename):
+        return False
+    return Track(get_pyramid_filename(filename, 1, "mean")).size() == Track(filename).size()/2
+
+
+def get_pyramid_levels(filename):
+    """Return the number of levels in the pyramid, including level zero."""
+    level = 1
+    while os.path.isfile(get_pyramid_filename(filename, level, "mean")):
+        level += 1
+    return level
+
+
+def clear_pyramid(filename):
+    """Remove all data from the pyramid of a track.
+
+    The first level is kept as an empty track, such that the pyramid is
+    rebuilt when data are appended to the track.
+    """
+    for level in xrange(1, get_pyramid_levels(filename)):
+        for kind in kinds:
+            pyramid_filename = get_pyramid_filename(filename, level, kind)
+            if os.path.isfile(pyramid_filename):
+                os.remove(pyramid_filename)
+    for kind in kinds:
+        dump_track(get_pyramid_filename(filename, 1, kind), numpy.zeros(0, float))
+
+
+def _read_level(filename, level, start, stop):
+    if level == 0:
+        data = Track(filename).read(slice(start, stop)).astype(float)
+        return data, data, data
+    return [
+        Track(get_pyramid_filename(filename, level, kind)).read(slice(start, stop))
+        for kind in kinds
+    ]
+
+
+def update_pyramid(filename, min_size=1024, buffer_size=None):
+    """Build or extend the pyramid of a track.
+
+    Only the values that were appended to the track since the last update are
+    processed. New levels are added as long as the previous level contains at
+    least 2*min_size values.
+
+    Arguments:
+      filename  --  The track file.
+
+    Optional arguments:
+      min_size  --  The minimum size of the last level. [default=1024]
+      buffer_size  --  The memory used for the update in bytes.
+                       [default=context.default_buffer_size]
+    """
+    if buffer_size is None:
+        buffer_size = context.default_buffer_size
+    # the number of pairs that is processed at once
+    block_size = max(1, buffer_size/(6*numpy.dtype(float).itemsize))
+    level = 1
+    source_size = Track(filename).size()
+    while True:
+        track_mean = Track(get_pyramid_filename(filename, level, "mean"))
+        if os.path.isfile(track_mean.filename):
+            size = track_mean.size()
+        elif source_size >= 2*min_size:
+            size = 0
+        else:
+            break
+        for begin in xrange(2*size, 2*(source_size/2), 2*block_size):
+            end = min(begin + 2*block_size, 2*(source_size/2))
+            lows, highs, means = _read_level(filename, level-1, begin, end)
+            for kind, data in zip(kinds, [
+                numpy.minimum(lows[::2], lows[1::2]),
+                numpy.maximum(highs[::2], highs[1::2]),
+                0.5*(means[::2] + means[1::2]),
+            ]):
+                Track(get_pyramid_filename(filename, level, kind)).append(data)
+        source_size = source_size/2
+        level += 1
+
+
+def choose_pyramid_level(filename, start, stop, num_points):
+    """Return the highest level with at least num_points values in a range.
+
+    The range slice(start, stop) refers to the indexes of the track itself.
+    """
+    num_levels = get_pyramid_levels(filename)
+    level = 0
+    while level+1 < num_levels and (stop - start) >> (level+1) >= num_points:
+        level += 1
+    return level
+
+
+def load_pyramid_level(filename, level, start, stop):
+    """Load the minimum, maximum and mean in a range at a given level.
+
+    The range slice(start, stop) refers to the indexes of the track itself.
+    The return value is a list with three arrays.
+    """
+    return _read_level(filename, level, start >> level, (stop + (1 << level) - 1) >> level)
+
+
+def _finish_hook(filenames, clear):
+    # keep the existing pyramids up to date when a MultiTracksWriter finishes
+    for filename in filenames:
+        if has_pyramid(filename):
+            if clear:
+                clear_pyramid(filename)
+            update_pyramid(filename)
+
+
+finish_hooks.append(_finish_hook)
@@ -87,15 +87,17 @@ names = [
     "tr-blav", "tr-calc", "tr-corr", "tr-cwt", "tr-derive", "tr-fit-geom",
     "tr-fit-peaks", "tr-fluct", "tr-from-atrj", "tr-from-cp2k-cell",
     "tr-from-cp2k-ener", "tr-from-cp2k-stress", "tr-from-cpmd-ener",
-    "tr-from-cpmd-traj", "tr-from-dlpoly-hist", "tr-from-dlpoly-output",
-    "tr-from-lammps-dump", "tr-from-gro",
-    "tr-from-txt", "tr-from-xyz", "tr-hist", "tr-ic-bend",  "tr-ic-dihed",
-    "tr-ic-dist", "tr-ic-dtl", "tr-ic-oop", "tr-ic-psf", "tr-ic-puckering",
+    "tr-from-cpmd-traj", "tr-from-dcd", "tr-from-dlpoly-hist",
+    "tr-from-dlpoly-output", "tr-from-lammps-dump", "tr-from-gro",
+    "tr-from-npy", "tr-from-txt", "tr-from-xyz", "tr-hist", "tr-ic-bend",
+    "tr-ic-dihed", "tr-ic-dist", "tr-ic-dtl", "tr-ic-oop", "tr-ic-psf", "tr-ic-puckering",
     "tr-integrate", "tr-irfft", "tr-length", "tr-mean-std", "tr-msd",
-    "tr-msd-fit", "tr-norm", "tr-pca", "tr-pca-geom", "tr-plot", "tr-qh-entropy", "tr-rdf",
+    "tr-msd-fit", "tr-norm", "tr-pca", "tr-pca-geom", "tr-plot", "tr-pyramid",
+    "tr-qh-entropy", "tr-rdf",
     "tr-reduce", "tr-rfft", "tr-select", "tr-select-rings",
     "tr-shortest-distance", "tr-slice", "tr-spectrum", "tr-split-com",
-    "tr-to-txt", "tr-to-xyz", "tr-to-xyz-mode",
+    "tr-to-dcd", "tr-to-npy", "tr-to-txt", "tr-to-xyz", "tr-to-xyz-mode",
+    "tr-transpose",
 ]
 
 for name in names: